@@ -0,0 +1,36 @@
+def test_micro_benchmarks():
+    from corm.bench import run_micro_benchmarks
+
+    results = run_micro_benchmarks(count=100, rounds=1)
+    assert [result.name for result in results] == ['encode.values', 'encode.as_hash', 'decode.row']
+    for result in results:
+        assert result.kind == 'micro'
+        assert result.operations == 100
+        assert result.ops_per_second > 0
+
+def test_decode_row_round_trip():
+    import collections
+
+    from corm import decode_row, register_table
+    from corm.bench import BenchModel, generate_bench_entries
+
+    register_table(BenchModel)
+    entry = generate_bench_entries(1)[0]
+    RawRow = collections.namedtuple('RawRow', BenchModel._corm_details.field_names)
+    decoded = decode_row(BenchModel, RawRow(*entry.values()))
+    assert decoded.as_hash() == entry.as_hash()
+    assert decoded.option is entry.option
+
+def test_macro_benchmarks_in_memory():
+    from corm import set_backend
+    from corm.backends import MemoryBackend
+    from corm.bench import run_macro_benchmarks
+
+    previous = set_backend(MemoryBackend())
+    try:
+        results = run_macro_benchmarks(count=100, rounds=1)
+
+    finally:
+        set_backend(previous)
+
+    assert [result.name for result in results] == ['sync_schema', 'insert.batch', 'insert.concurrent', 'select.scan', 'where.equal']
@@ -0,0 +1,68 @@
+import pytest
+
+def test_limiter_grows_and_backs_off():
+    from corm.concurrency import AdaptiveLimiter
+    from corm.metrics import REGISTRY
+
+    from cassandra import WriteTimeout
+
+    limiter = AdaptiveLimiter('test-aimd', initial=4, minimum=2, maximum=8, target_seconds=0.05)
+    for idx in range(0, 4):
+        assert limiter.acquire(timeout=0) is True
+
+    # Full until a request completes
+    assert limiter.acquire(timeout=0) is False
+    for idx in range(0, 4):
+        limiter.release(0.001)
+
+    # About one more slot per round of healthy completions
+    for idx in range(0, 4):
+        limiter.acquire()
+        limiter.release(0.001)
+
+    assert limiter.limit == 5
+    # Slow successes hold the limit
+    limiter.acquire()
+    limiter.release(1.0)
+    assert limiter.limit == 5
+    for idx in range(0, 3):
+        limiter.acquire()
+        limiter.release(0.001, WriteTimeout('timed out', write_type=0))
+
+    # One back off per target window, however many requests failed in it
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+    assert REGISTRY.gauge('corm_concurrency_limit', limiter='test-aimd') == 2
+    assert 'corm_concurrency_limit{limiter="test-aimd"} 2' in REGISTRY.as_prometheus()
+
+def test_execute_adaptive():
+    import threading
+
+    from corm.concurrency import AdaptiveLimiter, execute_adaptive
+
+    from cassandra.protocol import OverloadedErrorMessage
+
+    class CompletedFuture:
+        def __init__(self, parameters):
+            self.parameters = parameters
+
+        def add_callbacks(self, callback, errback):
+            # Complete from another thread, like the driver's event loop
+            if self.parameters == 'overloaded':
+                threading.Timer(0.01, errback, [OverloadedErrorMessage(0x1001, 'overloaded', {})]).start()
+
+            else:
+                threading.Timer(0.01, callback, [[self.parameters]]).start()
+
+    class Session:
+        def execute_async(self, statement, parameters, execution_profile=None):
+            return CompletedFuture(parameters)
+
+    limiter = AdaptiveLimiter('test-execute', initial=8, minimum=1, maximum=8, target_seconds=10)
+    parameters = [idx for idx in range(0, 20)]
+    parameters[10] = 'overloaded'
+    results = [result for result in execute_adaptive(Session(), [(None, entry) for entry in parameters], 3, limiter)]
+    assert [success for success, result in results] == [idx != 10 for idx in range(0, 20)]
+    assert [result for success, result in results if success] == [[idx] for idx in range(0, 20) if idx != 10]
+    assert limiter.limit < 8
+    assert limiter.in_flight == 0
@@ -139,6 +139,34 @@ def test_set_api():
     four = TestModelSet('four', ['one', 'two', 'three', 'four'])
     insert([one, two, three, four])
 
+def test_typed_collection_api():
+    from corm import register_table, insert, update, sync_schema, select, cp, Operator
+    from corm.models import CORMBase
+    from corm.annotations import Set, List, Dict, Frozen
+
+    class TestModelCollections(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        something: str
+        tags: Set[str]
+        scores: List[int]
+        prices: Dict[str, float]
+        history: Frozen[List[str]]
+
+    register_table(TestModelCollections)
+    sync_schema()
+    insert([TestModelCollections('one', {'a', 'b'}, [1, 2], {'open': 1.5}, ['x'])])
+    entry = [entry for entry in select(TestModelCollections)][0]
+    assert entry.tags == {'a', 'b'}
+    assert entry.scores == [1, 2]
+    assert entry.prices == {'open': 1.5}
+    update(TestModelCollections, where=[cp(Operator.Equal, 'guid', entry.guid)],
+            append={'tags': {'c'}, 'prices': {'close': 2.5}}, remove={'scores': [1]})
+    entry = [entry for entry in select(TestModelCollections)][0]
+    assert entry.tags == {'a', 'b', 'c'}
+    assert entry.scores == [2]
+    assert entry.prices == {'open': 1.5, 'close': 2.5}
+
 def test_select_api():
     import random
 
@@ -113,7 +113,9 @@ def test__convert_data_to_postgresql():
     sql_metadata = generate_sqlalchemy_metadata(psql_info)
     sql_table = generate_sqlalchemy_table(TestModelToPostgreSQL, sql_metadata)
     sync_sqlalchemy_schema(sql_metadata)
-    migrate_data_to_sqlalchemy_table(TestModelToPostgreSQL, sql_table, cassandra_info, psql_info)
+    stats = migrate_data_to_sqlalchemy_table(TestModelToPostgreSQL, sql_table, cassandra_info, psql_info, workers=2)
+    assert stats.rows == 100
+    assert stats.rows_per_second > 0
 
 
 def test__export_to_csv_from_uri():
@@ -146,3 +148,329 @@ def test__export_to_csv_from_uri():
     export_to_csv(TestModelToCSV, csv_filepath, conn_info)
     assert os.stat(csv_filepath).st_size > 0
     os.remove(csv_filepath)
+
+def test__export_to_csv_gzip():
+    import csv
+    import gzip
+    import os
+    import tempfile
+
+    from corm import register_table, insert, sync_schema
+    from corm.etl.datatypes import ExportCompression
+    from corm.etl.utils import export_to_csv
+    from corm.models import CORMBase
+
+    class TestModelToCSVGZip(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        string_data: str
+        float_data: float
+
+    register_table(TestModelToCSVGZip)
+    sync_schema()
+    insert_later = []
+    for idx in range(0, 100):
+        insert_later.append(TestModelToCSVGZip(generate_string(10), random.uniform(0, 1)))
+        if len(insert_later) % 10 == 0:
+            insert(insert_later)
+            insert_later = []
+
+    csv_filepath = f'{tempfile.NamedTemporaryFile().name}.csv.gz'
+    stats = export_to_csv(TestModelToCSVGZip, csv_filepath, compression=ExportCompression.GZip, workers=2, fetch_size=7)
+    assert stats.rows == 100
+    with gzip.open(csv_filepath, 'rt', newline='') as stream:
+        rows = [row for row in csv.reader(stream)]
+
+    assert rows[0] == ['string_data', 'float_data', 'guid']
+    assert len(rows) == 101
+    os.remove(csv_filepath)
+
+def test__csv_pipe():
+    import threading
+
+    from corm.etl.utils import _CSVPipe
+
+    pipe = _CSVPipe(depth=1)
+    def produce():
+        for idx in range(0, 10):
+            pipe.write_rows([[str(idx), 'value,with,commas']])
+
+        pipe.close()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    chunks = []
+    while True:
+        chunk = pipe.read(7)
+        if not chunk:
+            break
+
+        chunks.append(chunk)
+
+    producer.join()
+    lines = ''.join(chunks).splitlines()
+    assert len(lines) == 10
+    assert lines[3] == '3,"value,with,commas"'
+
+def test__checkpoint_resume():
+    import tempfile
+
+    from corm.etl.checkpoint import Checkpoint
+
+    directory = tempfile.mkdtemp()
+    checkpoint = Checkpoint('cassandra-to-csv.mykeyspace.resume', False, directory)
+    token_ranges = checkpoint.token_ranges(8)
+    assert len(token_ranges) == 8
+    checkpoint.mark_complete(token_ranges[0], 10)
+    checkpoint.mark_complete(token_ranges[3], 5)
+
+    resumed = Checkpoint('cassandra-to-csv.mykeyspace.resume', True, directory)
+    assert resumed.token_ranges(2) == token_ranges
+    assert resumed.is_complete(token_ranges[0])
+    assert resumed.is_complete(token_ranges[3])
+    assert not resumed.is_complete(token_ranges[1])
+    assert resumed.completed_rows == 15
+    resumed.require_option('compression', 'gzip')
+    resumed.mark_complete(token_ranges[1], 1)
+
+    # Output of the finished ranges depends on the compression, so a resume has to keep it
+    changed = Checkpoint('cassandra-to-csv.mykeyspace.resume', True, directory)
+    changed.require_option('compression', 'gzip')
+    with pytest.raises(NotImplementedError):
+        changed.require_option('compression', None)
+
+    restarted = Checkpoint('cassandra-to-csv.mykeyspace.resume', False, directory)
+    assert not restarted.is_complete(token_ranges[0])
+    assert restarted.completed_rows == 0
+
+def test__export_to_csv_checkpointed():
+    import csv
+    import os
+    import tempfile
+
+    from corm import register_table, insert, sync_schema
+    from corm.etl.checkpoint import Checkpoint
+    from corm.etl.utils import export_to_csv
+    from corm.models import CORMBase
+
+    class TestModelToCSVCheckpoint(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        string_data: str
+        float_data: float
+
+    register_table(TestModelToCSVCheckpoint)
+    sync_schema()
+    insert([TestModelToCSVCheckpoint(generate_string(10), random.uniform(0, 1)) for idx in range(0, 50)])
+
+    csv_filepath = tempfile.NamedTemporaryFile().name
+    checkpoint = Checkpoint('cassandra-to-csv.mykeyspace.testmodeltocsvcheckpoint', False, tempfile.mkdtemp())
+    stats = export_to_csv(TestModelToCSVCheckpoint, csv_filepath, workers=2, checkpoint=checkpoint)
+    assert stats.rows == 50
+    assert not os.path.exists(f'{csv_filepath}.parts')
+    with open(csv_filepath, 'r', newline='') as stream:
+        rows = [row for row in csv.reader(stream)]
+
+    assert rows[0] == ['string_data', 'float_data', 'guid']
+    assert len(rows) == 51
+    os.remove(csv_filepath)
+
+    # A range recorded as complete without its part file is exported again, not skipped
+    checkpoint = Checkpoint('cassandra-to-csv.mykeyspace.testmodeltocsvcheckpoint', False, tempfile.mkdtemp())
+    token_ranges = checkpoint.token_ranges(4)
+    for token_range in token_ranges:
+        checkpoint.mark_complete(token_range, 0)
+
+    stats = export_to_csv(TestModelToCSVCheckpoint, csv_filepath, workers=2, checkpoint=checkpoint)
+    assert stats.rows == 50
+    with open(csv_filepath, 'r', newline='') as stream:
+        assert len([row for row in csv.reader(stream)]) == 51
+
+    os.remove(csv_filepath)
+
+def test__export_to_parquet():
+    import shutil
+    import tempfile
+
+    from corm import register_table, insert, sync_schema
+    from corm.etl.parquet import export_to_parquet
+    from corm.models import CORMBase
+
+    from datetime import datetime
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    class TestModelToParquet(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        string_data: str
+        float_data: float
+        int_data: int
+        timestamp_data: datetime
+
+    register_table(TestModelToParquet)
+    sync_schema()
+    insert([TestModelToParquet(generate_string(10), random.uniform(0, 1), random.randint(0, 100), datetime.utcnow())
+        for idx in range(0, 50)])
+
+    dirpath = tempfile.mkdtemp()
+    stats = export_to_parquet(TestModelToParquet, dirpath, workers=2, fetch_size=7)
+    assert stats.rows == 50
+    dataset = pq.read_table(dirpath)
+    assert dataset.num_rows == 50
+    assert dataset.schema.field('float_data').type == pa.float64()
+    assert dataset.schema.field('int_data').type == pa.int64()
+    assert dataset.schema.field('timestamp_data').type == pa.timestamp('ms', tz='UTC')
+    shutil.rmtree(dirpath)
+
+def test__load_file_round_trip():
+    import os
+    import tempfile
+
+    from corm import register_table, insert, sync_schema, select, obtain_session
+    from corm.etl.utils import export_to_csv
+    from corm.etl.loader import load_file
+    from corm.models import CORMBase
+
+    from datetime import datetime
+
+    class TestModelLoadFile(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        string_data: str
+        float_data: float
+        int_data: int
+        boolean_data: bool
+        timestamp_data: datetime
+
+    register_table(TestModelLoadFile)
+    sync_schema()
+    insert([TestModelLoadFile(generate_string(10), random.uniform(0, 1), random.randint(0, 100),
+        bool(random.randint(0, 1)), datetime.utcnow()) for idx in range(0, 50)])
+
+    csv_filepath = tempfile.NamedTemporaryFile().name
+    export_to_csv(TestModelLoadFile, csv_filepath, workers=2)
+    obtain_session('mykeyspace').execute(f'TRUNCATE mykeyspace.{TestModelLoadFile._corm_details.table_name}')
+    assert len([entry for entry in select(TestModelLoadFile)]) == 0
+
+    with open(csv_filepath, 'a') as stream:
+        stream.write('bad-row,not-a-float,1,True,2020-01-01T00:00:00,guid\n')
+
+    stats = load_file(TestModelLoadFile, csv_filepath, concurrency=8)
+    assert stats.rows == 50
+    assert stats.errors == 1
+    assert len([entry for entry in select(TestModelLoadFile)]) == 50
+    assert os.path.exists(f'{csv_filepath}.rejects.csv')
+    os.remove(csv_filepath)
+    os.remove(f'{csv_filepath}.rejects.csv')
+
+def test__load_file_udt_round_trip():
+    import os
+    import tempfile
+    import uuid
+
+    from corm import register_table, register_user_defined_type, insert, sync_schema, select, obtain_session
+    from corm.etl.utils import export_to_csv
+    from corm.etl.loader import load_file
+    from corm.models import CORMBase, CORMUDTBase
+
+    class TestUDTLoadFileInner(CORMUDTBase):
+        __keyspace__ = 'mykeyspace'
+
+        label: str
+        seen: datetime
+
+    class TestUDTLoadFileOuter(CORMUDTBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+        count: int
+        ident: uuid.UUID
+        inner: TestUDTLoadFileInner
+
+    class TestModelLoadFileUDT(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        string_data: str
+        udt_data: TestUDTLoadFileOuter
+
+    register_user_defined_type(TestUDTLoadFileInner)
+    register_user_defined_type(TestUDTLoadFileOuter)
+    register_table(TestModelLoadFileUDT)
+    sync_schema()
+    seen = datetime(2020, 1, 2, 3, 4, 5)
+    ident = uuid.uuid4()
+    insert([TestModelLoadFileUDT('one', TestUDTLoadFileOuter('outer', None, ident, TestUDTLoadFileInner('inner', seen)))])
+
+    csv_filepath = tempfile.NamedTemporaryFile().name
+    export_to_csv(TestModelLoadFileUDT, csv_filepath, workers=1)
+    obtain_session('mykeyspace').execute(f'TRUNCATE mykeyspace.{TestModelLoadFileUDT._corm_details.table_name}')
+    stats = load_file(TestModelLoadFileUDT, csv_filepath, concurrency=1)
+    assert (stats.rows, stats.errors) == (1, 0)
+
+    entries = [entry for entry in select(TestModelLoadFileUDT)]
+    assert len(entries) == 1
+    assert (entries[0].udt_data.name, entries[0].udt_data.count, entries[0].udt_data.ident) == ('outer', None, ident)
+    assert entries[0].udt_data.inner.label == 'inner'
+    assert entries[0].udt_data.inner.seen.replace(tzinfo=None) == seen
+    os.remove(csv_filepath)
+
+def test__generate_data():
+    import enum
+    import uuid
+
+    from corm import register_table, sync_schema, select
+    from corm.annotations import Set
+    from corm.etl.factory_testing.models import RandomDataModel
+    from corm.etl.factory_testing.utils import generate_column, generate_data, generate_entries
+    from corm.models import CORMBase
+
+    from datetime import datetime
+
+    class GeneratedOption(enum.Enum):
+        One = 'one'
+        Two = 'two'
+
+    class TestModelGenerated(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        string_data: str
+        int_data: int
+        float_data: float
+        boolean_data: bool
+        timestamp_data: datetime
+        uuid_data: uuid.UUID
+        set_data: Set
+        option_data: GeneratedOption
+
+    register_table(TestModelGenerated)
+    entries = [entry for entry in generate_entries(TestModelGenerated, 25)]
+    assert len(entries) == 25
+    for entry in entries:
+        assert isinstance(entry.string_data, str) and len(entry.string_data) == 10
+        assert isinstance(entry.timestamp_data, datetime)
+        assert isinstance(entry.uuid_data, uuid.UUID)
+        assert entry.option_data in GeneratedOption.__members__.values()
+
+    register_table(RandomDataModel)
+    sync_schema()
+    stats = generate_data('corm.etl.factory_testing.models.RandomDataModel', 250, workers=2, concurrency=16, chunk_size=100)
+    assert stats.rows == 250
+    assert stats.errors == 0
+    assert len([entry for entry in select(RandomDataModel)]) >= 250
+
+def test__generate_data_with_udt():
+    from corm import register_table, register_user_defined_type, sync_schema, select
+    from corm.etl.factory_testing.models import RandomDataUDT, RandomUDTDataModel
+    from corm.etl.factory_testing.utils import generate_data
+
+    register_user_defined_type(RandomDataUDT)
+    register_table(RandomUDTDataModel)
+    sync_schema()
+    # Spawned workers register the UDT themselves before building rows
+    stats = generate_data('corm.etl.factory_testing.models.RandomUDTDataModel', 50, workers=2, concurrency=16, chunk_size=10)
+    assert (stats.rows, stats.errors) == (50, 0)
+    entries = [entry for entry in select(RandomUDTDataModel)]
+    assert len(entries) >= 50
+    assert all([isinstance(entry.random_udt, RandomDataUDT) for entry in entries])
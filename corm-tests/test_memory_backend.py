@@ -0,0 +1,543 @@
+import pytest
+
+@pytest.fixture(scope='function', autouse=True)
+def setup_case(request):
+    from corm import set_backend
+    from corm.backends import MemoryBackend
+
+    previous = set_backend(MemoryBackend())
+    def destroy_case():
+        set_backend(previous)
+
+    request.addfinalizer(destroy_case)
+
+def test_insert_and_select():
+    from corm import register_table, insert, sync_schema, select, keyspace_exists
+    from corm.models import CORMBase
+
+    class TestModelMemory(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        something: str
+        other: str
+
+    register_table(TestModelMemory)
+    assert keyspace_exists('mykeyspace') is False
+    sync_schema()
+    assert keyspace_exists('mykeyspace') is True
+    one = TestModelMemory('one', 'two')
+    two = TestModelMemory('one', 'two')
+    three = TestModelMemory('one', 'three')
+    insert([one, two, three])
+    # Same values, same guid, so the second write replaces the first
+    entries = [entry for entry in select(TestModelMemory, fetch_size=1)]
+    assert sorted([entry.other for entry in entries]) == ['three', 'two']
+
+def test_where_operators():
+    import enum
+
+    from corm import register_table, insert, sync_schema, where, cp, Operator
+    from corm.models import CORMBase
+
+    class OptionMemory(enum.Enum):
+        One = 'one'
+        Two = 'two'
+
+    class TestModelMemoryWhere(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+        score: int
+        option: OptionMemory
+
+    register_table(TestModelMemoryWhere)
+    sync_schema()
+    insert([TestModelMemoryWhere(f'name-{idx}', idx, OptionMemory.One if idx % 2 else OptionMemory.Two) for idx in range(0, 10)])
+    equal = [entry for entry in where(TestModelMemoryWhere, [cp(Operator.Equal, 'name', 'name-3')])]
+    assert [entry.score for entry in equal] == [3]
+    assert equal[0].option is OptionMemory.One
+    within = [entry for entry in where(TestModelMemoryWhere, [cp(Operator.In, 'score', [1, 2, 42])])]
+    assert sorted([entry.score for entry in within]) == [1, 2]
+    ranged = [entry for entry in where(TestModelMemoryWhere, [
+        cp(Operator.GreaterThanOrEqual, 'score', 4),
+        cp(Operator.LessThan, 'score', 8),
+        cp(Operator.Equal, 'option', OptionMemory.Two)])]
+    assert sorted([entry.score for entry in ranged]) == [4, 6]
+    limited = [entry for entry in where(TestModelMemoryWhere, [cp(Operator.GreaterThan, 'score', 0)], limit=3)]
+    assert len(limited) == 3
+
+def test_ordered_table_and_token_scan():
+    from corm import register_table, insert, sync_schema, select, scan
+    from corm.datatypes import TableOrdering
+    from corm.models import CORMBase
+    from corm.utils import split_token_ring
+
+    class TestModelMemoryOrdered(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __primary_keys__ = ['symbol', 'day']
+        __ordered_by_primary_keys__ = TableOrdering.DESC
+
+        symbol: str
+        day: int
+
+    register_table(TestModelMemoryOrdered)
+    sync_schema()
+    insert([TestModelMemoryOrdered(symbol, day) for symbol in ['a', 'b', 'c'] for day in range(0, 4)])
+    entries = [(entry.symbol, entry.day) for entry in select(TestModelMemoryOrdered)]
+    assert len(entries) == 12
+    for symbol in ['a', 'b', 'c']:
+        assert [day for entry_symbol, day in entries if entry_symbol == symbol] == [3, 2, 1, 0]
+
+    scanned = []
+    for token_range in split_token_ring(4):
+        scanned.extend([(entry.symbol, entry.day) for entry in scan(TestModelMemoryOrdered, token_range)])
+
+    assert sorted(scanned) == sorted(entries)
+
+def test_where_cql():
+    from corm import register_table, cp, Operator
+    from corm.backends import CassandraBackend
+    from corm.datatypes import SelectQuery
+    from corm.models import CORMBase
+
+    class TestModelMemoryCQL(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+        score: int
+
+    register_table(TestModelMemoryCQL)
+    query = SelectQuery(TestModelMemoryCQL, ['name', 'score'], [cp(Operator.Equal, 'name', "o'neil"), cp(Operator.In, 'score', [1, 2])], 5)
+    assert CassandraBackend().select_cql(query) == \
+            "SELECT name,score FROM mykeyspace.testmodelmemorycql WHERE name = 'o''neil' AND score IN (1, 2) LIMIT 5 ALLOW FILTERING"
+
+def test_index_and_view_routing():
+    from corm import register_table, insert, sync_schema, where, cp, Operator
+    from corm.backends import CassandraBackend
+    from corm.datatypes import SelectQuery, TableOrdering, IndexKind
+    from corm.models import CORMBase
+
+    class TestModelMemoryRouted(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __primary_keys__ = ['exchange', 'day']
+        __ordered_by_primary_keys__ = TableOrdering.DESC
+        __indexes__ = {'name': IndexKind.Secondary, 'volume': IndexKind.SAI}
+        __views__ = {'by_symbol': ['symbol']}
+
+        exchange: str
+        day: int
+        symbol: str
+        name: str
+        volume: int
+
+    register_table(TestModelMemoryRouted)
+    details = TestModelMemoryRouted._corm_details
+    assert details.indexes[1].as_create_index_cql('mykeyspace', details.table_name) == \
+            "CREATE INDEX IF NOT EXISTS testmodelmemoryrouted_volume_idx ON mykeyspace.testmodelmemoryrouted (volume) USING 'StorageAttachedIndex';"
+    assert details.views[0].as_create_view_cql(details) == \
+            'CREATE MATERIALIZED VIEW IF NOT EXISTS mykeyspace.testmodelmemoryrouted_by_symbol AS ' \
+            'SELECT * FROM mykeyspace.testmodelmemoryrouted WHERE symbol IS NOT NULL AND exchange IS NOT NULL AND day IS NOT NULL ' \
+            'PRIMARY KEY((symbol), exchange, day) WITH CLUSTERING ORDER BY (exchange asc, day desc);'
+
+    def _cql(*compare_functions: cp) -> str:
+        return CassandraBackend().select_cql(SelectQuery(TestModelMemoryRouted, ['symbol'], list(compare_functions)))
+
+    # Partition key and clustering range on the table itself
+    assert _cql(cp(Operator.Equal, 'exchange', 'nyse'), cp(Operator.GreaterThan, 'day', 3)) == \
+            'SELECT symbol FROM mykeyspace.testmodelmemoryrouted WHERE exchange = \'nyse\' AND day > 3'
+    # Non key column served by the view
+    assert _cql(cp(Operator.Equal, 'symbol', 'ACME')) == \
+            'SELECT symbol FROM mykeyspace.testmodelmemoryrouted_by_symbol WHERE symbol = \'ACME\''
+    assert _cql(cp(Operator.Equal, 'symbol', 'ACME'), cp(Operator.Equal, 'exchange', 'nyse'), cp(Operator.LessThan, 'day', 3)).startswith(
+            'SELECT symbol FROM mykeyspace.testmodelmemoryrouted_by_symbol WHERE')
+    # Indexes, one secondary index predicate, any number of storage attached ones
+    assert _cql(cp(Operator.Equal, 'name', 'Acme')) == 'SELECT symbol FROM mykeyspace.testmodelmemoryrouted WHERE name = \'Acme\''
+    assert _cql(cp(Operator.GreaterThan, 'volume', 10), cp(Operator.LessThan, 'volume', 20)) == \
+            'SELECT symbol FROM mykeyspace.testmodelmemoryrouted WHERE volume > 10 AND volume < 20'
+    assert _cql(cp(Operator.Equal, 'name', 'Acme'), cp(Operator.GreaterThan, 'volume', 10)).endswith('ALLOW FILTERING')
+    # Clustering key without its partition still filters
+    assert _cql(cp(Operator.Equal, 'day', 3)).endswith('ALLOW FILTERING')
+
+    sync_schema()
+    insert([TestModelMemoryRouted('nyse', day, 'ACME', 'Acme', day * 10) for day in range(5)])
+    assert [entry.day for entry in where(TestModelMemoryRouted, [cp(Operator.Equal, 'symbol', 'ACME'), cp(Operator.GreaterThan, 'volume', 20)])] == [4, 3]
+
+def test_lookup_tables():
+    from corm import register_table, insert, insert_concurrent, sync_schema, where, cp, Operator, obtain_backend, update, delete, \
+            update_mutation, mutate_concurrent
+    from corm.backends import CassandraBackend
+    from corm.datatypes import SelectQuery
+    from corm.models import CORMBase
+
+    class TestModelMemoryLookup(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __lookups__ = {'by_owner': ['owner']}
+
+        job: str
+        owner: str
+
+    register_table(TestModelMemoryLookup)
+    lookup = TestModelMemoryLookup._corm_details.lookups[0]
+    assert lookup.table_name == 'testmodelmemorylookup_by_owner'
+    assert lookup.partition_keys == ['owner']
+    assert lookup.as_create_table_cql() == 'CREATE TABLE IF NOT EXISTS mykeyspace.testmodelmemorylookup_by_owner (' \
+            'job TEXT,owner TEXT, guid TEXT, PRIMARY KEY((owner), guid)) WITH CLUSTERING ORDER BY (guid asc);'
+    assert CassandraBackend().select_cql(SelectQuery(TestModelMemoryLookup, ['job'], [cp(Operator.Equal, 'owner', 'ada')])) == \
+            "SELECT job FROM mykeyspace.testmodelmemorylookup_by_owner WHERE owner = 'ada'"
+
+    sync_schema()
+    insert([TestModelMemoryLookup('build', 'ada'), TestModelMemoryLookup('orphan', None)])
+    insert_concurrent([TestModelMemoryLookup('deploy', 'ada')])
+    assert sorted([entry.job for entry in where(TestModelMemoryLookup, [cp(Operator.Equal, 'owner', 'ada')])]) == ['build', 'deploy']
+    # Rows missing a lookup key get no lookup row
+    lookup_rows = obtain_backend()._table(lookup).rows.values()
+    assert sorted([row['job'] for row in lookup_rows]) == ['build', 'deploy']
+
+    # Reads by owner go to the lookup table, so it has to follow updates and deletes
+    build, deploy = sorted(where(TestModelMemoryLookup, [cp(Operator.Equal, 'owner', 'ada')]), key=lambda entry: entry.job)
+    build.owner = 'grace'
+    update(build)
+    assert [entry.job for entry in where(TestModelMemoryLookup, [cp(Operator.Equal, 'owner', 'ada')])] == ['deploy']
+    assert [entry.job for entry in where(TestModelMemoryLookup, [cp(Operator.Equal, 'owner', 'grace')])] == ['build']
+    delete(deploy)
+    assert [entry.job for entry in where(TestModelMemoryLookup, [cp(Operator.Equal, 'owner', 'ada')])] == []
+    update(build, set=['owner'], if_=[cp(Operator.Equal, 'owner', 'ada')])
+    assert [entry.job for entry in where(TestModelMemoryLookup, [cp(Operator.Equal, 'owner', 'grace')])] == ['build']
+    mutate_concurrent([update_mutation(TestModelMemoryLookup, set={'owner': None}, where=[cp(Operator.Equal, 'guid', build.guid)])])
+    assert [entry.job for entry in where(TestModelMemoryLookup, [cp(Operator.Equal, 'owner', 'grace')])] == []
+    assert sorted([row['job'] for row in obtain_backend()._table(lookup).rows.values()]) == []
+    insert([TestModelMemoryLookup('review', 'ada')], if_not_exists=True)
+    assert [entry.job for entry in where(TestModelMemoryLookup, [cp(Operator.Equal, 'owner', 'ada')])] == ['review']
+
+def test_page_cursors():
+    from corm import register_table, insert, sync_schema, select, where, cp, Operator
+    from corm.models import CORMBase
+
+    class TestModelMemoryPaged(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+        score: int
+
+    register_table(TestModelMemoryPaged)
+    sync_schema()
+    insert([TestModelMemoryPaged(f'name-{idx}', idx) for idx in range(7)])
+
+    seen = []
+    page = select(TestModelMemoryPaged).page(3)
+    while True:
+        seen.extend([entry.score for entry in page.rows])
+        if page.cursor is None:
+            break
+
+        # A fresh query resumes from the cursor alone
+        assert isinstance(page.cursor, str)
+        page = select(TestModelMemoryPaged).page(3, page.cursor)
+
+    assert sorted(seen) == list(range(7))
+    assert [entry.score for entry in where(TestModelMemoryPaged, [cp(Operator.GreaterThan, 'score', 4)]).page(5).rows] in [[5, 6], [6, 5]]
+    assert where(TestModelMemoryPaged, [cp(Operator.GreaterThan, 'score', 4)]).page(5).cursor is None
+
+def test_aggregate():
+    from corm import register_table, insert, sync_schema, aggregate, cp, Operator
+    from corm.backends import CassandraBackend
+    from corm.datatypes import SelectQuery, TableOrdering
+    from corm.models import CORMBase
+
+    from datetime import datetime, timezone
+
+    class TestModelMemoryAggregate(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __primary_keys__ = ['symbol', 'day']
+        __ordered_by_primary_keys__ = TableOrdering.ASC
+
+        symbol: str
+        day: int
+        price: float
+        stamp: datetime
+
+    register_table(TestModelMemoryAggregate)
+    query = SelectQuery(TestModelMemoryAggregate, ['symbol'], aggregates=[('count', '*'), ('max', 'price')], group_by=['symbol'])
+    assert CassandraBackend().select_cql(query) == 'SELECT symbol,count(*),max(price) FROM mykeyspace.testmodelmemoryaggregate GROUP BY symbol'
+
+    sync_schema()
+    assert aggregate(TestModelMemoryAggregate) == {'count': 0}
+    stamp = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    insert([TestModelMemoryAggregate(symbol, day, float(day), stamp.replace(day=day + 1)) for symbol in ['ACME', 'INIT'] for day in range(4)])
+    assert aggregate(TestModelMemoryAggregate, max='stamp', sum=['price']) == {'count': 8, 'max_stamp': stamp.replace(day=4), 'sum_price': 12.0}
+    assert aggregate(TestModelMemoryAggregate, count=False, min='price', group_by=['symbol'], token_ranges=3) == \
+            {('ACME',): {'min_price': 0.0}, ('INIT',): {'min_price': 0.0}}
+    assert aggregate(TestModelMemoryAggregate, where=[cp(Operator.Equal, 'symbol', 'ACME'), cp(Operator.GreaterThan, 'day', 1)]) == {'count': 2}
+
+def test_estimate_and_partition_profile():
+    from corm import register_table, insert, sync_schema, estimate, profile_partitions
+    from corm.backends import scale_estimate
+    from corm.constants import MIN_TOKEN
+    from corm.datatypes import RangeEstimate, TokenRange, TableOrdering
+    from corm.models import CORMBase
+
+    class TestModelMemoryEstimate(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __primary_keys__ = ['symbol', 'day']
+        __ordered_by_primary_keys__ = TableOrdering.ASC
+
+        symbol: str
+        day: int
+
+    # A node's ranges covering a quarter of the ring, one wrapping around its end
+    quarter = 2 ** 62
+    scaled = scale_estimate([RangeEstimate(TokenRange(0, quarter // 2), 10, 100),
+        RangeEstimate(TokenRange(-MIN_TOKEN - quarter // 4, MIN_TOKEN + quarter // 4), 30, 200)])
+    assert scaled.coverage == 0.25
+    assert (scaled.partitions, scaled.bytes) == (160, 28000)
+
+    register_table(TestModelMemoryEstimate)
+    sync_schema()
+    insert([TestModelMemoryEstimate('ACME', day) for day in range(5)] + [TestModelMemoryEstimate('INIT', 0)])
+    assert estimate(TestModelMemoryEstimate).partitions == 2
+    assert estimate(TestModelMemoryEstimate).bytes > 0
+
+    # Sampling every range sees the whole table
+    profile = profile_partitions(TestModelMemoryEstimate, samples=8, token_ranges=8, top=1)
+    assert (profile.partitions, profile.rows, profile.max_rows, profile.estimated_partitions) == (2, 6, 5, 2)
+    assert profile.widest == [(('ACME',), 5)]
+    assert profile.mean_rows == 3.0
+    for samples, token_ranges in [(0, 8), (8, 0)]:
+        with pytest.raises(NotImplementedError):
+            profile_partitions(TestModelMemoryEstimate, samples=samples, token_ranges=token_ranges)
+
+    assert profile_partitions(TestModelMemoryEstimate, samples=8, token_ranges=8, concurrency=0).rows == 6
+
+def test_conditional_writes():
+    from corm import register_table, insert, update, sync_schema, select, cp, Operator
+    from corm.models import CORMBase
+
+    class TestModelMemoryCAS(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        job: str
+        owner: str
+
+    register_table(TestModelMemoryCAS)
+    sync_schema()
+    results = insert([TestModelMemoryCAS('one', None), TestModelMemoryCAS('two', None)], if_not_exists=True)
+    assert [result.applied for result in results] == [True, True]
+    results = insert([TestModelMemoryCAS('one', None)], if_not_exists=True)
+    assert results[0].applied is False
+    assert results[0].existing['job'] == 'one'
+
+    # Claim a job: only the first worker to see it unowned wins
+    job = [entry for entry in select(TestModelMemoryCAS) if entry.job == 'one'][0]
+    job.owner = 'worker-a'
+    assert update(job, if_=[cp(Operator.Equal, 'owner', None)]).applied is True
+    job.owner = 'worker-b'
+    result = update(job, if_=[cp(Operator.Equal, 'owner', None)])
+    assert result.applied is False
+    assert result.existing == {'owner': 'worker-a'}
+    assert sorted([(entry.job, entry.owner or '') for entry in select(TestModelMemoryCAS)]) == [('one', 'worker-a'), ('two', '')]
+
+def test_update_and_delete():
+    from corm import register_table, insert, update, delete, sync_schema, select, cp, Operator, \
+            update_mutation, delete_mutation, mutate_concurrent, mutate_batch
+    from corm.backends import CassandraBackend
+    from corm.datatypes import TableOrdering
+    from corm.models import CORMBase
+
+    class TestModelMemoryMutation(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __primary_keys__ = ['symbol', 'day']
+        __ordered_by_primary_keys__ = TableOrdering.ASC
+
+        symbol: str
+        day: int
+        price: float
+        note: str
+
+    register_table(TestModelMemoryMutation)
+    sync_schema()
+    insert([TestModelMemoryMutation('a', day, 1.0, 'open') for day in range(0, 4)])
+    mutation = update_mutation(TestModelMemoryMutation, set={'price': 2.0},
+            where=[cp(Operator.Equal, 'symbol', 'a'), cp(Operator.Equal, 'day', 0)])
+    # Only the changed column is written
+    assert CassandraBackend().mutation_statement(mutation) == \
+            ('UPDATE mykeyspace.testmodelmemorymutation SET price = ? WHERE symbol = ? AND day = ?', [2.0, 'a', 0])
+    assert update(TestModelMemoryMutation, set={'price': 2.0}, where=[cp(Operator.Equal, 'symbol', 'a'), cp(Operator.Equal, 'day', 0)]).applied
+    mutate_batch([update_mutation(TestModelMemoryMutation, set={'note': 'closed'},
+            where=[cp(Operator.Equal, 'symbol', 'a'), cp(Operator.Equal, 'day', day)]) for day in [1, 2]])
+    results = mutate_concurrent([delete_mutation(TestModelMemoryMutation, where=[cp(Operator.Equal, 'symbol', 'a'), cp(Operator.Equal, 'day', 3)])])
+    assert [success for success, result in results] == [True]
+    assert [(entry.day, entry.price, entry.note) for entry in select(TestModelMemoryMutation)] == \
+            [(0, 2.0, 'open'), (1, 1.0, 'closed'), (2, 1.0, 'closed')]
+
+    entry = [entry for entry in select(TestModelMemoryMutation)][0]
+    assert delete(entry, if_=[cp(Operator.Equal, 'note', 'closed')]).applied is False
+    assert delete(entry).applied is True
+    assert len([entry for entry in select(TestModelMemoryMutation)]) == 2
+
+def test_insert_leaves_none_unset():
+    from corm import register_table, insert, sync_schema, select, unset_nulls
+    from corm.datatypes import TableOrdering
+    from corm.models import CORMBase
+
+    from cassandra.query import UNSET_VALUE
+
+    class TestModelMemorySparse(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __primary_keys__ = ['symbol', 'day']
+        __ordered_by_primary_keys__ = TableOrdering.ASC
+
+        symbol: str
+        day: int
+        note: str
+
+    assert unset_nulls(['a', None]) == ['a', UNSET_VALUE]
+    register_table(TestModelMemorySparse)
+    sync_schema()
+    insert([TestModelMemorySparse('a', 0, 'kept'), TestModelMemorySparse('a', 1, 'cleared')])
+    insert([TestModelMemorySparse('a', 0, None)])
+    insert([TestModelMemorySparse('a', 1, None)], write_nulls=True)
+    assert [(entry.day, entry.note) for entry in select(TestModelMemorySparse)] == [(0, 'kept'), (1, None)]
+
+def test_typed_collections():
+    import enum
+
+    from corm import register_table, insert, update, sync_schema, select, cp, Operator
+    from corm.annotations import Set, List, Dict, Frozen
+    from corm.backends import CassandraBackend
+    from corm.models import CORMBase
+
+    class ColorMemory(enum.Enum):
+        Red = 'red'
+        Blue = 'blue'
+
+    class TestModelMemoryCollections(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+        tags: Set[int]
+        colors: List[ColorMemory]
+        prices: Dict[str, float]
+        history: Frozen[Set[str]]
+        nested: List[Frozen[Set[int]]]
+
+    register_table(TestModelMemoryCollections)
+    assert TestModelMemoryCollections._corm_details.as_create_table_cql() == \
+            'CREATE TABLE IF NOT EXISTS mykeyspace.testmodelmemorycollections (name TEXT,tags SET<BIGINT>,colors LIST<TEXT>,' \
+            'prices MAP<TEXT, DOUBLE>,history FROZEN<SET<TEXT>>,nested LIST<FROZEN<SET<BIGINT>>>, guid TEXT PRIMARY KEY);'
+    sync_schema()
+    tags = {3, 1, 2}
+    one = TestModelMemoryCollections('one', tags, [ColorMemory.Red], {'open': 1.5}, frozenset(['x']), [frozenset([1])])
+    # Containers of natively encoded elements are handed to the driver as they are
+    assert one.values()[1] is tags
+    assert one.values()[2] == ['red']
+    assert one.as_hash() == TestModelMemoryCollections('one', {2, 3, 1}, [ColorMemory.Red], {'open': 1.5}, frozenset(['x']), [frozenset([1])]).as_hash()
+    insert([one])
+    where = [cp(Operator.Equal, 'guid', one.as_hash())]
+    mutation_kwargs = {'append': {'tags': {4}, 'colors': [ColorMemory.Blue]}, 'remove': {'prices': ['open']}}
+    update(TestModelMemoryCollections, where=where, **mutation_kwargs)
+    entry = [entry for entry in select(TestModelMemoryCollections)][0]
+    assert entry.tags == {1, 2, 3, 4}
+    assert entry.colors == [ColorMemory.Red, ColorMemory.Blue]
+    assert entry.prices is None
+    assert entry.history == frozenset(['x'])
+
+    from corm import update_mutation
+    CQL, parameters = CassandraBackend().mutation_statement(update_mutation(TestModelMemoryCollections, where=where, **mutation_kwargs))
+    assert CQL == 'UPDATE mykeyspace.testmodelmemorycollections SET tags = tags + ?, colors = colors + ?, prices = prices - ? WHERE guid = ?'
+    assert parameters == [{4}, ['blue'], {'open'}, one.as_hash()]
+
+def test_temporal_types():
+    import uuid
+
+    from corm import register_table, insert, sync_schema, select, cql_literal
+    from corm.annotations import TimeUUID
+    from corm.models import CORMBase
+
+    from datetime import date, datetime, time, timedelta, timezone
+
+    class TestModelMemoryTemporal(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        stamp: datetime
+        day: date
+        moment: time
+        event_id: TimeUUID
+
+    register_table(TestModelMemoryTemporal)
+    assert TestModelMemoryTemporal._corm_details.as_create_table_cql() == \
+            'CREATE TABLE IF NOT EXISTS mykeyspace.testmodelmemorytemporal (stamp TIMESTAMP,day DATE,moment TIME,' \
+            'event_id TIMEUUID, guid TEXT PRIMARY KEY);'
+    sync_schema()
+    naive = datetime(2024, 3, 1, 12, 30, 15, 123000)
+    aware = naive.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=-5)))
+    event_id = uuid.uuid1()
+    one = TestModelMemoryTemporal(aware, date(2024, 3, 1), time(12, 30, 15, 250000), event_id)
+    # The same instant hashes the same whatever zone it is expressed in
+    assert one.as_hash() == TestModelMemoryTemporal(naive, date(2024, 3, 1), time(12, 30, 15, 250000), event_id).as_hash()
+    assert cql_literal(naive) == '1709296215123'
+    assert cql_literal(date(2024, 3, 1)) == "'2024-03-01'"
+    insert([one])
+    entry = [entry for entry in select(TestModelMemoryTemporal)][0]
+    assert entry.stamp == aware
+    assert entry.stamp.tzinfo is not None
+    assert entry.day == date(2024, 3, 1)
+    assert entry.moment == time(12, 30, 15, 250000)
+    assert entry.event_id == event_id
+    assert entry.as_hash() == one.as_hash()
+
+    # CORM_LEGACY_DATETIME_HASH keeps the text the guids of older rows were hashed from
+    from corm.encoders import datetime__legacy_python_to_hash
+    assert datetime__legacy_python_to_hash(naive) == datetime__legacy_python_to_hash(aware) == '2024-03-01T12:30:15Z'
+
+def test_nested_udts():
+    import enum
+
+    from corm import register_table, register_user_defined_type, insert, sync_schema, select
+    from corm.annotations import List, Frozen
+    from corm.models import CORMUDTBase, CORMBase
+
+    class UnitMemory(enum.Enum):
+        Metre = 'm'
+        Second = 's'
+
+    class TestUDTMemoryMeasure(CORMUDTBase):
+        __keyspace__ = 'mykeyspace'
+
+        amount: float
+        unit: UnitMemory
+
+    class TestUDTMemoryReading(CORMUDTBase):
+        __keyspace__ = 'mykeyspace'
+
+        label: str
+        measure: TestUDTMemoryMeasure
+
+    class TestModelMemoryUDT(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+        reading: TestUDTMemoryReading
+        history: List[Frozen[TestUDTMemoryReading]]
+
+    register_user_defined_type(TestUDTMemoryMeasure)
+    register_user_defined_type(TestUDTMemoryReading)
+    register_table(TestModelMemoryUDT)
+    assert TestUDTMemoryReading._udt_details.as_create_user_defined_type_cql() == \
+            'CREATE TYPE IF NOT EXISTS mykeyspace.testudtmemoryreading (label TEXT,measure FROZEN<testudtmemorymeasure>);'
+    assert TestModelMemoryUDT._corm_details.as_create_table_cql() == \
+            'CREATE TABLE IF NOT EXISTS mykeyspace.testmodelmemoryudt (name TEXT,reading testudtmemoryreading,' \
+            'history LIST<FROZEN<testudtmemoryreading>>, guid TEXT PRIMARY KEY);'
+    sync_schema()
+    reading = TestUDTMemoryReading('a', TestUDTMemoryMeasure(1.5, UnitMemory.Metre))
+    one = TestModelMemoryUDT('one', reading, [reading, TestUDTMemoryReading('b', None)])
+    # Encoded positionally, the way the driver serialises a UDT from a tuple
+    assert one.values()[1] == ('a', (1.5, 'm'))
+    # The driver builds registered UDTs from keyword arguments
+    assert TestUDTMemoryMeasure(unit=UnitMemory.Second).amount is None
+    insert([one])
+    entry = [entry for entry in select(TestModelMemoryUDT)][0]
+    assert isinstance(entry.reading, TestUDTMemoryReading)
+    assert entry.reading.measure.unit is UnitMemory.Metre
+    assert [item.label for item in entry.history] == ['a', 'b']
+    assert entry.history[1].measure is None
+    assert entry.as_hash() == one.as_hash()
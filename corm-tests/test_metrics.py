@@ -0,0 +1,134 @@
+import pytest
+
+@pytest.fixture(scope='function', autouse=True)
+def setup_case(request):
+    from corm import set_backend
+    from corm.backends import MemoryBackend
+    from corm.metrics import enable_metrics, disable_metrics
+
+    previous = set_backend(MemoryBackend())
+    enable_metrics().reset()
+    def destroy_case():
+        disable_metrics().reset()
+        set_backend(previous)
+
+    request.addfinalizer(destroy_case)
+
+def test_metrics_registry():
+    from corm import register_table, insert, insert_concurrent, sync_schema, select
+    from corm.metrics import REGISTRY
+    from corm.models import CORMBase
+
+    class TestModelMetrics(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+        score: int
+
+    events = []
+    REGISTRY.add_hook(events.append)
+    try:
+        register_table(TestModelMetrics)
+        sync_schema()
+        insert([TestModelMetrics(f'name-{idx}', idx) for idx in range(0, 10)])
+        insert_concurrent([TestModelMetrics(f'other-{idx}', idx) for idx in range(0, 5)])
+        assert len([entry for entry in select(TestModelMetrics, fetch_size=4)]) == 15
+
+    finally:
+        REGISTRY.remove_hook(events.append)
+
+    batch = REGISTRY.operation('testmodelmetrics', 'insert.batch')
+    assert batch.batches == 1 and batch.batch_rows == 10
+    assert REGISTRY.operation('testmodelmetrics', 'insert.concurrent').rows == 5
+    assert REGISTRY.operation('testmodelmetrics', 'select.execute').pages == 1
+    assert REGISTRY.operation('testmodelmetrics', 'select.fetch_page').pages == 3
+    assert REGISTRY.operation('testmodelmetrics', 'select.decode').rows == 15
+    assert events[0].operation == 'insert.batch'
+    exposition = REGISTRY.as_prometheus()
+    assert 'corm_query_seconds_count{table="testmodelmetrics",operation="select.decode"} 15' in exposition
+    assert 'corm_rows_total{table="testmodelmetrics",operation="insert.batch"} 10' in exposition
+
+    def broken_hook(event):
+        raise Exception('exporter down')
+
+    # A failing hook is logged, the query still succeeds and later hooks still run
+    REGISTRY.add_hook(broken_hook)
+    REGISTRY.add_hook(events.append)
+    try:
+        insert([TestModelMetrics('after', 0)])
+    finally:
+        REGISTRY.remove_hook(broken_hook)
+        REGISTRY.remove_hook(events.append)
+
+    assert events[-1].operation == 'insert.batch'
+
+def test_metrics_disabled_and_json_log(tmpdir):
+    import os
+
+    import ujson as json
+
+    from corm import register_table, insert, sync_schema
+    from corm.metrics import REGISTRY, JSONLogHook, disable_metrics, enable_metrics
+    from corm.models import CORMBase
+
+    class TestModelMetricsLog(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+
+    register_table(TestModelMetricsLog)
+    sync_schema()
+    disable_metrics()
+    insert([TestModelMetricsLog('one')])
+    assert REGISTRY.as_dict() == {}
+
+    hook = JSONLogHook(os.path.join(tmpdir, 'events.jsonl'))
+    REGISTRY.add_hook(hook)
+    try:
+        enable_metrics()
+        insert([TestModelMetricsLog('two')])
+
+    finally:
+        REGISTRY.remove_hook(hook)
+        hook.close()
+
+    with open(hook.filepath, 'r') as stream:
+        events = [json.loads(line) for line in stream]
+
+    assert [event['operation'] for event in events] == ['insert.batch']
+    assert events[0]['table_name'] == 'testmodelmetricslog'
+
+def test_slow_query_log(tmpdir):
+    import os
+
+    import ujson as json
+
+    from corm import register_table, insert, sync_schema, where, cp, Operator
+    from corm.models import CORMBase
+    from corm.tracing import SLOW_QUERY_LOG, should_trace
+
+    class TestModelSlowQuery(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+
+    assert should_trace(True) is True
+    assert should_trace(False) is False
+    register_table(TestModelSlowQuery)
+    sync_schema()
+    threshold, filepath = SLOW_QUERY_LOG.threshold, SLOW_QUERY_LOG.filepath
+    SLOW_QUERY_LOG.threshold = 0
+    SLOW_QUERY_LOG.filepath = os.path.join(tmpdir, 'slow.jsonl')
+    try:
+        insert([TestModelSlowQuery('one')], trace=True)
+        assert len([entry for entry in where(TestModelSlowQuery, [cp(Operator.Equal, 'name', 'one')], trace=True)]) == 1
+
+    finally:
+        SLOW_QUERY_LOG.threshold, SLOW_QUERY_LOG.filepath = threshold, filepath
+
+    with open(os.path.join(tmpdir, 'slow.jsonl'), 'r') as stream:
+        entries = [json.loads(line) for line in stream]
+
+    assert [entry['operation'] for entry in entries] == ['insert.batch', 'where.execute']
+    # The memory backend has no coordinator to trace
+    assert entries[1]['trace'] is None
@@ -0,0 +1,105 @@
+import pytest
+
+def test_percentile_speculative_execution():
+    from corm.profiles import PercentileSpeculativeExecutionPolicy
+
+    policy = PercentileSpeculativeExecutionPolicy(90, max_attempts=3, window=100, initial_delay=0.5, minimum_samples=10)
+    assert policy.delay == 0.5
+    for idx in range(0, 100):
+        policy.observe((idx + 1) / 1000)
+
+    assert policy.delay == 0.091
+    # Up to max_attempts speculative executions on top of the first one
+    plan = policy.new_plan('mykeyspace', None)
+    assert [plan.next_execution(None) for idx in range(0, 4)] == [0.091, 0.091, 0.091, -1]
+
+def test_idempotent_retries():
+    from corm.profiles import IdempotentRetryPolicy
+
+    from cassandra.query import SimpleStatement
+
+    policy = IdempotentRetryPolicy()
+    read = SimpleStatement('SELECT name FROM mykeyspace.sometable', is_idempotent=True)
+    counter = SimpleStatement('UPDATE mykeyspace.sometable SET hits = hits + 1 WHERE name = ?')
+    assert policy.on_write_timeout(read, 1, 'SIMPLE', 1, 0, 0) == (policy.RETRY_NEXT_HOST, None)
+    assert policy.on_write_timeout(read, 1, 'SIMPLE', 1, 0, 1)[0] == policy.RETHROW
+    assert policy.on_write_timeout(counter, 1, 'SIMPLE', 1, 0, 0)[0] == policy.RETHROW
+    assert policy.on_request_error(counter, 1, Exception('closed'), 0)[0] == policy.RETHROW
+
+def test_execution_profile_resolution():
+    from corm import register_table, update_mutation, cp, Operator, register_execution_profile
+    from corm.annotations import Set, List
+    from corm.models import CORMBase
+    from corm.profiles import PROFILES, PercentileSpeculativeExecutionPolicy, resolve_profile
+
+    from cassandra.cluster import EXEC_PROFILE_DEFAULT
+
+    class TestModelProfile(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __execution_profile__ = 'test-fast-reads'
+
+        name: str
+        tags: Set[str]
+        history: List[str]
+
+    class TestModelProfileDefault(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+
+    profile = register_execution_profile('test-fast-reads', speculative_percentile=99)
+    try:
+        assert isinstance(profile.speculative_execution_policy, PercentileSpeculativeExecutionPolicy)
+        assert resolve_profile(TestModelProfile) == 'test-fast-reads'
+        assert resolve_profile(TestModelProfile, 'other') == 'other'
+        assert resolve_profile(TestModelProfileDefault) is EXEC_PROFILE_DEFAULT
+        with pytest.raises(NotImplementedError):
+            register_execution_profile('test-invalid', speculative_delay=0.01, speculative_percentile=99)
+
+    finally:
+        del PROFILES['test-fast-reads']
+
+    register_table(TestModelProfile)
+    where = [cp(Operator.Equal, 'guid', 'abc')]
+    assert update_mutation(TestModelProfile, set={'name': 'one'}, where=where).is_idempotent is True
+    assert update_mutation(TestModelProfile, where=where, append={'tags': {'a'}}).is_idempotent is True
+    assert update_mutation(TestModelProfile, where=where, append={'history': ['a']}).is_idempotent is False
+    assert update_mutation(TestModelProfile, set={'name': 'one'}, where=where, if_exists=True).is_idempotent is False
+
+def test_consistency_levels():
+    from corm.datatypes import ConsistencyProfile
+    from corm.models import CORMBase
+    from corm.profiles import CONSISTENCY_PROFILES, resolve_profile, driver_profile, consistency_value
+
+    from cassandra import ConsistencyLevel
+    from cassandra.cluster import EXEC_PROFILE_DEFAULT
+
+    class TestModelConsistency(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __read_consistency__ = 'LOCAL_ONE'
+        __write_consistency__ = ConsistencyLevel.LOCAL_QUORUM
+
+        name: str
+
+    assert consistency_value('local_one') == ConsistencyLevel.LOCAL_ONE
+    with pytest.raises(NotImplementedError):
+        consistency_value('SOME')
+
+    assert resolve_profile(TestModelConsistency) == ConsistencyProfile(EXEC_PROFILE_DEFAULT, ConsistencyLevel.LOCAL_ONE)
+    assert resolve_profile(TestModelConsistency, write=True) == ConsistencyProfile(EXEC_PROFILE_DEFAULT, ConsistencyLevel.LOCAL_QUORUM)
+    analytics = resolve_profile(TestModelConsistency, 'analytics', ConsistencyLevel.ONE)
+    assert analytics == ConsistencyProfile('analytics', ConsistencyLevel.ONE)
+
+    class Session:
+        clones = 0
+        def execution_profile_clone_update(self, execution_profile, consistency_level):
+            self.clones += 1
+            return (execution_profile, consistency_level)
+
+    session = Session()
+    assert driver_profile(session, 'analytics') == 'analytics'
+    assert driver_profile(session, analytics) == ('analytics', ConsistencyLevel.ONE)
+    # Cloned once, then reused
+    assert driver_profile(session, analytics) == ('analytics', ConsistencyLevel.ONE)
+    assert session.clones == 1
+    del CONSISTENCY_PROFILES[analytics]
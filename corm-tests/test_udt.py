@@ -18,7 +18,7 @@ def setup_case(request):
     request.addfinalizer(destroy_case)
 
 def test_udt():
-    from corm import register_table, register_user_defined_type, sync_schema, insert
+    from corm import register_table, register_user_defined_type, sync_schema, insert, select
     from corm.models import CORMUDTBase, CORMBase
 
     class TestUDTDatum(CORMUDTBase):
@@ -40,4 +40,6 @@ def test_udt():
     one = TestUDTModel('one', 'two', TestUDTDatum('no', 'yes'))
     two = TestUDTModel('one', 'three', TestUDTDatum('yes', 'no'))
     insert([one, two])
-
+    entries = sorted([entry for entry in select(TestUDTModel)], key=lambda entry: entry.other)
+    assert [entry.udt_datum.alpha for entry in entries] == ['yes', 'no']
+    assert isinstance(entries[0].udt_datum, TestUDTDatum)
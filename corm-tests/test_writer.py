@@ -0,0 +1,106 @@
+import pytest
+
+@pytest.fixture(scope='function', autouse=True)
+def setup_case(request):
+    from corm import set_backend
+    from corm.backends import MemoryBackend
+
+    previous = set_backend(MemoryBackend())
+    def destroy_case():
+        set_backend(previous)
+
+    request.addfinalizer(destroy_case)
+
+def test_writer_coalesces_and_flushes():
+    from corm import register_table, sync_schema, select, Writer
+    from corm.datatypes import TableOrdering
+    from corm.models import CORMBase
+
+    class TestModelWriter(CORMBase):
+        __keyspace__ = 'mykeyspace'
+        __primary_keys__ = ['symbol', 'day']
+        __ordered_by_primary_keys__ = TableOrdering.ASC
+
+        symbol: str
+        day: int
+        price: float
+        note: str
+
+    register_table(TestModelWriter)
+    sync_schema()
+    writer = Writer(flush_rows=100, flush_seconds=60)
+    writer.put(TestModelWriter('a', 0, 1.0, 'open'))
+    # Same primary key, so the two writes coalesce and the unset note keeps its earlier value
+    writer.put(TestModelWriter('a', 0, 2.0, None))
+    writer.put(TestModelWriter('b', 0, 3.0, 'open'))
+    assert [entry for entry in select(TestModelWriter)] == []
+    assert writer.flush(timeout=5) is True
+    assert sorted([(entry.symbol, entry.price, entry.note) for entry in select(TestModelWriter)]) == \
+            [('a', 2.0, 'open'), ('b', 3.0, 'open')]
+    assert writer.written == 2
+    assert writer.close(timeout=5) is True
+    with pytest.raises(Exception):
+        writer.put(TestModelWriter('c', 0, 1.0, None))
+
+def test_writer_backpressure_and_failures():
+    import queue
+    import threading
+
+    from corm import register_table, sync_schema, obtain_backend, Writer
+    from corm.models import CORMBase
+
+    class TestModelWriterFailure(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+
+    register_table(TestModelWriterFailure)
+    sync_schema()
+    release = threading.Event()
+    backend = obtain_backend()
+    def blocked_insert_concurrent(table, rows, concurrency, execution_profile=None):
+        release.wait(5)
+        raise Exception('unavailable')
+
+    backend.insert_concurrent = blocked_insert_concurrent
+    failed = []
+    with Writer(max_pending=2, flush_rows=1, flush_seconds=60, on_failure=lambda corm_object, error: failed.append(corm_object.name)) as writer:
+        writer.put(TestModelWriterFailure('one'))
+        writer.put(TestModelWriterFailure('two'))
+        # Both rows are queued or in flight, so a third has to wait for room
+        with pytest.raises(queue.Full):
+            writer.put(TestModelWriterFailure('three'), timeout=0.1)
+
+        release.set()
+        assert writer.flush(timeout=5) is True
+
+    assert sorted(failed) == ['one', 'two']
+    assert writer.failures == 2
+
+def test_writer_survives_errors(monkeypatch):
+    import corm
+
+    from corm import register_table, sync_schema, select, Writer
+    from corm.models import CORMBase
+
+    class TestModelWriterBroken(CORMBase):
+        __keyspace__ = 'mykeyspace'
+
+        name: str
+
+    register_table(TestModelWriterBroken)
+    sync_schema()
+    def broken_observe_query(*args, **kwargs):
+        raise Exception('exporter down')
+
+    # A metrics hook raising after the rows are written leaves them written and the thread running
+    monkeypatch.setattr(corm, '_observe_query', broken_observe_query)
+    with Writer(flush_rows=1, flush_seconds=60) as writer:
+        writer.put(TestModelWriterBroken('one'))
+        assert writer.flush(timeout=5) is True
+        writer.put(TestModelWriterBroken('two'))
+        assert writer.flush(timeout=5) is True
+
+    monkeypatch.undo()
+    assert sorted([entry.name for entry in select(TestModelWriterBroken)]) == ['one', 'two']
+    assert (writer.written, writer.failures) == (2, 0)
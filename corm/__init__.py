@@ -1,30 +1,75 @@
+import base64
+import binascii
+import collections
 import enum
 import logging
+import random
+import threading
+import time
+import types
 import typing
+import uuid
 
-from corm.constants import CLUSTER_IPS, CLUSTER_PORT, PWN
-from corm.annotations import Set
+from corm.constants import CLUSTER_IPS, CLUSTER_PORT, CORM_BACKEND, ENCODING, PWN
+from corm.annotations import CollectionType, Set, List, Dict, Frozen, TimeUUID
 from corm.auth import AuthProvider
-from corm.encoders import DT_MAP, UDT_MAP, setup_udt_transliterator
+from corm.backends import Backend, CassandraBackend, MemoryBackend
+from corm.concurrency import LIMITER
+from corm.metrics import REGISTRY, record_query
+from corm.profiles import PROFILES, register_execution_profile, resolve_profile
+from corm.tracing import SLOW_QUERY_LOG, should_trace
+from corm.utils import split_token_ring
+from corm.writer import Writer
+from corm.encoders import setup_udt_transliterator, obtain_transliterator, udt_field_transliterator, datetime__python_to_hash
 from corm.models import CORMBase, CORMUDTBase
-from corm.datatypes import CORMDetails, CassandraKeyspaceStrategy, TableOrdering, CORMUDTDetails, EnumTransliterator
+from corm.datatypes import CORMDetails, CassandraKeyspaceStrategy, TableOrdering, CORMUDTDetails, \
+        TokenRange, SelectQuery, Mutation, CASResult, MutationKind, IndexKind, IndexDetails, ViewDetails, Page, \
+        TableEstimate, PartitionProfile
 
 from cassandra.cluster import Cluster
-from cassandra.query import BatchStatement, SimpleStatement
+from cassandra.concurrent import ExecutionResult
+from cassandra.query import PreparedStatement, UNSET_VALUE
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time as time_of_day
 
 UDT_TYPES = {}
 TABLES = {}
 SESSIONS = {}
-if AuthProvider:
-    CLUSTER = Cluster(CLUSTER_IPS, port=CLUSTER_PORT, auth_provider=AuthProvider)
-else:
-    CLUSTER = Cluster(CLUSTER_IPS, port=CLUSTER_PORT)
-
-SESSIONS['global'] = CLUSTER.connect()
+PREPARED_STATEMENTS = {}
+CLUSTER = None
+BACKEND = None
 RESERVED_KEYSPACE_NAMES = ['global']
+# Guards creating CLUSTER and SESSIONS, which worker threads may ask for at once. Re-entrant, since creating
+# a keyspace's session may create the global one
+CONNECTION_LOCK = threading.RLock()
 
 logger = logging.getLogger(__name__)
 
+def obtain_cluster() -> Cluster:
+    global CLUSTER
+    if CLUSTER is None:
+        with CONNECTION_LOCK:
+            if CLUSTER is None:
+                if len(CLUSTER_IPS) < 1:
+                    raise NotImplementedError('CLUSTER_IPS ENVVar required')
+
+                # Profiles registered later are added to the running Cluster by register_execution_profile
+                if AuthProvider:
+                    CLUSTER = Cluster(CLUSTER_IPS, port=CLUSTER_PORT, auth_provider=AuthProvider, execution_profiles=dict(PROFILES))
+                else:
+                    CLUSTER = Cluster(CLUSTER_IPS, port=CLUSTER_PORT, execution_profiles=dict(PROFILES))
+
+    return CLUSTER
+
+def obtain_global_session() -> 'SESSIONS["global"]':
+    if not 'global' in SESSIONS.keys():
+        with CONNECTION_LOCK:
+            if not 'global' in SESSIONS.keys():
+                SESSIONS['global'] = obtain_cluster().connect()
+
+    return SESSIONS['global']
+
 def obtain_session(keyspace_name: str, auto_create_keyspace: bool = False) -> 'SESSIONS[keyspace_name]':
     if keyspace_name in RESERVED_KEYSPACE_NAMES:
         raise NotImplementedError(f'Unable to request Keyspace Name[{keyspace_name}]')
@@ -32,49 +77,57 @@ def obtain_session(keyspace_name: str, auto_create_keyspace: bool = False) -> 'S
     if keyspace_name in SESSIONS.keys():
         return SESSIONS[keyspace_name]
 
-    try:
-        SESSIONS[keyspace_name] = CLUSTER.connect(keyspace_name)
-    except Exception as err:
-        if auto_create_keyspace:
-            keyspace_create(keyspace_name, CassandraKeyspaceStrategy.Simple)
-            SESSIONS[keyspace_name] = CLUSTER.connect(keyspace_name)
+    with CONNECTION_LOCK:
+        if keyspace_name in SESSIONS.keys():
+            return SESSIONS[keyspace_name]
 
-        else:
-            raise err
+        try:
+            SESSIONS[keyspace_name] = obtain_cluster().connect(keyspace_name)
+        except Exception as err:
+            if auto_create_keyspace:
+                keyspace_create(keyspace_name, CassandraKeyspaceStrategy.Simple)
+                SESSIONS[keyspace_name] = obtain_cluster().connect(keyspace_name)
+
+            else:
+                raise err
 
     return SESSIONS[keyspace_name]
 
-def keyspace_exists(keyspace_name: str) -> None:
-    CQL = f"""SELECT
-    keyspace_name,
-    durable_writes,
-    replication
-FROM system_schema.keyspaces
-WHERE keyspace_name = '{keyspace_name}';"""
+def obtain_backend() -> Backend:
+    global BACKEND
+    if BACKEND is None:
+        if CORM_BACKEND == 'memory':
+            BACKEND = MemoryBackend()
 
-    rows = [row for row in SESSIONS['global'].execute(CQL)]
-    if len(rows) == 0:
-        return False
+        elif CORM_BACKEND == 'cassandra':
+            BACKEND = CassandraBackend()
 
-    return True
+        else:
+            raise NotImplementedError(f'Unknown CORM_BACKEND[{CORM_BACKEND}]')
 
-def keyspace_create(keyspace_name: str, strategy: CassandraKeyspaceStrategy) -> None:
-    if strategy is CassandraKeyspaceStrategy.Simple:
-        CQL = "CREATE KEYSPACE %s WITH REPLICATION = {'class': 'SimpleStrategy', 'replication_factor': 3};" % keyspace_name
-    else:
-        raise NotImplementedError
+    return BACKEND
 
-    SESSIONS['global'].execute(CQL)
+def set_backend(backend: Backend) -> Backend:
+    """
+    Swaps the backend behind every corm call, returning the previous one. Tests and profiles install a
+    MemoryBackend here to run without a cluster
+    """
+    global BACKEND
+    previous = BACKEND
+    BACKEND = backend
+    return previous
+
+def keyspace_exists(keyspace_name: str) -> bool:
+    return obtain_backend().keyspace_exists(keyspace_name)
+
+def keyspace_create(keyspace_name: str, strategy: CassandraKeyspaceStrategy) -> None:
+    obtain_backend().keyspace_create(keyspace_name, strategy)
 
 def keyspace_destroy(keyspace_name: str) -> None:
-    CQL = "DROP KEYSPACE IF EXISTS %s" % keyspace_name
-    SESSIONS['global'].execute(CQL)
+    obtain_backend().keyspace_destroy(keyspace_name)
 
 def annihilate_keyspace_tables(keyspace_name: str) -> None:
-    FIND_TABLES_CQL = "SELECT table_name FROM system_schema.tables WHERE keyspace_name='{keyspace_name}';"
-    for row in SESSIONS['global'].execute(FIND_TABLES_CQL):
-        cql = f'DROP TABLE IF EXISTS {keyspace_name}.{row.table_name};'
-        SESSIONS['global'].execute(cql)
+    obtain_backend().annihilate_keyspace_tables(keyspace_name)
 
 def register_user_defined_type(udt: CORMUDTBase) -> None:
     keyspace = getattr(udt, '__keyspace__', None)
@@ -85,7 +138,7 @@ def register_user_defined_type(udt: CORMUDTBase) -> None:
     field_transliterators = []
     for field_name, annotation in udt.__annotations__.items():
         field_names.append(field_name)
-        field_transliterators.append(DT_MAP[annotation])
+        field_transliterators.append(udt_field_transliterator(annotation))
 
     udt_details = CORMUDTDetails(
             udt.__keyspace__,
@@ -107,22 +160,7 @@ def register_table(table: typing.NamedTuple) -> None:
     field_transliterators = []
     for field_name, annotation in table.__annotations__.items():
         field_names.append(field_name)
-        try:
-            transliterator = DT_MAP[annotation]
-        except KeyError:
-            if isinstance(annotation, Set):
-                import pdb; pdb.set_trace()
-                pass
-
-            elif issubclass(annotation, enum.Enum):
-                transliterator = EnumTransliterator(annotation)
-
-            else:
-                transliterator = UDT_MAP.get(annotation, None)
-                if transliterator is None:
-                    raise NotImplementedError
-
-        field_transliterators.append(transliterator)
+        field_transliterators.append(obtain_transliterator(annotation))
 
     pk_fields = getattr(table, '__primary_keys__', [])[:] or field_names[:]
     for pk_field in pk_fields:
@@ -140,208 +178,667 @@ def register_table(table: typing.NamedTuple) -> None:
         pk_fields,
         ordered_by_primary_keys)
 
+    # __indexes__ lists field names, or maps them to an IndexKind
+    indexes = getattr(table, '__indexes__', [])
+    if not isinstance(indexes, dict):
+        indexes = {field_name: IndexKind.Secondary for field_name in indexes}
+
+    for field_name in indexes.keys():
+        if not field_name in field_names:
+            raise NotImplementedError(f'Index Field[{field_name}] not in Table[{table.__class__}]')
+
+    # __views__ maps a view name to the fields partitioning it
+    views = []
+    for view_name, view_partition_keys in getattr(table, '__views__', {}).items():
+        for field_name in view_partition_keys:
+            if not field_name in field_names:
+                raise NotImplementedError(f'View[{view_name}] Field[{field_name}] not in Table[{table.__class__}]')
+
+        clustering_keys = [key for key in corm_details.primary_keys if not key in view_partition_keys]
+        if len([key for key in view_partition_keys if not key in corm_details.primary_keys]) > 1:
+            raise NotImplementedError(f'View[{view_name}] may only add one non primary key Field to its key')
+
+        views.append(ViewDetails(f'{corm_details.table_name}_{view_name}', list(view_partition_keys), clustering_keys))
+
+    # __lookups__ maps a lookup table name to the fields partitioning it, written by corm next to the table
+    lookups = []
+    for lookup_name, lookup_partition_keys in getattr(table, '__lookups__', {}).items():
+        if lookup_name in getattr(table, '__views__', {}).keys():
+            raise NotImplementedError(f'Lookup[{lookup_name}] has the same name as a View')
+
+        for field_name in lookup_partition_keys:
+            if not field_name in field_names:
+                raise NotImplementedError(f'Lookup[{lookup_name}] Field[{field_name}] not in Table[{table.__class__}]')
+
+        # Keyed by the table's primary keys too, so every row of the table keeps its own lookup row
+        clustering_keys = [key for key in corm_details.primary_keys if not key in lookup_partition_keys]
+        lookups.append(corm_details._replace(
+            table_name=f'{corm_details.table_name}_{lookup_name}',
+            pk_fields=list(lookup_partition_keys) + clustering_keys,
+            ordered_by_primary_keys=TableOrdering.ASC if ordered_by_primary_keys is TableOrdering.Nope else ordered_by_primary_keys,
+            clustering_keys=clustering_keys))
+
+    corm_details = corm_details._replace(
+        indexes=[IndexDetails(field_name, IndexKind(kind)) for field_name, kind in indexes.items()],
+        views=views,
+        lookups=lookups)
+
     TABLES[corm_details.table_name] = corm_details
     table._corm_details = corm_details
 
 def sync_schema() -> None:
-    """
-    https://docs.datastax.com/en/dse/5.1/cql/cql/cql_using/useQuerySystemTable.html
-    """
-    # Sync User Defined Types, then tables
-    keyspace_udts = {}
-    for udt_name, udt in UDT_TYPES.items():
-        udts = keyspace_udts.get(udt._udt_details.keyspace, [])
-        udts.append(udt)
-        keyspace_udts[udt._udt_details.keyspace] = udts
-
-    for udt_idx, (udt_keyspace_name, udts) in enumerate(keyspace_udts.items()):
-        if keyspace_exists(udt_keyspace_name) is False:
-            keyspace_create(udt_keyspace_name, True)
-
-        session = obtain_session(udt_keyspace_name, True)
-        for user_defined_type in udts:
-            session.execute(user_defined_type._udt_details.as_create_user_defined_type_cql())
-            CLUSTER.register_user_type(user_defined_type._udt_details.keyspace, udt._udt_details.udt_key, user_defined_type)
-
-            # (CLUSTER, udt)
-
-    # Create or Update Tables
-    keyspace_tables = {}
-    for table_name, table in TABLES.items():
-        tables = keyspace_tables.get(table.keyspace, [])
-        tables.append(table)
-        keyspace_tables[table.keyspace] = tables
-
-
-    for idx, (keyspace_name, tables) in enumerate(keyspace_tables.items()):
-        if keyspace_exists(keyspace_name) is False:
-            keyspace_create(keyspace_name, CassandraKeyspaceStrategy.Simple)
-
-        session = obtain_session(keyspace_name, True)
-        for table in tables:
-            COLUMN_CQL = f'''
-            SELECT
-                column_name, type
-            FROM
-                system_schema.columns
-            WHERE table_name = ?
-                AND keyspace_name = ?'''
-            stmt = obtain_session(keyspace_name).prepare(COLUMN_CQL)
-            existing_columns = {r.column_name: r.type for r in obtain_session(keyspace_name).execute(stmt, [table.table_name, keyspace_name])}
-
-            # Add Whole Table
-            if len(existing_columns.keys()) == 0:
-                logger.info(f'Creating Table[{table.table_name}] in Keyspace[{table.keyspace}]')
-                session.execute(table.as_create_table_cql())
-
-            # Add Columns
-            elif len(table.field_names) > len(existing_columns.keys()) - 1:
-                column_updates = {}
-                for field_idx, field_name in enumerate(table.field_names):
-                    field_transliterator = table.field_transliterators[field_idx]
-                    if field_name in existing_columns.keys():
-                        if field_transliterator.cql_type.lower() != existing_columns[field_name].lower():
-                            raise NotImplementedError
-
-                    else:
-                        column_updates[field_name] = field_transliterator.cql_type
-
-                formatted_column_names = ', '.join(sorted(column_updates.keys()))
-                formatted_column_definitions = ',\n'.join([' '.join([c_name, c_type]) for c_name, c_type in column_updates.items()])
-                logger.info(f'Altering Table[{table.table_name}]. Adding Columns[{formatted_column_names}]')
-                ALTER_CQL = f'''
-ALTER TABLE
-    {keyspace_name}.{table.table_name}
-ADD ({formatted_column_definitions})
-'''
-                obtain_session(keyspace_name).execute(ALTER_CQL)
-
-            # Delete Columns
-            elif len(table.field_names) < len(existing_columns.keys()) - 1:
-                columns_to_be_removed = [key for key in existing_columns.keys() if not key in table.field_names and key != 'guid']
-                formatted_column_names = ', '.join(sorted(columns_to_be_removed))
-                ALTER_CQL = f'''
-ALTER TABLE
-    {keyspace_name}.{table.table_name}
-DROP ({formatted_column_names})
-'''
-                obtain_session(keyspace_name).execute(ALTER_CQL)
-
-def insert(corm_objects: typing.List[typing.Any]) -> None:
-    keyspace = corm_objects[0]._corm_details.keyspace
-    table_name = corm_objects[0]._corm_details.table_name
-    field_names = corm_objects[0]._corm_details.field_names[:]
-    instance_type = corm_objects[0].__class__
+    tables = [table for table in TABLES.values()]
+    tables.extend([lookup for table in TABLES.values() for lookup in table.lookups])
+    obtain_backend().sync_schema([udt for udt in UDT_TYPES.values()], tables)
+
+def obtain_prepared_statement(keyspace_name: str, cql: str) -> PreparedStatement:
+    key = (keyspace_name, cql)
+    if key not in PREPARED_STATEMENTS.keys():
+        started = time.perf_counter()
+        PREPARED_STATEMENTS[key] = obtain_session(keyspace_name, True).prepare(cql)
+        if REGISTRY.enabled:
+            record_query(keyspace_name, 'prepare', started)
+
+    return PREPARED_STATEMENTS[key]
+
+def insert_statement(table: CORMDetails) -> PreparedStatement:
+    field_names = table.field_names[:]
     field_names.append('guid')
     formatted_field_names = ','.join(field_names)
     formatted_question_marks = ','.join(['?' for idx in range(0, len(field_names))])
-    CQL = f'INSERT INTO {keyspace}.{table_name} ({formatted_field_names}) VALUES ({formatted_question_marks})'
-    prepared_statement = obtain_session(keyspace, True).prepare(CQL)
-    cql_batch = BatchStatement()
+    CQL = f'INSERT INTO {table.keyspace}.{table.table_name} ({formatted_field_names}) VALUES ({formatted_question_marks})'
+    prepared_statement = obtain_prepared_statement(table.keyspace, CQL)
+    # The guid is derived from the values, so a retried insert rewrites the same row
+    prepared_statement.is_idempotent = True
+    return prepared_statement
+
+def unset_nulls(v_set: typing.List[typing.Any]) -> typing.List[typing.Any]:
+    """
+    Binds UNSET_VALUE in place of None. Unset columns are left alone, where a bound null writes a cell
+    tombstone. Requires native protocol v4 or later
+    """
+    return [UNSET_VALUE if value is None else value for value in v_set]
+
+def _bind_values(corm_objects: typing.List[typing.Any], write_nulls: bool = True) -> typing.List[typing.List[typing.Any]]:
+    instance_type = corm_objects[0].__class__
+    bind_values = []
     for corm_object in corm_objects:
         if corm_object.__class__ != instance_type:
             raise Exception('All corm_objects must be the same type')
 
         v_set = corm_object.values()
         v_set.append(corm_object.as_hash())
-        cql_batch.add(prepared_statement, v_set)
+        bind_values.append(v_set if write_nulls else unset_nulls(v_set))
 
-    obtain_session(keyspace).execute(cql_batch)
+    return bind_values
+
+def _observe_query(table_name: str, operation: str, started: float, result: typing.Any = None, traced: bool = False, **counts) -> None:
+    if REGISTRY.enabled:
+        record_query(table_name, operation, started, result=result, **counts)
+
+    SLOW_QUERY_LOG.capture(table_name, operation, time.perf_counter() - started, result, traced)
+
+def _row_values(corm_object: CORMBase, write_nulls: bool = True) -> typing.Dict[str, typing.Any]:
+    v_set = corm_object.values()
+    values = dict(zip(corm_object._corm_details.field_names, v_set if write_nulls else unset_nulls(v_set)))
+    values['guid'] = getattr(corm_object, 'guid', None) or corm_object.as_hash()
+    return values
+
+def insert(corm_objects: typing.List[typing.Any], trace: bool = None, if_not_exists: bool = False,
+        concurrency: int = 100, write_nulls: bool = False, execution_profile: str = None,
+        consistency_level: typing.Any = None) -> typing.Optional[typing.List[CASResult]]:
+    """
+    Writes the objects in one batch and returns None. With if_not_exists each object becomes its own
+    lightweight transaction and one CASResult per object is returned, in order. None fields are left unset rather
+    than written as null, pass write_nulls=True when an explicit null is meant. execution_profile names a
+    profile from register_execution_profile and consistency_level overrides the model's __write_consistency__.
+    Naive datetimes are written as UTC and select returns timezone aware UTC datetimes. Guids hash timestamps
+    as epoch milliseconds, so rows of unordered tables written with the older text encoding are duplicated
+    when re-inserted, unless CORM_LEGACY_DATETIME_HASH is set.
+    Rows are written to the model's __lookups__ tables in the same batch. Inserting over an existing row doesn't
+    remove the lookup rows of its old values, use update for rows whose lookup fields change
+    """
+    if if_not_exists:
+        if len(set([corm_object.__class__ for corm_object in corm_objects])) > 1:
+            raise Exception('All corm_objects must be the same type')
+
+        # The backend writes the lookup rows of the applied ones
+        return execute_cas([Mutation(MutationKind.Insert, corm_object.__class__, _row_values(corm_object, write_nulls), if_not_exists=True)
+            for corm_object in corm_objects], concurrency)
+
+    started = time.perf_counter()
+    table = corm_objects[0]._corm_details
+    traced = should_trace(trace)
+    result = obtain_backend().insert(table, _bind_values(corm_objects, write_nulls), traced,
+        resolve_profile(corm_objects[0], execution_profile, consistency_level, write=True))
+    _observe_query(table.table_name, 'insert.batch', started, result, traced, rows=len(corm_objects), batch_size=len(corm_objects))
+
+def insert_concurrent(corm_objects: typing.List[typing.Any], concurrency: int = 100, write_nulls: bool = False,
+        execution_profile: str = None, consistency_level: typing.Any = None) -> typing.List[ExecutionResult]:
+    """
+    Writes each object with its own prepared execution, keeping at most concurrency requests in flight.
+    Unlike insert, rows may span partitions without paying for a multi-partition batch. Returns one
+    (success, result_or_exc) pair per object, in order
+    """
+    started = time.perf_counter()
+    table = corm_objects[0]._corm_details
+    results = obtain_backend().insert_concurrent(table, _bind_values(corm_objects, write_nulls), concurrency,
+        resolve_profile(corm_objects[0], execution_profile, consistency_level, write=True))
+    if REGISTRY.enabled:
+        errors = len([success for success, result in results if not success])
+        record_query(table.table_name, 'insert.concurrent', started, rows=len(results) - errors, errors=errors)
+
+    return results
+
+def _encode_field_values(table: CORMBase, field_values: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    values = {}
+    for field_name, value in field_values.items():
+        if not field_name in table._corm_details.field_names:
+            raise NotImplementedError(f'Field[{field_name}] not in Table[{table._corm_details.table_name}]')
+
+        transliterator = table._corm_details.field_transliterators[table._corm_details.field_names.index(field_name)]
+        if value is None or transliterator.values_encode_exemption:
+            values[field_name] = value
+
+        else:
+            values[field_name] = transliterator.python_to_cql(value)
+
+    return values
+
+def _key_values(table: CORMBase, where: typing.List['cp']) -> typing.Dict[str, typing.Any]:
+    primary_keys = table._corm_details.primary_keys
+    values = {}
+    for cp_func in where:
+        if not cp_func.operator is Operator.Equal or not cp_func.field_name in primary_keys:
+            raise NotImplementedError(f'Mutations are addressed with Operator.Equal on PrimaryKeys[{primary_keys}], not Field[{cp_func.field_name}]')
+
+        values[cp_func.field_name] = cp_func.bound_values(table)[0]
+
+    missing_keys = [key for key in primary_keys if not key in values.keys()]
+    if missing_keys:
+        formatted_missing_keys = ', '.join(missing_keys)
+        raise NotImplementedError(f'Missing PrimaryKeys[{formatted_missing_keys}]')
+
+    return values
+
+def _encode_collection_change(table: CORMBase, field_name: str, value: typing.Any, removing: bool) -> typing.Any:
+    if not field_name in table._corm_details.field_names:
+        raise NotImplementedError(f'Field[{field_name}] not in Table[{table._corm_details.table_name}]')
+
+    transliterator = table._corm_details.field_transliterators[table._corm_details.field_names.index(field_name)]
+    collection_type = transliterator.python_type
+    if not isinstance(collection_type, CollectionType) or collection_type.frozen:
+        raise NotImplementedError(f'Field[{field_name}] is not a non-frozen collection, append and remove are unavailable')
+
+    if removing and collection_type.container is Dict:
+        # Map entries are removed by key
+        key_transliterator = obtain_transliterator(collection_type.arguments[0])
+        return {key_transliterator.python_to_cql(key) for key in value}
+
+    return transliterator.python_to_cql(value)
+
+def update_mutation(target: typing.Any, set: typing.Dict[str, typing.Any] = None, where: typing.List['cp'] = [],
+        if_: typing.List['cp'] = [], if_exists: bool = False, append: typing.Dict[str, typing.Any] = {},
+        remove: typing.Dict[str, typing.Any] = {}) -> Mutation:
+    """
+    Either a model object, written to its own row, optionally limited to the field names in set, or a
+    model class with set={field_name: value} and where=[cp(Operator.Equal, key, value)] for every primary key.
+    append and remove add or drop elements of Set, List and Dict columns without rewriting them; map
+    entries are removed by key. However they run, mutations of models with __lookups__ read their row
+    before and after writing it, to move the lookup rows along
+    """
+    if isinstance(target, CORMBase):
+        table = target.__class__
+        values = _row_values(target)
+        if set is not None:
+            values = {key: value for key, value in values.items() if key in set or key in target._corm_details.primary_keys}
+
+        # The object's own copy of a collection being appended to or removed from isn't written
+        values = {key: value for key, value in values.items() if not key in append.keys() and not key in remove.keys()}
+
+    else:
+        table = target
+        values = _key_values(target, where)
+        values.update(_encode_field_values(target, set or {}))
+
+    overlapping_names = [field_name for field_name in append.keys() if field_name in remove.keys() or field_name in values.keys()]
+    overlapping_names.extend([field_name for field_name in remove.keys() if field_name in values.keys()])
+    if overlapping_names:
+        formatted_overlapping_names = ', '.join(sorted(overlapping_names))
+        raise NotImplementedError(f'Fields[{formatted_overlapping_names}] can only be set, appended to or removed from once per update')
+
+    appends = {field_name: _encode_collection_change(table, field_name, value, False) for field_name, value in append.items()}
+    removes = {field_name: _encode_collection_change(table, field_name, value, True) for field_name, value in remove.items()}
+    return Mutation(MutationKind.Update, table, values, if_, if_exists, appends=appends, removes=removes)
+
+def delete_mutation(target: typing.Any, where: typing.List['cp'] = [], if_: typing.List['cp'] = [], if_exists: bool = False) -> Mutation:
+    if isinstance(target, CORMBase):
+        row_values = _row_values(target)
+        values = {key: row_values[key] for key in target._corm_details.primary_keys}
+        return Mutation(MutationKind.Delete, target.__class__, values, if_, if_exists)
+
+    return Mutation(MutationKind.Delete, target, _key_values(target, where), if_, if_exists)
+
+def update(target: typing.Any, set: typing.Dict[str, typing.Any] = None, where: typing.List['cp'] = [],
+        if_: typing.List['cp'] = [], if_exists: bool = False, append: typing.Dict[str, typing.Any] = {},
+        remove: typing.Dict[str, typing.Any] = {}) -> CASResult:
+    """
+    Writes only the given columns of one row, see update_mutation. if_ conditions or if_exists make it
+    a lightweight transaction; the CASResult says whether it applied. Rows of unordered tables are
+    addressed by guid, which select fills in, so an object keeps its row while its values change.
+    On models with __lookups__ the row is read before and after the write and the lookup rows are moved
+    to match, which isn't atomic with the write itself
+    """
+    return _execute_mutation(update_mutation(target, set, where, if_, if_exists, append, remove))
+
+def delete(target: typing.Any, where: typing.List['cp'] = [], if_: typing.List['cp'] = [], if_exists: bool = False) -> CASResult:
+    return _execute_mutation(delete_mutation(target, where, if_, if_exists))
+
+def _execute_mutation(mutation: Mutation) -> CASResult:
+    started = time.perf_counter()
+    result = obtain_backend().execute_cas([mutation], 1)[0]
+    if REGISTRY.enabled:
+        record_query(mutation.table._corm_details.table_name, mutation.kind.value, started, rows=int(result.applied))
+
+    return result
+
+def mutate_concurrent(mutations: typing.List[Mutation], concurrency: int = 100) -> typing.List[ExecutionResult]:
+    """
+    Executes unconditional mutations of one table individually, at most concurrency in flight, with one
+    cached prepared statement per column set. Returns one (success, result_or_exc) pair per mutation
+    """
+    started = time.perf_counter()
+    results = obtain_backend().execute_mutations(mutations, concurrency)
+    if REGISTRY.enabled and mutations:
+        errors = len([success for success, result in results if not success])
+        record_query(mutations[0].table._corm_details.table_name, 'mutate.concurrent', started, rows=len(results) - errors, errors=errors)
+
+    return results
+
+def mutate_batch(mutations: typing.List[Mutation]) -> None:
+    """
+    Executes unconditional mutations of one table as a single batch, best kept to one partition
+    """
+    started = time.perf_counter()
+    result = obtain_backend().execute_batch(mutations)
+    if REGISTRY.enabled and mutations:
+        record_query(mutations[0].table._corm_details.table_name, 'mutate.batch', started, rows=len(mutations),
+            batch_size=len(mutations), result=result)
+
+def execute_cas(mutations: typing.List[Mutation], concurrency: int = 100) -> typing.List[CASResult]:
+    """
+    Runs conditional writes, grouped by partition so writes to one partition don't race each other's
+    Paxos rounds, while distinct partitions proceed concurrently
+    """
+    started = time.perf_counter()
+    results = obtain_backend().execute_cas(mutations, concurrency)
+    if REGISTRY.enabled and mutations:
+        applied = len([result for result in results if result.applied])
+        record_query(mutations[0].table._corm_details.table_name, 'cas', started, rows=applied, errors=len(results) - applied)
+
+    return results
+
+def decode_row(table: CORMBase, row: typing.Any) -> CORMBase:
+    values = []
+    for idx, field_name in enumerate(table._corm_details.field_names):
+        raw_value = getattr(row, field_name, None)
+        if raw_value is None:
+            values.append(None)
+
+        else:
+            values.append(table._corm_details.field_transliterators[idx].cql_to_python(raw_value))
+
+    instance = table(*values)
+    guid = getattr(row, 'guid', None)
+    if guid:
+        instance.guid = guid
+
+    return instance
+
+def _default_field_names(table: CORMBase) -> typing.List[str]:
+    # guid comes along so decoded objects can be updated in place
+    field_names = table._corm_details.field_names[:]
+    field_names.append('guid')
+    return field_names
+
+def _encode_cursor(paging_state: bytes) -> str:
+    if paging_state is None:
+        return None
+
+    return base64.urlsafe_b64encode(paging_state).decode(ENCODING)
+
+def _decode_cursor(cursor: str) -> bytes:
+    try:
+        return base64.urlsafe_b64decode(cursor.encode(ENCODING))
+    except (binascii.Error, ValueError) as err:
+        raise NotImplementedError(f'Invalid Cursor[{cursor}]') from err
 
 class select:
-    def __init__(self: PWN, table: CORMBase, field_names: typing.List[str] = [], fetch_size: int = 100) -> None:
-        self._table = table
-        self._field_names = field_names or table._corm_details.field_names
-
-        formatted_field_names = ','.join(self._field_names)
-        keyspace = self._table._corm_details.keyspace
-        table_name = self._table._corm_details.table_name
-        self._query = f'SELECT {formatted_field_names} FROM {keyspace}.{table_name}'
-        self._fetch_size = fetch_size
-        self._stmt = SimpleStatement(self._query, fetch_size=fetch_size)
-        self._iter = obtain_session(self._table._corm_details.keyspace).execute(self._stmt)
-        self._fetched = []
-        self._fetched.extend(self._iter.current_rows)
+    """
+    Runs on first iteration, or once per page() call. Timestamps come back as timezone aware UTC datetimes
+    """
+    def __init__(self: PWN, table: CORMBase, field_names: typing.List[str] = [], fetch_size: int = 100, trace: bool = None,
+            execution_profile: str = None, consistency_level: typing.Any = None) -> None:
+        self._prepare(SelectQuery(table, field_names or _default_field_names(table), fetch_size=fetch_size,
+            trace=should_trace(trace), execution_profile=resolve_profile(table, execution_profile, consistency_level)))
+
+    def _prepare(self: PWN, query: SelectQuery) -> None:
+        self._table = query.table
+        self._field_names = query.field_names
+        self._fetch_size = query.fetch_size
+        self._query = query
+        self._iter = None
+
+    def _execute(self: PWN) -> None:
+        started = time.perf_counter()
+        with LIMITER.slot():
+            self._iter = obtain_backend().execute_select(self._query)
+
+        self._fetched = collections.deque(self._iter.current_rows)
+        _observe_query(self._table._corm_details.table_name, f'{self.__class__.__name__}.execute', started,
+            self._iter, self._query.trace, rows=len(self._fetched), pages=1)
+
+    def page(self: PWN, size: int, cursor: str = None) -> Page:
+        """
+        Up to size objects and the cursor of the page after them, None after the last page. The cursor is a
+        url-safe string wrapping the driver's paging_state, so the next page can be asked for by another
+        process running the same query. Each call is one request, however deep the page
+        """
+        query = self._query._replace(fetch_size=size, paging_state=None if cursor is None else _decode_cursor(cursor))
+        started = time.perf_counter()
+        with LIMITER.slot():
+            result = obtain_backend().execute_select(query)
+
+        rows = [decode_row(self._table, row) for row in result.current_rows]
+        _observe_query(self._table._corm_details.table_name, f'{self.__class__.__name__}.page', started,
+            result, query.trace, rows=len(rows), pages=1)
+
+        return Page(rows, _encode_cursor(result.paging_state if result.has_more_pages else None))
+
+    def _fetch_next_page(self: PWN) -> typing.List[typing.Any]:
+        started = time.perf_counter()
+        with LIMITER.slot():
+            self._iter.fetch_next_page()
+
+        _observe_query(self._table._corm_details.table_name, f'{self.__class__.__name__}.fetch_page', started,
+            self._iter, self._query.trace, rows=len(self._iter.current_rows), pages=1)
+
+        return self._iter.current_rows
 
     def __iter__(self: PWN) -> PWN:
         return self
 
     def __next__(self: PWN) -> CORMBase:
+        if self._iter is None:
+            self._execute()
+
         if len(self._fetched) < 1:
             if self._iter.has_more_pages is False:
                 raise StopIteration
 
-            self._iter.fetch_next_page()
-            self._fetched.extend(self._iter.current_rows)
+            self._fetched.extend(self._fetch_next_page())
 
         if len(self._fetched) < 1:
             raise StopIteration
 
-        next_object = self._fetched.pop()
-        values = []
-        for field_name, annotation in self._table.__annotations__.items():
-            try:
-                transliterator = DT_MAP[annotation]
-            except KeyError:
-                if issubclass(annotation, enum.Enum):
-                    transliterator = EnumTransliterator(annotation)
+        if REGISTRY.enabled:
+            started = time.perf_counter()
+            instance = decode_row(self._table, self._fetched.popleft())
+            record_query(self._table._corm_details.table_name, f'{self.__class__.__name__}.decode', started, rows=1)
+            return instance
 
-                else:
-                    transliterator = UDT_MAP.get(annotation, None)
-                    if transliterator is None:
-                        raise NotImplementedError
+        return decode_row(self._table, self._fetched.popleft())
+
+    def pages(self: PWN) -> types.GeneratorType:
+        '''
+        Yields raw driver rows one page at a time, without building model instances
+        '''
+        if self._iter is None:
+            self._execute()
+
+        if self._fetched:
+            yield list(self._fetched)
+            self._fetched.clear()
 
-            raw_value = getattr(next_object, field_name, None)
-            values.append(transliterator.cql_to_python(raw_value))
+        while self._iter.has_more_pages:
+            yield self._fetch_next_page()
 
-        return self._table(*values)
+class scan(select):
+    def __init__(self: PWN, table: CORMBase, token_range: TokenRange, field_names: typing.List[str] = [], fetch_size: int = 100,
+            trace: bool = None, execution_profile: str = None, consistency_level: typing.Any = None) -> None:
+        self._token_range = token_range
+        self._prepare(SelectQuery(table, field_names or _default_field_names(table),
+            token_range=token_range, fetch_size=fetch_size, trace=should_trace(trace),
+            execution_profile=resolve_profile(table, execution_profile, consistency_level)))
 
 class Operator(enum.Enum):
     Equal = 'equal'
+    In = 'in'
+    GreaterThan = 'greater-than'
+    GreaterThanOrEqual = 'greater-than-or-equal'
+    LessThan = 'less-than'
+    LessThanOrEqual = 'less-than-or-equal'
+
+OPERATOR_CQL = {
+    Operator.Equal: '=',
+    Operator.In: 'IN',
+    Operator.GreaterThan: '>',
+    Operator.GreaterThanOrEqual: '>=',
+    Operator.LessThan: '<',
+    Operator.LessThanOrEqual: '<=',
+}
+
+OPERATOR_MATCH = {
+    Operator.Equal: lambda value, other: value == other,
+    Operator.In: lambda value, other: value in other,
+    Operator.GreaterThan: lambda value, other: value is not None and value > other,
+    Operator.GreaterThanOrEqual: lambda value, other: value is not None and value >= other,
+    Operator.LessThan: lambda value, other: value is not None and value < other,
+    Operator.LessThanOrEqual: lambda value, other: value is not None and value <= other,
+}
+
+def cql_literal(value: typing.Any) -> str:
+    if value is None:
+        return 'null'
+
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+
+    elif isinstance(value, (float, int)):
+        return f'{value}'
+
+    elif isinstance(value, uuid.UUID):
+        return str(value)
+
+    elif issubclass(value.__class__, enum.Enum):
+        return cql_literal(value.value)
+
+    elif isinstance(value, datetime):
+        # Milliseconds since the epoch, exact and timezone independent
+        return str(datetime__python_to_hash(value))
+
+    elif isinstance(value, (date, time_of_day)):
+        return cql_literal(value.isoformat())
+
+    elif isinstance(value, str):
+        escaped = value.replace("'", "''")
+        return f"'{escaped}'"
+
+    raise NotImplementedError(value.__class__)
 
 class cp:
     def __init__(self: PWN, operator: Operator, field_name: str, value: typing.Any) -> None:
         self._operator = operator
         self._field_name = field_name
         self._value = value
+        if operator is Operator.In:
+            assert isinstance(value, (list, tuple, set)), 'Operator.In requires a list of values'
+
+    @property
+    def field_name(self: PWN) -> str:
+        return self._field_name
+
+    @property
+    def operator(self: PWN) -> Operator:
+        return self._operator
 
     def as_cql(self: PWN, table: CORMBase) -> str:
         assert self._field_name in table.__annotations__.keys(), f'Field[{self._field_name}] not available on Table[{table}]'
-        if isinstance(self._value, (float, int)):
-            return f"{self._field_name} = {self._value}"
+        if self._operator is Operator.In:
+            formatted_values = ', '.join([cql_literal(value) for value in self._value])
+            return f'{self._field_name} IN ({formatted_values})'
 
-        elif issubclass(self._value.__class__, enum.Enum):
-            return f"{self._field_name} = '{self._value.value}'"
+        return f'{self._field_name} {OPERATOR_CQL[self._operator]} {cql_literal(self._value)}'
 
-        elif isinstance(self._value, str):
-            return f"{self._field_name} = '{self._value}'"
+    def as_bound_cql(self: PWN, table: CORMBase) -> str:
+        """
+        Same predicate with ? placeholders, for prepared statements and lightweight transaction conditions
+        """
+        assert self._field_name in table.__annotations__.keys() or self._field_name == 'guid', f'Field[{self._field_name}] not available on Table[{table}]'
+        if self._operator is Operator.In:
+            formatted_question_marks = ', '.join(['?' for value in self._value])
+            return f'{self._field_name} IN ({formatted_question_marks})'
 
-        else:
-            raise NotImplementedError(self._value.__class__)
+        return f'{self._field_name} {OPERATOR_CQL[self._operator]} ?'
+
+    def bound_values(self: PWN, table: CORMBase) -> typing.List[typing.Any]:
+        if self._operator is Operator.In:
+            return [self._encode(table, value) for value in self._value]
+
+        return [self._encode(table, self._value)]
+
+    def _encode(self: PWN, table: CORMBase, value: typing.Any) -> typing.Any:
+        if self._field_name == 'guid':
+            return value
+
+        transliterator = table._corm_details.field_transliterators[table._corm_details.field_names.index(self._field_name)]
+        if value is None or transliterator.values_encode_exemption:
+            return value
+
+        return transliterator.python_to_cql(value)
+
+    def matches(self: PWN, table: CORMBase, value: typing.Any) -> bool:
+        """
+        Evaluates the predicate against a stored, already encoded column value
+        """
+        if self._operator is Operator.In:
+            return OPERATOR_MATCH[self._operator](value, [self._encode(table, entry) for entry in self._value])
+
+        return OPERATOR_MATCH[self._operator](value, self._encode(table, self._value))
 
 class where(select):
-    def __init__(self: PWN, table: CORMBase, compare_functions: typing.List[cp], field_names: typing.List[str] = [], fetch_size: int = 100, limit: int = 0) -> None:
-        self._table = table
-        self._field_names = field_names or table._corm_details.field_names
-
-        formatted_field_names = ','.join(self._field_names)
-        keyspace = self._table._corm_details.keyspace
-        table_name = self._table._corm_details.table_name
-
-        # select * from marketstack_com.history where symbol = 'LTUU' limit 3 ALLOW FILTERING
-        self._query = f'SELECT {formatted_field_names} FROM {keyspace}.{table_name}'
-        where_clause = ' AND'.join([cp_func.as_cql(table) for cp_func in compare_functions])
-        if where_clause:
-            self._query = f'{self._query} WHERE {where_clause}'
-
-        if limit > 0:
-            self._query = f'{self._query} LIMIT = {limit}'
-
-        if where_clause:
-            self._query = f'{self._query} ALLOW FILTERING'
-
-        self._fetch_size = fetch_size
-        self._stmt = SimpleStatement(self._query, fetch_size=fetch_size)
-        self._iter = obtain_session(self._table._corm_details.keyspace).execute(self._stmt)
-        self._fetched = []
-        self._fetched.extend(self._iter.current_rows)
+    def __init__(self: PWN, table: CORMBase, compare_functions: typing.List[cp], field_names: typing.List[str] = [], fetch_size: int = 100, limit: int = 0,
+            trace: bool = None, execution_profile: str = None, consistency_level: typing.Any = None) -> None:
+        self._prepare(SelectQuery(table, field_names or _default_field_names(table),
+            compare_functions, limit, fetch_size=fetch_size, trace=should_trace(trace),
+            execution_profile=resolve_profile(table, execution_profile, consistency_level)))
+
+AGGREGATE_MERGE = {
+    'count': lambda value, other: value + other,
+    'sum': lambda value, other: value + other,
+    'min': lambda value, other: value if value <= other else other,
+    'max': lambda value, other: value if value >= other else other,
+}
+
+def _decode_key(details: CORMDetails, key_names: typing.List[str], values: typing.Tuple[typing.Any]) -> typing.Tuple[typing.Any]:
+    return tuple([value if key == 'guid' or value is None else
+        details.field_transliterators[details.field_names.index(key)].cql_to_python(value) for key, value in zip(key_names, values)])
+
+def _aggregate_rows(queries: typing.List[SelectQuery], concurrency: int) -> typing.List[typing.Any]:
+    def _execute_range(query: SelectQuery) -> typing.List[typing.Any]:
+        with LIMITER.slot():
+            result = obtain_backend().execute_select(query)
+            rows = list(result.current_rows)
+            while result.has_more_pages:
+                result.fetch_next_page()
+                rows.extend(result.current_rows)
+
+        return rows
+
+    if len(queries) == 1:
+        return _execute_range(queries[0])
+
+    with ThreadPoolExecutor(max_workers=max(min(concurrency, len(queries)), 1)) as executor:
+        return [row for rows in executor.map(_execute_range, queries) for row in rows]
+
+def aggregate(table: CORMBase, count: bool = True, min: typing.Any = [], max: typing.Any = [], sum: typing.Any = [],
+        group_by: typing.List[str] = [], where: typing.List[cp] = [], token_ranges: int = 16, concurrency: int = 16,
+        execution_profile: str = None, consistency_level: typing.Any = None) -> typing.Dict[typing.Any, typing.Any]:
+    """
+    Computes count(*) and the min, max and sum of the named fields in Cassandra, so only the results cross
+    the network. Returns {'count': 10, 'max_score': 7}, or with group_by, a prefix of the primary keys, one
+    such dict per group keyed by the tuple of its values. Without where the token ring is split into
+    token_ranges queries, run concurrency at a time, and their results merged
+    """
+    details = table._corm_details
+    aggregates = [('count', '*')] if count else []
+    for function, field_names in [('min', min), ('max', max), ('sum', sum)]:
+        for field_name in [field_names] if isinstance(field_names, str) else field_names:
+            if not field_name in details.field_names:
+                raise NotImplementedError(f'Field[{field_name}] not in Table[{details.table_name}]')
+
+            aggregates.append((function, field_name))
+
+    if not aggregates:
+        raise NotImplementedError('Nothing to aggregate')
+
+    elif group_by != details.primary_keys[:len(group_by)]:
+        raise NotImplementedError(f'GroupBy[{group_by}] is not a prefix of PrimaryKeys[{details.primary_keys}]')
+
+    started = time.perf_counter()
+    query = SelectQuery(table, group_by[:], where, fetch_size=1000, trace=should_trace(None),
+        execution_profile=resolve_profile(table, execution_profile, consistency_level), aggregates=aggregates, group_by=group_by)
+    queries = [query] if where else [query._replace(token_range=token_range) for token_range in split_token_ring(token_ranges)]
+    results = {}
+    for row in _aggregate_rows(queries, concurrency):
+        group, values = tuple(row[:len(group_by)]), list(row[len(group_by):])
+        merged = results.get(group, None)
+        if merged is not None:
+            # A group spread over several token ranges
+            values = [value if other is None else other if value is None else AGGREGATE_MERGE[function](value, other)
+                for (function, field_name), value, other in zip(aggregates, merged, values)]
+
+        results[group] = values
+
+    decoded = {}
+    for group, values in results.items():
+        entry = decoded[_decode_key(details, group_by, group)] = {}
+        for (function, field_name), value in zip(aggregates, values):
+            if function in ['min', 'max'] and value is not None:
+                value = details.field_transliterators[details.field_names.index(field_name)].cql_to_python(value)
+
+            entry['count' if field_name == '*' else f'{function}_{field_name}'] = value
+
+    _observe_query(details.table_name, 'aggregate', started, rows=len(decoded), pages=len(queries))
+    # Ungrouped aggregates always come back as one row
+    return decoded if group_by else decoded[()]
+
+def estimate(table: CORMBase) -> TableEstimate:
+    """
+    Approximate partitions and bytes of the table, without reading it. See TableEstimate
+    """
+    return obtain_backend().estimate(table._corm_details)
+
+def profile_partitions(table: CORMBase, samples: int = 16, token_ranges: int = 1024, top: int = 10,
+        concurrency: int = 16) -> PartitionProfile:
+    """
+    Counts rows per partition in samples of token_ranges slices of the ring, picked at random, to find the
+    widest partitions and how skewed the table is. Only the counts cross the network, the sampled slices
+    are still read by Cassandra
+    """
+    if samples < 1 or token_ranges < 1:
+        raise NotImplementedError(f'Samples[{samples}] and TokenRanges[{token_ranges}] must be at least 1')
+
+    details = table._corm_details
+    partition_keys = details.partition_keys
+    started = time.perf_counter()
+    sampled = random.sample(split_token_ring(token_ranges), min(samples, token_ranges))
+    query = SelectQuery(table, partition_keys[:], fetch_size=1000, aggregates=[('count', '*')], group_by=partition_keys)
+    counts = {}
+    for row in _aggregate_rows([query._replace(token_range=token_range) for token_range in sampled], concurrency):
+        counts[_decode_key(details, partition_keys, row[:-1])] = row[-1]
+
+    widest = sorted(counts.items(), key=lambda entry: entry[1], reverse=True)[:top]
+    _observe_query(details.table_name, 'profile_partitions', started, rows=len(counts), pages=len(sampled))
+    return PartitionProfile(len(sampled), len(counts), sum(counts.values()), widest[0][1] if widest else 0,
+        int(len(counts) * token_ranges / len(sampled)), widest)
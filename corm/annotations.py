@@ -1,2 +1,54 @@
-class Set:
+import typing
+
+class CollectionType(typing.NamedTuple):
+    """
+    A parameterised annotation such as Set[int] or Frozen[List[str]]. Hashable, so it keys transliterators
+    the same way plain python types do
+    """
+    container: typing.Any
+    arguments: typing.Tuple[typing.Any]
+    frozen: bool = False
+
+class TimeUUID:
+    """
+    Marks a TIMEUUID column, holding version 1 uuid.UUID values such as uuid.uuid1()
+    """
     pass
+
+class _Collection:
+    cql_name: str = None
+    argument_count: int = 1
+
+    def __class_getitem__(cls, arguments: typing.Any) -> CollectionType:
+        if not isinstance(arguments, tuple) or isinstance(arguments, CollectionType):
+            arguments = (arguments,)
+
+        if len(arguments) != cls.argument_count:
+            raise NotImplementedError(f'{cls.__name__} takes {cls.argument_count} type arguments')
+
+        return CollectionType(cls, arguments)
+
+class Set(_Collection):
+    """
+    Set[T] maps to SET<T>. The bare Set annotation keeps meaning SET<text>
+    """
+    cql_name = 'SET'
+
+class List(_Collection):
+    cql_name = 'LIST'
+
+class Dict(_Collection):
+    cql_name = 'MAP'
+    argument_count = 2
+
+class Frozen(_Collection):
+    """
+    Frozen[Set[T]] and friends are written and read as one value, like Cassandra's FROZEN<...>
+    """
+    cql_name = 'FROZEN'
+
+    def __class_getitem__(cls, argument: typing.Any) -> CollectionType:
+        if isinstance(argument, CollectionType):
+            return argument._replace(frozen=True)
+
+        return CollectionType(cls, (argument,), True)
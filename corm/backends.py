@@ -0,0 +1,886 @@
+import collections
+import hashlib
+import logging
+import threading
+import time
+import typing
+
+from corm.concurrency import execute_adaptive
+from corm.constants import PWN, MIN_TOKEN, MAX_TOKEN, ENCODING, CORM_FILTERING_WARN_PARTITIONS, CORM_ESTIMATE_CACHE_SECONDS
+from corm.datatypes import CORMDetails, CassandraKeyspaceStrategy, SelectQuery, TableOrdering, Mutation, CASResult, \
+        MutationKind, IndexKind, SelectRoute, TokenRange, RangeEstimate, TableEstimate
+from corm.profiles import observe_latency, driver_profile, resolve_profile
+
+from cassandra.cluster import EXEC_PROFILE_DEFAULT
+from cassandra.concurrent import ExecutionResult
+from cassandra.query import BatchStatement, SimpleStatement, UNSET_VALUE
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class Backend:
+    """
+    Storage behind corm's public functions. Rows cross this interface as bind values, already encoded by
+    the table's transliterators and with the guid appended, and come back as row objects exposing one
+    attribute per selected column
+    """
+    def keyspace_exists(self: PWN, keyspace_name: str) -> bool:
+        raise NotImplementedError
+
+    def keyspace_create(self: PWN, keyspace_name: str, strategy: CassandraKeyspaceStrategy) -> None:
+        raise NotImplementedError
+
+    def keyspace_destroy(self: PWN, keyspace_name: str) -> None:
+        raise NotImplementedError
+
+    def annihilate_keyspace_tables(self: PWN, keyspace_name: str) -> None:
+        raise NotImplementedError
+
+    def sync_schema(self: PWN, udts: typing.List[typing.Any], tables: typing.List[CORMDetails]) -> None:
+        raise NotImplementedError
+
+    def insert(self: PWN, table: CORMDetails, rows: typing.List[typing.List[typing.Any]], trace: bool = False,
+            execution_profile: typing.Any = EXEC_PROFILE_DEFAULT) -> typing.Any:
+        raise NotImplementedError
+
+    def insert_concurrent(self: PWN, table: CORMDetails, rows: typing.List[typing.List[typing.Any]], concurrency: int,
+            execution_profile: typing.Any = EXEC_PROFILE_DEFAULT) -> typing.List[ExecutionResult]:
+        raise NotImplementedError
+
+    def execute_mutations(self: PWN, mutations: typing.List[Mutation], concurrency: int) -> typing.List[ExecutionResult]:
+        raise NotImplementedError
+
+    def execute_batch(self: PWN, mutations: typing.List[Mutation]) -> typing.Any:
+        raise NotImplementedError
+
+    def execute_cas(self: PWN, mutations: typing.List[Mutation], concurrency: int) -> typing.List[CASResult]:
+        """
+        Runs conditional writes and returns one CASResult per mutation, in order
+        """
+        raise NotImplementedError
+
+    def execute_select(self: PWN, query: SelectQuery) -> typing.Any:
+        """
+        Returns a result set exposing current_rows, has_more_pages and fetch_next_page, like the driver's ResultSet
+        """
+        raise NotImplementedError
+
+    def estimate(self: PWN, table: CORMDetails) -> TableEstimate:
+        raise NotImplementedError
+
+    def select_route(self: PWN, query: SelectQuery) -> SelectRoute:
+        """
+        Picks the table, lookup table or materialized view able to answer the predicates, preferring one that needs no
+        ALLOW FILTERING, then one whose partition is restricted. Predicates are served by the partition key
+        through = or IN, a clustering key prefix ending in a range, or an index on the table. Secondary
+        indexes serve one = predicate, storage attached indexes = and ranges on any number of columns
+        """
+        from corm import Operator
+
+        table = query.table._corm_details
+        if not query.compare_functions:
+            return SelectRoute(table.table_name, False, False)
+
+        key_operators = [Operator.Equal, Operator.In]
+        indexes = {index.field_name: index.kind for index in table.indexes}
+        sources = [(table.table_name, table.partition_keys, table.primary_keys[len(table.partition_keys):], indexes)]
+        if not query.group_by and not query.token_range:
+            # GROUP BY and token ranges name the table's own keys
+            sources.extend([(lookup.table_name, lookup.partition_keys, lookup.clustering_keys, {}) for lookup in table.lookups])
+            sources.extend([(view.view_name, view.partition_keys, view.clustering_keys, {}) for view in table.views])
+
+        routes = []
+        for source_idx, (source_name, partition_keys, clustering_keys, source_indexes) in enumerate(sources):
+            unserved = [cp_func for cp_func in query.compare_functions]
+
+            def _serve(field_name: str, operators: typing.List[typing.Any], first_only: bool = False) -> bool:
+                served = [cp_func for cp_func in unserved if cp_func.field_name == field_name and cp_func.operator in operators]
+                for cp_func in served[:1] if first_only else served:
+                    unserved.remove(cp_func)
+
+                return len(served) > 0
+
+            restricts_partition = all([_serve(key, key_operators, True) for key in partition_keys])
+            if restricts_partition:
+                for key in clustering_keys:
+                    if not _serve(key, key_operators, True):
+                        _serve(key, [operator for operator in Operator if not operator in key_operators])
+                        break
+
+            else:
+                unserved = [cp_func for cp_func in query.compare_functions]
+
+            sai_served = [_serve(field_name, [operator for operator in Operator if not operator is Operator.In])
+                for field_name, kind in source_indexes.items() if kind is IndexKind.SAI]
+            if not any(sai_served):
+                secondary = [cp_func for cp_func in unserved if source_indexes.get(cp_func.field_name, None) is IndexKind.Secondary and \
+                        cp_func.operator is Operator.Equal]
+                if secondary:
+                    unserved.remove(secondary[0])
+
+            routes.append(((len(unserved) > 0, not restricts_partition, len(unserved), source_idx),
+                SelectRoute(source_name, len(unserved) > 0, restricts_partition)))
+
+        return sorted(routes, key=lambda route: route[0])[0][1]
+
+class CassandraBackend(Backend):
+    def __init__(self: PWN) -> None:
+        self._estimates = {}
+
+    def keyspace_exists(self: PWN, keyspace_name: str) -> bool:
+        from corm import obtain_global_session
+
+        CQL = f"""SELECT
+    keyspace_name,
+    durable_writes,
+    replication
+FROM system_schema.keyspaces
+WHERE keyspace_name = '{keyspace_name}';"""
+
+        rows = [row for row in obtain_global_session().execute(CQL)]
+        if len(rows) == 0:
+            return False
+
+        return True
+
+    def keyspace_create(self: PWN, keyspace_name: str, strategy: CassandraKeyspaceStrategy) -> None:
+        from corm import obtain_global_session
+
+        if strategy is CassandraKeyspaceStrategy.Simple:
+            CQL = "CREATE KEYSPACE %s WITH REPLICATION = {'class': 'SimpleStrategy', 'replication_factor': 3};" % keyspace_name
+        else:
+            raise NotImplementedError
+
+        obtain_global_session().execute(CQL)
+
+    def keyspace_destroy(self: PWN, keyspace_name: str) -> None:
+        from corm import obtain_global_session
+
+        CQL = "DROP KEYSPACE IF EXISTS %s" % keyspace_name
+        obtain_global_session().execute(CQL)
+
+    def annihilate_keyspace_tables(self: PWN, keyspace_name: str) -> None:
+        from corm import obtain_global_session
+
+        # Tables can't be dropped while materialized views depend on them
+        FIND_VIEWS_CQL = 'SELECT view_name FROM system_schema.views WHERE keyspace_name = %s'
+        for row in obtain_global_session().execute(FIND_VIEWS_CQL, [keyspace_name]):
+            obtain_global_session().execute(f'DROP MATERIALIZED VIEW IF EXISTS {keyspace_name}.{row.view_name};')
+
+        FIND_TABLES_CQL = "SELECT table_name FROM system_schema.tables WHERE keyspace_name='{keyspace_name}';"
+        for row in obtain_global_session().execute(FIND_TABLES_CQL):
+            cql = f'DROP TABLE IF EXISTS {keyspace_name}.{row.table_name};'
+            obtain_global_session().execute(cql)
+
+    def sync_schema(self: PWN, udts: typing.List[typing.Any], tables: typing.List[CORMDetails]) -> None:
+        """
+        https://docs.datastax.com/en/dse/5.1/cql/cql/cql_using/useQuerySystemTable.html
+        """
+        from corm import obtain_session, obtain_cluster
+
+        # Sync User Defined Types, then tables
+        keyspace_udts = {}
+        for udt in udts:
+            keyspace_udts_entry = keyspace_udts.get(udt._udt_details.keyspace, [])
+            keyspace_udts_entry.append(udt)
+            keyspace_udts[udt._udt_details.keyspace] = keyspace_udts_entry
+
+        for udt_idx, (udt_keyspace_name, keyspace_udts_entry) in enumerate(keyspace_udts.items()):
+            if self.keyspace_exists(udt_keyspace_name) is False:
+                self.keyspace_create(udt_keyspace_name, CassandraKeyspaceStrategy.Simple)
+
+            session = obtain_session(udt_keyspace_name, True)
+            for user_defined_type in keyspace_udts_entry:
+                session.execute(user_defined_type._udt_details.as_create_user_defined_type_cql())
+                obtain_cluster().register_user_type(user_defined_type._udt_details.keyspace, user_defined_type._udt_details.udt_key, user_defined_type)
+
+        # Create or Update Tables
+        keyspace_tables = {}
+        for table in tables:
+            keyspace_tables_entry = keyspace_tables.get(table.keyspace, [])
+            keyspace_tables_entry.append(table)
+            keyspace_tables[table.keyspace] = keyspace_tables_entry
+
+        for idx, (keyspace_name, keyspace_tables_entry) in enumerate(keyspace_tables.items()):
+            if self.keyspace_exists(keyspace_name) is False:
+                self.keyspace_create(keyspace_name, CassandraKeyspaceStrategy.Simple)
+
+            session = obtain_session(keyspace_name, True)
+            for table in keyspace_tables_entry:
+                COLUMN_CQL = f'''
+                SELECT
+                    column_name, type
+                FROM
+                    system_schema.columns
+                WHERE table_name = ?
+                    AND keyspace_name = ?'''
+                stmt = obtain_session(keyspace_name).prepare(COLUMN_CQL)
+                existing_columns = {r.column_name: r.type for r in obtain_session(keyspace_name).execute(stmt, [table.table_name, keyspace_name])}
+
+                # Add Whole Table
+                if len(existing_columns.keys()) == 0:
+                    logger.info(f'Creating Table[{table.table_name}] in Keyspace[{table.keyspace}]')
+                    session.execute(table.as_create_table_cql())
+
+                # Add Columns
+                elif len(table.field_names) > len(existing_columns.keys()) - 1:
+                    column_updates = {}
+                    for field_idx, field_name in enumerate(table.field_names):
+                        field_transliterator = table.field_transliterators[field_idx]
+                        if field_name in existing_columns.keys():
+                            if field_transliterator.cql_type.lower() != existing_columns[field_name].lower():
+                                raise NotImplementedError
+
+                        else:
+                            column_updates[field_name] = field_transliterator.cql_type
+
+                    formatted_column_names = ', '.join(sorted(column_updates.keys()))
+                    formatted_column_definitions = ',\n'.join([' '.join([c_name, c_type]) for c_name, c_type in column_updates.items()])
+                    logger.info(f'Altering Table[{table.table_name}]. Adding Columns[{formatted_column_names}]')
+                    ALTER_CQL = f'''
+ALTER TABLE
+    {keyspace_name}.{table.table_name}
+ADD ({formatted_column_definitions})
+'''
+                    obtain_session(keyspace_name).execute(ALTER_CQL)
+
+                # Delete Columns
+                elif len(table.field_names) < len(existing_columns.keys()) - 1:
+                    columns_to_be_removed = [key for key in existing_columns.keys() if not key in table.field_names and key != 'guid']
+                    formatted_column_names = ', '.join(sorted(columns_to_be_removed))
+                    ALTER_CQL = f'''
+ALTER TABLE
+    {keyspace_name}.{table.table_name}
+DROP ({formatted_column_names})
+'''
+                    obtain_session(keyspace_name).execute(ALTER_CQL)
+
+                # Add Indexes and Materialized Views, which need materialized_views_enabled in cassandra.yaml
+                for index in table.indexes:
+                    session.execute(index.as_create_index_cql(keyspace_name, table.table_name))
+
+                for view in table.views:
+                    logger.info(f'Creating View[{view.view_name}] in Keyspace[{keyspace_name}]')
+                    session.execute(view.as_create_view_cql(table))
+
+    def insert(self: PWN, table: CORMDetails, rows: typing.List[typing.List[typing.Any]], trace: bool = False,
+            execution_profile: typing.Any = EXEC_PROFILE_DEFAULT) -> typing.Any:
+        from corm import obtain_session, insert_statement
+
+        cql_batch = BatchStatement()
+        # Every row is keyed by its deterministic guid or primary key, so replaying the batch writes the same cells
+        cql_batch.is_idempotent = True
+        # Lookup rows go in the same logged batch, so they are written if and only if the table's are
+        for target in [table] + table.lookups:
+            prepared_statement = insert_statement(target)
+            for row in rows if target is table else lookup_rows(target, rows):
+                cql_batch.add(prepared_statement, row)
+
+        session = obtain_session(table.keyspace)
+        return session.execute(cql_batch, trace=trace, execution_profile=driver_profile(session, execution_profile))
+
+    def insert_concurrent(self: PWN, table: CORMDetails, rows: typing.List[typing.List[typing.Any]], concurrency: int,
+            execution_profile: typing.Any = EXEC_PROFILE_DEFAULT) -> typing.List[ExecutionResult]:
+        from corm import obtain_session, insert_statement
+
+        session = obtain_session(table.keyspace)
+        statements_and_parameters = []
+        owners = []
+        for target in [table] + table.lookups:
+            prepared_statement = insert_statement(target)
+            for row_idx, row in enumerate(rows):
+                if target is table or lookup_rows(target, [row]):
+                    statements_and_parameters.append((prepared_statement, row))
+                    owners.append(row_idx)
+
+        results = [None for row in rows]
+        for row_idx, result in zip(owners, execute_adaptive(session, statements_and_parameters, concurrency,
+                execution_profile=driver_profile(session, execution_profile))):
+            # A row succeeds once its table and lookup writes all have, otherwise it carries the first failure
+            if results[row_idx] is None or (results[row_idx].success and not result.success):
+                results[row_idx] = result
+
+        return results
+
+    def mutation_statement(self: PWN, mutation: Mutation) -> typing.Tuple[str, typing.List[typing.Any]]:
+        """
+        CQL with placeholders for exactly the columns the mutation writes, so each column set prepares once
+        """
+        table = mutation.table._corm_details
+        key_names = table.primary_keys
+        formatted_where = ' AND '.join([f'{field_name} = ?' for field_name in key_names])
+        if mutation.kind is MutationKind.Insert:
+            field_names = [key for key in mutation.values.keys()]
+            formatted_field_names = ','.join(field_names)
+            formatted_question_marks = ','.join(['?' for field_name in field_names])
+            CQL = f'INSERT INTO {table.keyspace}.{table.table_name} ({formatted_field_names}) VALUES ({formatted_question_marks})'
+            parameters = [mutation.values[field_name] for field_name in field_names]
+
+        elif mutation.kind is MutationKind.Update:
+            set_names = [key for key in mutation.values.keys() if not key in key_names]
+            assignments = [f'{field_name} = ?' for field_name in set_names]
+            parameters = [mutation.values[field_name] for field_name in set_names]
+            # Collection changes only ship the elements, not the whole column
+            for field_name, value in mutation.appends.items():
+                assignments.append(f'{field_name} = {field_name} + ?')
+                parameters.append(value)
+
+            for field_name, value in mutation.removes.items():
+                assignments.append(f'{field_name} = {field_name} - ?')
+                parameters.append(value)
+
+            formatted_set = ', '.join(assignments)
+            CQL = f'UPDATE {table.keyspace}.{table.table_name} SET {formatted_set} WHERE {formatted_where}'
+            parameters.extend([mutation.values[field_name] for field_name in key_names])
+
+        elif mutation.kind is MutationKind.Delete:
+            CQL = f'DELETE FROM {table.keyspace}.{table.table_name} WHERE {formatted_where}'
+            parameters = [mutation.values[field_name] for field_name in key_names]
+
+        else:
+            raise NotImplementedError(mutation.kind)
+
+        if mutation.conditions:
+            formatted_conditions = ' AND '.join([cp_func.as_bound_cql(mutation.table) for cp_func in mutation.conditions])
+            CQL = f'{CQL} IF {formatted_conditions}'
+            for cp_func in mutation.conditions:
+                parameters.extend(cp_func.bound_values(mutation.table))
+
+        elif mutation.if_exists:
+            CQL = f'{CQL} IF EXISTS'
+
+        elif mutation.if_not_exists:
+            CQL = f'{CQL} IF NOT EXISTS'
+
+        return CQL, parameters
+
+    def _bound_mutation(self: PWN, mutation: Mutation) -> typing.Tuple[typing.Any, typing.List[typing.Any]]:
+        from corm import obtain_prepared_statement
+
+        CQL, parameters = self.mutation_statement(mutation)
+        prepared_statement = obtain_prepared_statement(mutation.table._corm_details.keyspace, CQL)
+        # The CQL decides idempotence, so it is the same for every use of the cached statement
+        prepared_statement.is_idempotent = mutation.is_idempotent
+        return prepared_statement, parameters
+
+    def _read_rows(self: PWN, mutations: typing.List[Mutation], tracked: typing.List[int], concurrency: int) -> typing.Dict[int, typing.Any]:
+        """
+        Rows of the mutations at the tracked indexes, by index, as insert_statement binds them, or None where
+        there is no row
+        """
+        from corm import obtain_session, obtain_prepared_statement
+
+        if not tracked:
+            return {}
+
+        statements_and_parameters = []
+        for idx in tracked:
+            table = mutations[idx].table._corm_details
+            formatted_field_names = ','.join(table.field_names + ['guid'])
+            formatted_where = ' AND '.join([f'{key} = ?' for key in table.primary_keys])
+            CQL = f'SELECT {formatted_field_names} FROM {table.keyspace}.{table.table_name} WHERE {formatted_where}'
+            prepared_statement = obtain_prepared_statement(table.keyspace, CQL)
+            prepared_statement.is_idempotent = True
+            statements_and_parameters.append((prepared_statement, [mutations[idx].values[key] for key in table.primary_keys]))
+
+        rows = {}
+        session = obtain_session(mutations[tracked[0]].table._corm_details.keyspace)
+        for idx, (success, result_or_exc) in zip(tracked, execute_adaptive(session, statements_and_parameters, concurrency,
+                execution_profile=driver_profile(session, resolve_profile(mutations[tracked[0]].table, write=True)))):
+            if not success:
+                raise result_or_exc
+
+            rows[idx] = list(result_or_exc[0]) if result_or_exc else None
+
+        return rows
+
+    def _write_lookups(self: PWN, mutations: typing.List[Mutation], before: typing.Dict[int, typing.Any],
+            applied: typing.List[bool], concurrency: int) -> typing.Dict[int, ExecutionResult]:
+        """
+        Reads the rows of the applied mutations again and moves their lookup rows from the values read before
+        to the current ones, one logged batch per row. Returns the failed batches by mutation index
+        """
+        from corm import obtain_session, obtain_prepared_statement, insert_statement
+
+        after = self._read_rows(mutations, [idx for idx in before.keys() if applied[idx]], concurrency)
+        statements_and_parameters = []
+        owners = []
+        for idx, new_row in after.items():
+            cql_batch = BatchStatement()
+            # The batch deletes and writes fixed values, so replaying it changes nothing
+            cql_batch.is_idempotent = True
+            for lookup, stale_keys, rows in lookup_changes(mutations[idx].table._corm_details, [before[idx]], [new_row]):
+                formatted_where = ' AND '.join([f'{key} = ?' for key in lookup.primary_keys])
+                delete_statement = obtain_prepared_statement(lookup.keyspace, f'DELETE FROM {lookup.keyspace}.{lookup.table_name} WHERE {formatted_where}')
+                for key in stale_keys:
+                    cql_batch.add(delete_statement, key)
+
+                for row in rows:
+                    cql_batch.add(insert_statement(lookup), row)
+
+            if len(cql_batch) > 0:
+                statements_and_parameters.append((cql_batch, None))
+                owners.append(idx)
+
+        if not owners:
+            return {}
+
+        session = obtain_session(mutations[owners[0]].table._corm_details.keyspace)
+        results = execute_adaptive(session, statements_and_parameters, concurrency,
+            execution_profile=driver_profile(session, resolve_profile(mutations[owners[0]].table, write=True)))
+        return {idx: result for idx, result in zip(owners, results) if not result.success}
+
+    def execute_mutations(self: PWN, mutations: typing.List[Mutation], concurrency: int) -> typing.List[ExecutionResult]:
+        from corm import obtain_session
+
+        before = self._read_rows(mutations, lookup_sources(mutations), concurrency)
+        statements_and_parameters = [self._bound_mutation(mutation) for mutation in mutations]
+        session = obtain_session(mutations[0].table._corm_details.keyspace)
+        results = list(execute_adaptive(session, statements_and_parameters, concurrency,
+            execution_profile=driver_profile(session, resolve_profile(mutations[0].table, write=True))))
+        # A mutation whose lookup rows could not follow it carries that failure
+        for idx, failure in self._write_lookups(mutations, before, [result.success for result in results], concurrency).items():
+            results[idx] = failure
+
+        return results
+
+    def execute_batch(self: PWN, mutations: typing.List[Mutation]) -> typing.Any:
+        from corm import obtain_session
+
+        before = self._read_rows(mutations, lookup_sources(mutations), len(mutations))
+        cql_batch = BatchStatement()
+        for mutation in mutations:
+            cql_batch.add(*self._bound_mutation(mutation))
+
+        session = obtain_session(mutations[0].table._corm_details.keyspace)
+        result = session.execute(cql_batch, execution_profile=driver_profile(session, resolve_profile(mutations[0].table, write=True)))
+        for failure in self._write_lookups(mutations, before, [True for mutation in mutations], len(mutations)).values():
+            raise failure.result_or_exc
+
+        return result
+
+    def execute_cas(self: PWN, mutations: typing.List[Mutation], concurrency: int) -> typing.List[CASResult]:
+        """
+        Mutations on the same partition run one after another, since concurrent Paxos rounds on one
+        partition only contend with each other. Distinct partitions run concurrently
+        """
+        from corm import obtain_session
+
+        before = self._read_rows(mutations, lookup_sources(mutations), concurrency)
+        partitions = collections.OrderedDict()
+        for idx, mutation in enumerate(mutations):
+            partitions.setdefault((mutation.table._corm_details.keyspace, mutation.partition), []).append(idx)
+
+        results = [None] * len(mutations)
+        def _execute_partition(indexes: typing.List[int]) -> None:
+            for idx in indexes:
+                mutation = mutations[idx]
+                session = obtain_session(mutation.table._corm_details.keyspace)
+                result = session.execute(*self._bound_mutation(mutation),
+                    execution_profile=driver_profile(session, resolve_profile(mutation.table, write=True)))
+                if not mutation.is_conditional:
+                    # Not a transaction, Cassandra always applies it
+                    results[idx] = CASResult(True)
+                    continue
+
+                row = result.one()
+                existing = {key: value for key, value in row._asdict().items() if key != 'applied'} if row else {}
+                results[idx] = CASResult(result.was_applied, {} if result.was_applied else existing)
+
+        if len(partitions) == 1:
+            _execute_partition([idx for idx in range(0, len(mutations))])
+
+        else:
+            with ThreadPoolExecutor(max_workers=max(min(concurrency, len(partitions)), 1)) as executor:
+                for future in [executor.submit(_execute_partition, indexes) for indexes in partitions.values()]:
+                    future.result()
+
+        for failure in self._write_lookups(mutations, before, [result.applied for result in results], concurrency).values():
+            raise failure.result_or_exc
+
+        return results
+
+    def select_cql(self: PWN, query: SelectQuery, route: SelectRoute = None) -> str:
+        formatted_field_names = ','.join(query.field_names + [f'{function}({field_name})' for function, field_name in query.aggregates])
+        keyspace = query.table._corm_details.keyspace
+        route = route or self.select_route(query)
+
+        # select * from marketstack_com.history where symbol = 'LTUU' limit 3 ALLOW FILTERING
+        cql = f'SELECT {formatted_field_names} FROM {keyspace}.{route.table_name}'
+        predicates = [cp_func.as_cql(query.table) for cp_func in query.compare_functions]
+        if query.token_range:
+            predicates.append(query.token_range.as_cql(query.table._corm_details.partition_keys))
+
+        if predicates:
+            where_clause = ' AND '.join(predicates)
+            cql = f'{cql} WHERE {where_clause}'
+
+        if query.group_by:
+            formatted_group_by = ','.join(query.group_by)
+            cql = f'{cql} GROUP BY {formatted_group_by}'
+
+        if query.limit > 0:
+            cql = f'{cql} LIMIT {query.limit}'
+
+        if route.allow_filtering:
+            cql = f'{cql} ALLOW FILTERING'
+
+        return cql
+
+    def estimate(self: PWN, table: CORMDetails) -> TableEstimate:
+        """
+        system.size_estimates of the connected node, which lists its primary token ranges, scaled to the
+        whole ring. Cached per table for CORM_ESTIMATE_CACHE_SECONDS
+        """
+        from corm import obtain_global_session
+
+        key = (table.keyspace, table.table_name)
+        cached = self._estimates.get(key, None)
+        if cached is None or time.monotonic() - cached[0] > CORM_ESTIMATE_CACHE_SECONDS:
+            CQL = 'SELECT range_start, range_end, partitions_count, mean_partition_size FROM system.size_estimates ' \
+                    'WHERE keyspace_name = %s AND table_name = %s'
+            try:
+                rows = obtain_global_session().execute(CQL, [table.keyspace, table.table_name])
+                ranges = [RangeEstimate(TokenRange(int(row.range_start), int(row.range_end)), row.partitions_count, row.mean_partition_size)
+                    for row in rows]
+            except Exception as err:
+                logger.debug(f'Unable to estimate Table[{table.table_name}]: {err}')
+                ranges = []
+
+            cached = self._estimates[key] = (time.monotonic(), scale_estimate(ranges))
+
+        return cached[1]
+
+    def execute_select(self: PWN, query: SelectQuery) -> typing.Any:
+        from corm import obtain_session
+
+        table = query.table._corm_details
+        route = self.select_route(query)
+        cql = self.select_cql(query, route)
+        if route.allow_filtering and not route.restricts_partition:
+            estimated_partitions = self.estimate(table).partitions
+            if estimated_partitions > CORM_FILTERING_WARN_PARTITIONS:
+                logger.warning(f'ALLOW FILTERING on Table[{table.table_name}] with ~{estimated_partitions} partitions scans the whole table: {cql}')
+
+        # Reads are idempotent, so the driver may retry them and run speculative executions
+        stmt = SimpleStatement(cql, fetch_size=query.fetch_size, is_idempotent=True)
+        execution_profile = query.execution_profile or EXEC_PROFILE_DEFAULT
+        session = obtain_session(table.keyspace)
+        started = time.perf_counter()
+        result = session.execute(stmt, trace=query.trace, execution_profile=driver_profile(session, execution_profile),
+            paging_state=query.paging_state)
+        observe_latency(execution_profile, time.perf_counter() - started)
+        return result
+
+def scale_estimate(ranges: typing.List[RangeEstimate]) -> TableEstimate:
+    """
+    Scales estimates for part of the token ring to the whole of it
+    """
+    ring_size = MAX_TOKEN - MIN_TOKEN + 1
+    # A range may wrap around the end of the ring, and one starting where it ends is the whole ring
+    covered = sum([(entry.token_range.end - entry.token_range.start) % ring_size or ring_size for entry in ranges])
+    coverage = min(covered / ring_size, 1.0)
+    if coverage == 0:
+        return TableEstimate(0, 0, ranges, coverage)
+
+    partitions = sum([entry.partitions for entry in ranges])
+    estimated_bytes = sum([entry.bytes for entry in ranges])
+    return TableEstimate(int(partitions / coverage), int(estimated_bytes / coverage), ranges, coverage)
+
+def lookup_rows(lookup: CORMDetails, rows: typing.List[typing.List[typing.Any]]) -> typing.List[typing.List[typing.Any]]:
+    """
+    Rows with every key of the lookup table set. The rest have no lookup row, as Cassandra rejects null keys
+    """
+    field_names = lookup.field_names + ['guid']
+    key_indexes = [field_names.index(key) for key in lookup.primary_keys]
+    return [row for row in rows if all([not row[idx] is None and not row[idx] is UNSET_VALUE for idx in key_indexes])]
+
+def lookup_changes(table: CORMDetails, before: typing.List[typing.Any], after: typing.List[typing.Any]) -> \
+        typing.List[typing.Tuple[CORMDetails, typing.List[typing.List[typing.Any]], typing.List[typing.List[typing.Any]]]]:
+    """
+    For rows of the table going from before to after, None where there is no row, each lookup table with the
+    keys of its rows to delete and the rows to write
+    """
+    field_names = table.field_names + ['guid']
+    changes = []
+    for lookup in table.lookups:
+        key_indexes = [field_names.index(key) for key in lookup.primary_keys]
+        stale_keys = []
+        rows = []
+        for old_row, new_row in zip(before, after):
+            new_rows = lookup_rows(lookup, [new_row] if new_row else [])
+            new_keys = [[row[idx] for idx in key_indexes] for row in new_rows]
+            for row in lookup_rows(lookup, [old_row] if old_row else []):
+                if not [row[idx] for idx in key_indexes] in new_keys:
+                    stale_keys.append([row[idx] for idx in key_indexes])
+
+            rows.extend(new_rows)
+
+        changes.append((lookup, stale_keys, rows))
+
+    return changes
+
+def lookup_sources(mutations: typing.List[Mutation]) -> typing.List[int]:
+    """
+    Indexes of the mutations whose table has lookup tables to keep in step
+    """
+    return [idx for idx, mutation in enumerate(mutations) if mutation.table._corm_details.lookups]
+
+def _collection_append(current: typing.Any, value: typing.Any) -> typing.Any:
+    if current is None:
+        return value
+
+    elif isinstance(current, dict):
+        return {**current, **value}
+
+    elif isinstance(current, list):
+        return current + list(value)
+
+    return set(current) | set(value)
+
+def _collection_remove(current: typing.Any, value: typing.Any) -> typing.Any:
+    if current is None:
+        return None
+
+    elif isinstance(current, dict):
+        remaining = {key: entry for key, entry in current.items() if not key in value}
+
+    elif isinstance(current, list):
+        remaining = [entry for entry in current if not entry in value]
+
+    else:
+        remaining = set(current) - set(value)
+
+    # Cassandra doesn't tell an empty collection from a null one
+    return remaining or None
+
+class MemoryResultSet:
+    """
+    Pages over an already materialised list of rows, with the same surface select uses on the driver's ResultSet
+    """
+    def __init__(self: PWN, rows: typing.List[typing.Any], fetch_size: int, paging_state: bytes = None) -> None:
+        self._rows = rows
+        self._fetch_size = fetch_size or len(rows) or 1
+        # The paging state is the offset of the next row
+        self._offset = 0 if paging_state is None else int(paging_state.decode(ENCODING))
+        self.current_rows = []
+        self.fetch_next_page()
+
+    @property
+    def has_more_pages(self: PWN) -> bool:
+        return self._offset < len(self._rows)
+
+    @property
+    def paging_state(self: PWN) -> bytes:
+        return str(self._offset).encode(ENCODING) if self.has_more_pages else None
+
+    def fetch_next_page(self: PWN) -> None:
+        self.current_rows = self._rows[self._offset:self._offset + self._fetch_size]
+        self._offset += len(self.current_rows)
+
+MEMORY_AGGREGATES = {
+    'count': len,
+    'min': lambda values: min(values) if values else None,
+    'max': lambda values: max(values) if values else None,
+    'sum': sum,
+}
+
+class _MemoryTable(typing.NamedTuple):
+    details: CORMDetails
+    rows: typing.Dict[typing.Tuple[typing.Any], typing.Dict[str, typing.Any]]
+
+def memory_token(partition_values: typing.List[typing.Any]) -> int:
+    """
+    Stable signed 64 bit token for the in-memory ring. It doesn't match Murmur3, but splits of the ring
+    still cover every row exactly once
+    """
+    digest = hashlib.md5(repr(partition_values).encode(ENCODING)).digest()
+    return max(int.from_bytes(digest[:8], 'big', signed=True), MIN_TOKEN + 1)
+
+class MemoryBackend(Backend):
+    """
+    Driver-free backend holding every table in process, keyed by primary key. Nothing is sent over the
+    network, so tests and profiles measure corm's own CPU cost
+    """
+    def __init__(self: PWN) -> None:
+        self._keyspaces = {}
+        # Conditional writes check and write under one lock, as Paxos would serialise them
+        self._lock = threading.Lock()
+
+    def _keyspace(self: PWN, keyspace_name: str) -> typing.Dict[str, _MemoryTable]:
+        if not keyspace_name in self._keyspaces.keys():
+            raise NotImplementedError(f'Keyspace[{keyspace_name}] does not exist')
+
+        return self._keyspaces[keyspace_name]
+
+    def _table(self: PWN, table: CORMDetails) -> _MemoryTable:
+        memory_table = self._keyspace(table.keyspace).get(table.table_name, None)
+        if memory_table is None:
+            raise NotImplementedError(f'Table[{table.table_name}] does not exist in Keyspace[{table.keyspace}]')
+
+        return memory_table
+
+    def keyspace_exists(self: PWN, keyspace_name: str) -> bool:
+        return keyspace_name in self._keyspaces.keys()
+
+    def keyspace_create(self: PWN, keyspace_name: str, strategy: CassandraKeyspaceStrategy) -> None:
+        self._keyspaces.setdefault(keyspace_name, {})
+
+    def keyspace_destroy(self: PWN, keyspace_name: str) -> None:
+        self._keyspaces.pop(keyspace_name, None)
+
+    def annihilate_keyspace_tables(self: PWN, keyspace_name: str) -> None:
+        if keyspace_name in self._keyspaces.keys():
+            self._keyspaces[keyspace_name] = {}
+
+    def sync_schema(self: PWN, udts: typing.List[typing.Any], tables: typing.List[CORMDetails]) -> None:
+        for table in tables:
+            self.keyspace_create(table.keyspace, CassandraKeyspaceStrategy.Simple)
+            existing = self._keyspaces[table.keyspace].get(table.table_name, None)
+            rows = existing.rows if existing else {}
+            # Columns added or dropped by the new definition show up as missing or ignored keys
+            self._keyspaces[table.keyspace][table.table_name] = _MemoryTable(table, rows)
+
+    def _row_key(self: PWN, table: CORMDetails, row: typing.Dict[str, typing.Any]) -> typing.Tuple[typing.Any]:
+        return tuple([row[key] for key in table.primary_keys])
+
+    def insert(self: PWN, table: CORMDetails, rows: typing.List[typing.List[typing.Any]], trace: bool = False,
+            execution_profile: typing.Any = EXEC_PROFILE_DEFAULT) -> None:
+        field_names = table.field_names + ['guid']
+        for target in [table] + table.lookups:
+            memory_table = self._table(target)
+            for values in rows if target is table else lookup_rows(target, rows):
+                # Like Cassandra, an insert is an upsert and unset columns keep their current value
+                row = {field_name: value for field_name, value in zip(field_names, values) if not value is UNSET_VALUE}
+                memory_table.rows.setdefault(self._row_key(target, row), {}).update(row)
+
+    def insert_concurrent(self: PWN, table: CORMDetails, rows: typing.List[typing.List[typing.Any]], concurrency: int,
+            execution_profile: typing.Any = EXEC_PROFILE_DEFAULT) -> typing.List[ExecutionResult]:
+        self.insert(table, rows)
+        return [ExecutionResult(True, None) for row in rows]
+
+    def _apply(self: PWN, mutation: Mutation) -> CASResult:
+        table = mutation.table._corm_details
+        memory_table = self._table(table)
+        key = self._row_key(table, mutation.values)
+        existing = memory_table.rows.get(key, None)
+        before = [existing.get(field_name, None) for field_name in table.field_names + ['guid']] if existing is not None else None
+        values = {field_name: value for field_name, value in mutation.values.items() if not value is UNSET_VALUE}
+        if mutation.conditions:
+            current = existing or {}
+            if not all([cp_func.matches(mutation.table, current.get(cp_func.field_name, None)) for cp_func in mutation.conditions]):
+                return CASResult(False, {cp_func.field_name: current.get(cp_func.field_name, None) for cp_func in mutation.conditions})
+
+        elif mutation.if_exists and existing is None:
+            return CASResult(False)
+
+        elif mutation.if_not_exists and existing is not None:
+            return CASResult(False, dict(existing))
+
+        if mutation.kind is MutationKind.Insert or mutation.kind is MutationKind.Update:
+            row = memory_table.rows.setdefault(key, {})
+            row.update(values)
+            for field_name, value in mutation.appends.items():
+                row[field_name] = _collection_append(row.get(field_name, None), value)
+
+            for field_name, value in mutation.removes.items():
+                row[field_name] = _collection_remove(row.get(field_name, None), value)
+
+        elif mutation.kind is MutationKind.Delete:
+            memory_table.rows.pop(key, None)
+
+        else:
+            raise NotImplementedError(mutation.kind)
+
+        # Lookup rows move with the row, under the same lock
+        field_names = table.field_names + ['guid']
+        current = memory_table.rows.get(key, None)
+        after = [current.get(field_name, None) for field_name in field_names] if current is not None else None
+        for lookup, stale_keys, rows in lookup_changes(table, [before], [after]):
+            lookup_table = self._table(lookup)
+            for stale_key in stale_keys:
+                lookup_table.rows.pop(tuple(stale_key), None)
+
+            for values in rows:
+                row = dict(zip(field_names, values))
+                lookup_table.rows[self._row_key(lookup, row)] = row
+
+        return CASResult(True)
+
+    def execute_mutations(self: PWN, mutations: typing.List[Mutation], concurrency: int) -> typing.List[ExecutionResult]:
+        with self._lock:
+            return [ExecutionResult(self._apply(mutation).applied, None) for mutation in mutations]
+
+    def execute_batch(self: PWN, mutations: typing.List[Mutation]) -> None:
+        with self._lock:
+            for mutation in mutations:
+                self._apply(mutation)
+
+    def execute_cas(self: PWN, mutations: typing.List[Mutation], concurrency: int) -> typing.List[CASResult]:
+        with self._lock:
+            return [self._apply(mutation) for mutation in mutations]
+
+    def _sorted_rows(self: PWN, table: CORMDetails, rows: typing.List[typing.Dict[str, typing.Any]]) -> typing.List[typing.Dict[str, typing.Any]]:
+        # Token order across partitions, clustering order inside them, as Cassandra returns a full scan
+        partition_keys = table.partition_keys
+        if table.ordered_by_primary_keys is TableOrdering.Nope:
+            return sorted(rows, key=lambda row: memory_token([row[key] for key in partition_keys]))
+
+        clustering_key = table.pk_fields[-1]
+        rows = sorted(rows, key=lambda row: row[clustering_key], reverse=table.ordered_by_primary_keys is TableOrdering.DESC)
+        return sorted(rows, key=lambda row: memory_token([row[key] for key in partition_keys]))
+
+    def _aggregate(self: PWN, query: SelectQuery, rows: typing.List[typing.Dict[str, typing.Any]]) -> typing.List[typing.Tuple[typing.Any]]:
+        # One tuple per group, group values then aggregates, like Cassandra's GROUP BY. Ungrouped, always one row
+        groups = {} if query.group_by else {(): []}
+        for row in rows:
+            groups.setdefault(tuple([row[key] for key in query.group_by]), []).append(row)
+
+        results = []
+        for group, group_rows in groups.items():
+            values = []
+            for function, field_name in query.aggregates:
+                column = [row.get(field_name, None) for row in group_rows] if field_name != '*' else group_rows
+                values.append(MEMORY_AGGREGATES[function]([value for value in column if value is not None]))
+
+            results.append(group + tuple(values))
+
+        return results
+
+    def estimate(self: PWN, table: CORMDetails) -> TableEstimate:
+        # Exact partition counts, with the rows' repr standing in for their size on disk
+        rows = self._table(table).rows.values()
+        partition_bytes = {}
+        for row in rows:
+            partition = tuple([row.get(key, None) for key in table.partition_keys])
+            partition_bytes[partition] = partition_bytes.get(partition, 0) + len(repr(row).encode(ENCODING))
+
+        mean_partition_bytes = sum(partition_bytes.values()) // len(partition_bytes) if partition_bytes else 0
+        return scale_estimate([RangeEstimate(TokenRange(MIN_TOKEN, MAX_TOKEN), len(partition_bytes), mean_partition_bytes)])
+
+    def execute_select(self: PWN, query: SelectQuery) -> MemoryResultSet:
+        table = query.table._corm_details
+        partition_keys = table.partition_keys
+        # Reads go where Cassandra would send them. Views and indexes aren't kept apart, so they read the table
+        route = self.select_route(query)
+        source = {lookup.table_name: lookup for lookup in table.lookups}.get(route.table_name, table)
+        matched = []
+        for row in self._sorted_rows(source, self._table(source).rows.values()):
+            if query.token_range:
+                token = memory_token([row[key] for key in partition_keys])
+                if not query.token_range.start < token <= query.token_range.end:
+                    continue
+
+            if all([cp_func.matches(query.table, row.get(cp_func.field_name, None)) for cp_func in query.compare_functions]):
+                matched.append(row)
+
+        if query.aggregates:
+            return MemoryResultSet(self._aggregate(query, matched), query.fetch_size, query.paging_state)
+
+        if query.limit > 0:
+            matched = matched[:query.limit]
+
+        Row = collections.namedtuple('Row', query.field_names)
+        return MemoryResultSet([Row(*[row.get(field_name, None) for field_name in query.field_names]) for row in matched], query.fetch_size,
+            query.paging_state)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+import argparse
+import collections
+import enum
+import logging
+import os
+import platform
+import sys
+import time
+import types
+import typing
+import uuid
+
+import ujson as json
+
+from corm import register_table, decode_row
+from corm.constants import PWN
+from corm.models import CORMBase
+from corm.utils import generate_strings
+
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BENCH_KEYSPACE = 'corm_bench'
+
+class BenchOption(enum.Enum):
+    Alpha = 'alpha'
+    Beta = 'beta'
+    Gamma = 'gamma'
+
+class BenchModel(CORMBase):
+    __keyspace__ = BENCH_KEYSPACE
+
+    symbol: str
+    name: str
+    volume: int
+    price: float
+    active: bool
+    created: datetime
+    identity: uuid.UUID
+    option: BenchOption
+
+class BenchResult(typing.NamedTuple):
+    name: str
+    kind: str
+    operations: int
+    seconds: float
+
+    @property
+    def ops_per_second(self: PWN) -> float:
+        if self.seconds <= 0:
+            return float(self.operations)
+
+        return self.operations / self.seconds
+
+    def as_dict(self: PWN) -> typing.Dict[str, typing.Any]:
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'operations': self.operations,
+            'seconds': self.seconds,
+            'ops_per_second': self.ops_per_second,
+        }
+
+def corm_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version('cassandra-orm')
+    except Exception:
+        return 'unknown'
+
+def generate_bench_entries(count: int) -> typing.List[BenchModel]:
+    symbols = generate_strings(count, 4)
+    names = generate_strings(count, 32)
+    options = [member for member in BenchOption.__members__.values()]
+    now = datetime.utcnow().replace(microsecond=0)
+    return [BenchModel(symbols[idx], names[idx], idx, idx * 0.5, idx % 2 == 0, now, uuid.uuid4(), options[idx % len(options)])
+            for idx in range(0, count)]
+
+def _measure(name: str, kind: str, func: types.FunctionType, operations: int, rounds: int) -> BenchResult:
+    # Best of rounds, so one-off pauses don't show up as regressions
+    best = None
+    for idx in range(0, rounds):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return BenchResult(name, kind, operations, best)
+
+def run_micro_benchmarks(count: int = 10000, rounds: int = 5) -> typing.List[BenchResult]:
+    """
+    Pure-Python hot paths, no cluster connection required
+    """
+    register_table(BenchModel)
+    entries = generate_bench_entries(count)
+    RawRow = collections.namedtuple('RawRow', BenchModel._corm_details.field_names)
+    raw_rows = [RawRow(*entry.values()) for entry in entries]
+    return [
+        _measure('encode.values', 'micro', lambda: [entry.values() for entry in entries], count, rounds),
+        _measure('encode.as_hash', 'micro', lambda: [entry.as_hash() for entry in entries], count, rounds),
+        _measure('decode.row', 'micro', lambda: [decode_row(BenchModel, row) for row in raw_rows], count, rounds),
+    ]
+
+def run_macro_benchmarks(count: int = 10000, rounds: int = 3, batch_size: int = 50) -> typing.List[BenchResult]:
+    """
+    End to end against the active backend. With the default backend that is the cluster in CLUSTER_IPS,
+    meant for a local single-node stand-in
+    """
+    from corm import sync_schema, insert, insert_concurrent, select, where, cp, Operator, keyspace_destroy
+
+    register_table(BenchModel)
+    results = [_measure('sync_schema', 'macro', sync_schema, 1, 1)]
+    entries = generate_bench_entries(count)
+    batches = [entries[idx:idx + batch_size] for idx in range(0, count, batch_size)]
+    try:
+        results.append(_measure('insert.batch', 'macro', lambda: [insert(batch) for batch in batches], count, rounds))
+        results.append(_measure('insert.concurrent', 'macro', lambda: insert_concurrent(entries), count, rounds))
+        results.append(_measure('select.scan', 'macro', lambda: [entry for entry in select(BenchModel, fetch_size=1000)], count, rounds))
+        symbol = entries[0].symbol
+        results.append(_measure('where.equal', 'macro',
+            lambda: [entry for entry in where(BenchModel, [cp(Operator.Equal, 'symbol', symbol)])], 1, rounds))
+
+    finally:
+        keyspace_destroy(BENCH_KEYSPACE)
+
+    return results
+
+def obtain_options() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--macro', action='store_true', default=False,
+            help='Also run benchmarks against the cluster in CLUSTER_IPS')
+    parser.add_argument('--memory', action='store_true', default=False,
+            help='Run the macro benchmarks against the in-memory backend, isolating corm from network time')
+    parser.add_argument('-n', '--count', type=int, default=10000)
+    parser.add_argument('-r', '--rounds', type=int, default=5)
+    parser.add_argument('-o', '--output', type=str, default=None,
+            help='Write the JSON report to a file instead of stdout')
+    return parser.parse_args()
+
+def main() -> None:
+    options = obtain_options()
+    results = run_micro_benchmarks(options.count, options.rounds)
+    if options.macro:
+        if options.memory:
+            from corm import set_backend
+            from corm.backends import MemoryBackend
+
+            set_backend(MemoryBackend())
+
+        results.extend(run_macro_benchmarks(options.count, options.rounds))
+
+    report = json.dumps({
+        'corm_version': corm_version(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'created': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'results': [result.as_dict() for result in results],
+    }, indent=2)
+    if options.output:
+        with open(options.output, 'w') as stream:
+            stream.write(report)
+
+    else:
+        sys.stdout.write(f'{report}\n')
+
+def run_from_cli():
+    sys.path.append(os.getcwd())
+    main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import contextlib
+import threading
+import time
+import types
+import typing
+
+from corm.constants import PWN, CORM_CONCURRENCY_INITIAL, CORM_CONCURRENCY_MIN, CORM_CONCURRENCY_MAX, \
+        CORM_CONCURRENCY_TARGET_SECONDS
+from corm.metrics import REGISTRY
+
+from cassandra import WriteTimeout, ReadTimeout, Unavailable, OperationTimedOut
+from cassandra.cluster import NoHostAvailable, EXEC_PROFILE_DEFAULT
+from cassandra.concurrent import ExecutionResult
+from cassandra.protocol import OverloadedErrorMessage
+
+# Errors meaning the cluster is shedding load, rather than the statement being wrong
+OVERLOAD_ERRORS = (WriteTimeout, ReadTimeout, Unavailable, OperationTimedOut, OverloadedErrorMessage)
+
+def is_overload(error: Exception) -> bool:
+    if isinstance(error, NoHostAvailable):
+        # Every host was tried, each failure is listed per host
+        return any([is_overload(entry) for entry in (error.errors or {}).values()])
+
+    return isinstance(error, OVERLOAD_ERRORS)
+
+class AdaptiveLimiter:
+    """
+    AIMD in-flight limit. Every request completing within target_seconds adds 1 / limit, so the limit grows
+    by about one per round trip while latencies are healthy. A timeout or overload error multiplies the limit
+    by backoff, at most once per target_seconds so a burst of failures from one round only counts once.
+    Slow successes hold the limit where it is
+    """
+    def __init__(self: PWN, name: str = 'default', initial: int = CORM_CONCURRENCY_INITIAL, minimum: int = CORM_CONCURRENCY_MIN,
+            maximum: int = CORM_CONCURRENCY_MAX, target_seconds: float = CORM_CONCURRENCY_TARGET_SECONDS, backoff: float = 0.5) -> None:
+        if not minimum <= initial <= maximum:
+            raise NotImplementedError(f'Initial[{initial}] outside Minimum[{minimum}] and Maximum[{maximum}]')
+
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.backoff = backoff
+        self.in_flight = 0
+        self._limit = float(initial)
+        self._backed_off = 0.0
+        self._condition = threading.Condition()
+        self._publish()
+
+    @property
+    def limit(self: PWN) -> int:
+        return int(self._limit)
+
+    def _publish(self: PWN) -> None:
+        # Only written when the limit moves, so it is kept whether or not the registry is enabled
+        REGISTRY.set_gauge('corm_concurrency_limit', {'limiter': self.name}, self.limit)
+
+    def acquire(self: PWN, timeout: float = None) -> bool:
+        with self._condition:
+            acquired = self._condition.wait_for(lambda: self.in_flight < self.limit, timeout)
+            if acquired:
+                self.in_flight += 1
+
+            return acquired
+
+    def release(self: PWN, seconds: float, error: Exception = None) -> None:
+        previous = self.limit
+        with self._condition:
+            self.in_flight -= 1
+            if error is not None and is_overload(error):
+                now = time.monotonic()
+                if now - self._backed_off >= self.target_seconds:
+                    self._backed_off = now
+                    self._limit = max(self.minimum, self._limit * self.backoff)
+
+            elif error is None and seconds <= self.target_seconds:
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+
+            self._condition.notify_all()
+
+        if self.limit != previous:
+            self._publish()
+
+    @contextlib.contextmanager
+    def slot(self: PWN) -> types.GeneratorType:
+        """
+        Holds one in-flight slot around a synchronous request, such as fetching a page
+        """
+        self.acquire()
+        started = time.perf_counter()
+        try:
+            yield self
+
+        except Exception as err:
+            self.release(time.perf_counter() - started, err)
+            raise
+
+        self.release(time.perf_counter() - started)
+
+LIMITER = AdaptiveLimiter()
+
+def execute_adaptive(session: typing.Any, statements_and_parameters: typing.Iterable[typing.Tuple[typing.Any, typing.Any]],
+        concurrency: int = CORM_CONCURRENCY_MAX, limiter: AdaptiveLimiter = None,
+        execution_profile: typing.Any = EXEC_PROFILE_DEFAULT) -> types.GeneratorType:
+    """
+    Like cassandra.concurrent.execute_concurrent with raise_on_first_error=False and results_generator=True,
+    except requests only go out while the limiter has room. Yields ExecutionResults in submission order.
+    concurrency caps this call on top of the shared limit
+    """
+    limiter = limiter or LIMITER
+    local_slots = threading.BoundedSemaphore(concurrency)
+    condition = threading.Condition()
+    completed = {}
+    submitted = 0
+    next_idx = 0
+
+    def _complete(idx: int, started: float, result: ExecutionResult) -> None:
+        limiter.release(time.perf_counter() - started, None if result.success else result.result_or_exc)
+        local_slots.release()
+        with condition:
+            completed[idx] = result
+            condition.notify_all()
+
+    def _ready() -> typing.List[ExecutionResult]:
+        nonlocal next_idx
+        ready = []
+        with condition:
+            while next_idx in completed:
+                ready.append(completed.pop(next_idx))
+                next_idx += 1
+
+        return ready
+
+    for statement, parameters in statements_and_parameters:
+        local_slots.acquire()
+        limiter.acquire()
+        idx, started = submitted, time.perf_counter()
+        submitted += 1
+        try:
+            response_future = session.execute_async(statement, parameters, execution_profile=execution_profile)
+        except Exception as err:
+            _complete(idx, started, ExecutionResult(False, err))
+
+        else:
+            response_future.add_callbacks(
+                callback=lambda rows, idx=idx, started=started:
+                    _complete(idx, started, ExecutionResult(True, rows)),
+                errback=lambda err, idx=idx, started=started: _complete(idx, started, ExecutionResult(False, err)))
+
+        yield from _ready()
+
+    while next_idx < submitted:
+        with condition:
+            condition.wait_for(lambda: next_idx in completed)
+
+        yield from _ready()
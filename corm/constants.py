@@ -2,13 +2,39 @@ import os
 import typing
 
 ENCODING = 'utf-8'
-CLUSTER_IPS = [cluster_ip for cluster_ip in os.environ['CLUSTER_IPS'].split(',') if cluster_ip]
-if len(CLUSTER_IPS) < 1:
-    raise NotImplementedError('CLUSTER_IPS ENVVar required')
+# Validated on first connection, so corm can be imported and profiled without a cluster
+CLUSTER_IPS = [cluster_ip for cluster_ip in os.environ.get('CLUSTER_IPS', '').split(',') if cluster_ip]
 CLUSTER_PORT = int(os.environ.get('CLUSTER_PORT', 9042))
 CLUSTER_USERNAME = os.environ.get('CLUSTER_USERNAME', None)
 CLUSTER_PASSWORD = os.environ.get('CLUSTER_PASSWORD', None)
+# cassandra or memory, see corm.backends
+CORM_BACKEND = os.environ.get('CORM_BACKEND', 'cassandra')
+# Record corm.metrics from import time, instead of waiting for enable_metrics()
+CORM_METRICS = os.environ.get('CORM_METRICS', 'false').lower() in ['true', '1', 'yes']
+# Fraction of select, where and insert calls executed with driver tracing, unless trace= is passed
+CORM_TRACE_SAMPLE_RATE = float(os.environ.get('CORM_TRACE_SAMPLE_RATE', 0))
+CORM_SLOW_QUERY_SECONDS = float(os.environ.get('CORM_SLOW_QUERY_SECONDS', 1.0))
+CORM_SLOW_QUERY_LOG = os.environ.get('CORM_SLOW_QUERY_LOG', None)
+# Estimated partitions above which ALLOW FILTERING queries log a warning
+CORM_FILTERING_WARN_PARTITIONS = int(os.environ.get('CORM_FILTERING_WARN_PARTITIONS', 100000))
+# Hash timestamps as DATETIME_FORMAT text like corm did before epoch milliseconds, so guids of existing rows stay put
+CORM_LEGACY_DATETIME_HASH = os.environ.get('CORM_LEGACY_DATETIME_HASH', 'false').lower() in ['true', '1', 'yes']
+# How long CassandraBackend keeps system.size_estimates figures, which Cassandra refreshes every 5 minutes
+CORM_ESTIMATE_CACHE_SECONDS = float(os.environ.get('CORM_ESTIMATE_CACHE_SECONDS', 300))
+# corm.Writer bounds: rows held in memory, and the size or age at which they are flushed
+CORM_WRITER_MAX_PENDING = int(os.environ.get('CORM_WRITER_MAX_PENDING', 10000))
+CORM_WRITER_FLUSH_ROWS = int(os.environ.get('CORM_WRITER_FLUSH_ROWS', 500))
+CORM_WRITER_FLUSH_SECONDS = float(os.environ.get('CORM_WRITER_FLUSH_SECONDS', 0.1))
+# corm.concurrency.LIMITER, the in-flight limit shared by bulk writes, page fetches and ETL
+CORM_CONCURRENCY_INITIAL = int(os.environ.get('CORM_CONCURRENCY_INITIAL', 32))
+CORM_CONCURRENCY_MIN = int(os.environ.get('CORM_CONCURRENCY_MIN', 1))
+CORM_CONCURRENCY_MAX = int(os.environ.get('CORM_CONCURRENCY_MAX', 512))
+# Latency under which the limit keeps growing
+CORM_CONCURRENCY_TARGET_SECONDS = float(os.environ.get('CORM_CONCURRENCY_TARGET_SECONDS', 0.1))
 TABLES = {}
 SESSIONS = {}
 DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Murmur3Partitioner token ring bounds
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
 PWN = typing.TypeVar('PWN')
@@ -13,6 +13,8 @@ class Transliterator(typing.NamedTuple):
     python_to_cql: types.FunctionType
     cql_to_python: types.FunctionType
     values_encode_exemption: bool = False
+    # JSON friendly encoding for as_hash, when python_to_cql's output isn't
+    python_to_hash: types.FunctionType = None
 
 class EnumTransliterator(typing.NamedTuple):
     python_type: enum.Enum
@@ -20,6 +22,7 @@ class EnumTransliterator(typing.NamedTuple):
     python_to_cql: types.FunctionType = lambda x: x.value
     # cql_to_python: types.FunctionType = lambda x: x
     values_encode_exemption: bool = False
+    python_to_hash: types.FunctionType = None
 
     @property
     def cql_to_python(self) -> typing.Any:
@@ -32,11 +35,104 @@ class EnumTransliterator(typing.NamedTuple):
 
         return _find_member
 
+class TokenRange(typing.NamedTuple):
+    start: int
+    end: int
+
+    def as_cql(self: PWN, partition_keys: typing.List[str]) -> str:
+        formatted_partition_keys = ','.join(partition_keys)
+        return f'token({formatted_partition_keys}) > {self.start} AND token({formatted_partition_keys}) <= {self.end}'
+
+class RangeEstimate(typing.NamedTuple):
+    token_range: TokenRange
+    partitions: int
+    mean_partition_bytes: int
+
+    @property
+    def bytes(self: PWN) -> int:
+        return self.partitions * self.mean_partition_bytes
+
+class TableEstimate(typing.NamedTuple):
+    """
+    Approximate table size. ranges are the token ranges the figures were read from and coverage the share
+    of the token ring they span, partitions and bytes are scaled from them to the whole ring
+    """
+    partitions: int
+    bytes: int
+    ranges: typing.List[RangeEstimate] = []
+    coverage: float = 0.0
+
+class PartitionProfile(typing.NamedTuple):
+    sampled_ranges: int
+    # Partitions and rows found in the sampled ranges
+    partitions: int
+    rows: int
+    max_rows: int
+    # Partitions in the whole table, extrapolated from the sample
+    estimated_partitions: int
+    # (partition key values, rows) of the widest sampled partitions, widest first
+    widest: typing.List[typing.Tuple[typing.Tuple[typing.Any], int]] = []
+
+    @property
+    def mean_rows(self: PWN) -> float:
+        return self.rows / self.partitions if self.partitions else 0.0
+
 class TableOrdering(enum.Enum):
     DESC = 'desc'
     ASC = 'asc'
     Nope = 'nope'
 
+class IndexKind(enum.Enum):
+    Secondary = 'secondary'
+    # Storage attached index, Cassandra 5.0+ and DSE 6.8+
+    SAI = 'sai'
+
+class IndexDetails(typing.NamedTuple):
+    field_name: str
+    kind: IndexKind = IndexKind.Secondary
+
+    def as_create_index_cql(self: PWN, keyspace: str, table_name: str) -> str:
+        cql = f'CREATE INDEX IF NOT EXISTS {table_name}_{self.field_name}_idx ON {keyspace}.{table_name} ({self.field_name})'
+        if self.kind is IndexKind.SAI:
+            cql = f"{cql} USING 'StorageAttachedIndex'"
+
+        return f'{cql};'
+
+class ViewDetails(typing.NamedTuple):
+    """
+    A materialized view holding every column of its table, keyed by partition_keys. The table's primary
+    keys not in partition_keys become its clustering keys
+    """
+    view_name: str
+    partition_keys: typing.List[str]
+    clustering_keys: typing.List[str]
+
+    @property
+    def primary_keys(self: PWN) -> typing.List[str]:
+        return self.partition_keys + self.clustering_keys
+
+    def as_create_view_cql(self: PWN, table: 'CORMDetails') -> str:
+        formatted_not_nulls = ' AND '.join([f'{key} IS NOT NULL' for key in self.primary_keys])
+        formatted_partition_keys = ','.join(self.partition_keys)
+        formatted_primary_keys = ', '.join([f'({formatted_partition_keys})'] + self.clustering_keys)
+        cql = [f'CREATE MATERIALIZED VIEW IF NOT EXISTS {table.keyspace}.{self.view_name} AS ']
+        cql.append(f'SELECT * FROM {table.keyspace}.{table.table_name} WHERE {formatted_not_nulls}')
+        cql.append(f' PRIMARY KEY({formatted_primary_keys})')
+        if not table.ordered_by_primary_keys is TableOrdering.Nope and self.clustering_keys:
+            # Keep the table's sort order for its sort field, the other clustering keys ascending
+            formatted_ordering = ', '.join([f'{key} {table.ordered_by_primary_keys.value if key == table.pk_fields[-1] else "asc"}'
+                for key in self.clustering_keys])
+            cql.append(f' WITH CLUSTERING ORDER BY ({formatted_ordering})')
+
+        cql.append(';')
+        return ''.join(cql)
+
+class SelectRoute(typing.NamedTuple):
+    # Table or materialized view the select reads from
+    table_name: str
+    allow_filtering: bool
+    restricts_partition: bool
+
 class CORMDetails(typing.NamedTuple):
     keyspace: str
     table_name: str
@@ -44,6 +140,28 @@ class CORMDetails(typing.NamedTuple):
     field_transliterators: typing.List[Transliterator]
     pk_fields: typing.List[str]
     ordered_by_primary_keys: TableOrdering
+    indexes: typing.List[IndexDetails] = []
+    views: typing.List[ViewDetails] = []
+    lookups: typing.List['CORMDetails'] = []
+    # Set on lookup tables, which may cluster by several keys. Otherwise the last pk_field is the only one
+    clustering_keys: typing.List[str] = None
+
+    @property
+    def partition_keys(self: PWN) -> typing.List[str]:
+        if self.ordered_by_primary_keys is TableOrdering.Nope:
+            return ['guid']
+
+        elif self.clustering_keys is not None:
+            return [key for key in self.pk_fields if not key in self.clustering_keys]
+
+        return self.pk_fields[:-1]
+
+    @property
+    def primary_keys(self: PWN) -> typing.List[str]:
+        if self.ordered_by_primary_keys is TableOrdering.Nope:
+            return ['guid']
+
+        return self.pk_fields[:]
 
     def as_create_table_cql(self: PWN) -> str:
         entries = []
@@ -55,19 +173,113 @@ class CORMDetails(typing.NamedTuple):
         cql = [f'''CREATE TABLE IF NOT EXISTS {self.keyspace}.{self.table_name} (''']
         cql.append(','.join(entries))
         if not self.ordered_by_primary_keys is TableOrdering.Nope:
-            formatted_pk_fields = ','.join(self.pk_fields[:-1])
-            formatted_pk_fields = f'({formatted_pk_fields})'
+            partition_keys = self.partition_keys
+            clustering_keys = self.pk_fields[len(partition_keys):]
+            formatted_pk_fields = ','.join(partition_keys)
+            formatted_pk_fields = ', '.join([f'({formatted_pk_fields})'] + clustering_keys)
             sort_field = self.pk_fields[-1]
             cql.append(', guid TEXT')
-            cql.append(f', PRIMARY KEY({formatted_pk_fields}, {sort_field})')
+            cql.append(f', PRIMARY KEY({formatted_pk_fields})')
             cql.append(')')
-            cql.append(f' WITH CLUSTERING ORDER BY ({sort_field} {self.ordered_by_primary_keys.value});')
+            if clustering_keys:
+                # The last clustering key sorts by the table's ordering, any before it ascending
+                formatted_ordering = ', '.join([f'{key} {self.ordered_by_primary_keys.value if key == sort_field else "asc"}'
+                    for key in clustering_keys])
+                cql.append(f' WITH CLUSTERING ORDER BY ({formatted_ordering})')
+
+            cql.append(';')
         else:
             cql.append(', guid TEXT PRIMARY KEY')
             cql.append(');')
 
         return ''.join(cql)
 
+class SelectQuery(typing.NamedTuple):
+    table: typing.Any
+    field_names: typing.List[str]
+    compare_functions: typing.List[typing.Any] = []
+    limit: int = 0
+    token_range: TokenRange = None
+    fetch_size: int = 100
+    trace: bool = False
+    execution_profile: typing.Any = None
+    # Driver paging_state to resume from
+    paging_state: bytes = None
+    # (function, field_name) pairs such as ('max', 'score') or ('count', '*'), selected after field_names
+    aggregates: typing.List[typing.Tuple[str, str]] = []
+    group_by: typing.List[str] = []
+
+class Page(typing.NamedTuple):
+    rows: typing.List[typing.Any]
+    # Pass to page() for the next page, None after the last one
+    cursor: str = None
+
+class MutationKind(enum.Enum):
+    Insert = 'insert'
+    Update = 'update'
+    Delete = 'delete'
+
+class Mutation(typing.NamedTuple):
+    """
+    One write addressed by primary key. values holds encoded column values, primary key columns included,
+    and only the columns in values are written. conditions, if_exists or if_not_exists make it a
+    lightweight transaction
+    """
+    kind: MutationKind
+    table: typing.Any
+    values: typing.Dict[str, typing.Any]
+    conditions: typing.List[typing.Any] = []
+    if_exists: bool = False
+    if_not_exists: bool = False
+    # Encoded elements added to or removed from collection columns, for updates
+    appends: typing.Dict[str, typing.Any] = {}
+    removes: typing.Dict[str, typing.Any] = {}
+
+    @property
+    def is_conditional(self: PWN) -> bool:
+        return len(self.conditions) > 0 or self.if_exists or self.if_not_exists
+
+    @property
+    def partition(self: PWN) -> typing.Tuple[typing.Any]:
+        return tuple([self.values[key] for key in self.table._corm_details.partition_keys])
+
+    @property
+    def is_idempotent(self: PWN) -> bool:
+        # Replaying a transaction or a list append doesn't write the same result twice
+        if self.is_conditional:
+            return False
+
+        table = self.table._corm_details
+        changed_field_names = [field_name for field_name in self.appends.keys()] + [field_name for field_name in self.removes.keys()]
+        return not any([table.field_transliterators[table.field_names.index(field_name)].cql_type.upper().startswith('LIST')
+            for field_name in changed_field_names])
+
+class ConsistencyProfile(typing.NamedTuple):
+    """
+    An execution profile run at another consistency level, cloned from the named profile once connected
+    """
+    execution_profile: typing.Any
+    consistency_level: int
+
+class CASResult(typing.NamedTuple):
+    applied: bool
+    # Current values of the row, or of the conditioned columns, when the write was not applied
+    existing: typing.Dict[str, typing.Any] = {}
+
+class QueryEvent(typing.NamedTuple):
+    table_name: str
+    operation: str
+    seconds: float
+    rows: int = 0
+    pages: int = 0
+    batch_size: int = 0
+    errors: int = 0
+    coordinator: str = None
+    retries: int = 0
+
+    def as_dict(self: PWN) -> typing.Dict[str, typing.Any]:
+        return self._asdict()
+
 class CORMUDTDetails(typing.NamedTuple):
     keyspace: str
     name: str
@@ -1,38 +1,219 @@
+import calendar
+import enum
+import types
+import typing
 import uuid
 
-from corm.annotations import Set
-from corm.constants import DATETIME_FORMAT
-from corm.datatypes import Transliterator
+from corm.annotations import CollectionType, Set, List, Dict, Frozen, TimeUUID
+from corm.constants import DATETIME_FORMAT, CORM_LEGACY_DATETIME_HASH
+from corm.datatypes import Transliterator, EnumTransliterator
 from corm.models import CORMUDTBase
 
-from datetime import datetime
+from datetime import date, datetime, time, timezone
 
+EPOCH_DATE = date(1970, 1, 1)
 
-def datetime__python_to_cql(stamp: datetime) -> str:
-    return stamp.strftime(DATETIME_FORMAT)
+def datetime__python_to_cql(stamp: datetime) -> datetime:
+    # The driver binds aware datetimes by their UTC instant and treats naive ones as UTC already
+    if stamp.tzinfo is None:
+        return stamp.replace(tzinfo=timezone.utc)
 
+    return stamp
 
-def datetime__cql_to_python(stamp: str) -> datetime:
+def datetime__cql_to_python(stamp: typing.Any) -> datetime:
+    # The driver hands back naive UTC datetimes, truncated to milliseconds
     if isinstance(stamp, datetime):
-        return stamp
+        return stamp if stamp.tzinfo else stamp.replace(tzinfo=timezone.utc)
 
-    return datetime.strptime(stamp, DATETIME_FORMAT)
+    return datetime.strptime(stamp, DATETIME_FORMAT).replace(tzinfo=timezone.utc)
 
+def datetime__python_to_hash(stamp: datetime) -> int:
+    """
+    Milliseconds since the epoch, the precision Cassandra keeps, so a stamp hashes the same before and after a round trip
+    """
+    return calendar.timegm(stamp.utctimetuple()) * 1000 + stamp.microsecond // 1000
+
+def datetime__legacy_python_to_hash(stamp: datetime) -> str:
+    """
+    DATETIME_FORMAT text of the UTC stamp, the encoding guids were derived from before epoch milliseconds
+    """
+    return (stamp.astimezone(timezone.utc) if stamp.tzinfo else stamp).strftime(DATETIME_FORMAT)
+
+def date__cql_to_python(value: typing.Any) -> date:
+    # cassandra.util.Date
+    return value if isinstance(value, date) else value.date()
+
+def date__python_to_hash(value: date) -> int:
+    return (value - EPOCH_DATE).days
+
+def time__cql_to_python(value: typing.Any) -> time:
+    # cassandra.util.Time
+    return value if isinstance(value, time) else value.time()
+
+def time__python_to_hash(value: time) -> int:
+    # Nanoseconds since midnight, like CQL TIME
+    return (((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond) * 1000
 
 DT_MAP = {
     str: Transliterator(str, 'TEXT', lambda x: str(x), lambda x: str(x)),
     int: Transliterator(int, 'BIGINT', lambda x: int(x), lambda x: int(x)),
-    datetime: Transliterator(datetime, 'TIMESTAMP', datetime__python_to_cql, datetime__cql_to_python, True),
+    datetime: Transliterator(datetime, 'TIMESTAMP', datetime__python_to_cql, datetime__cql_to_python, False,
+        datetime__legacy_python_to_hash if CORM_LEGACY_DATETIME_HASH else datetime__python_to_hash),
+    date: Transliterator(date, 'DATE', lambda x: x, date__cql_to_python, True, date__python_to_hash),
+    time: Transliterator(time, 'TIME', lambda x: x, time__cql_to_python, True, time__python_to_hash),
+    TimeUUID: Transliterator(TimeUUID, 'TIMEUUID', lambda x: x, lambda x: x, True, str),
     Set: Transliterator(Set, 'SET<text>', lambda x: [i for i in x], lambda x: x),
     bool: Transliterator(bool, 'BOOLEAN', lambda x: x, lambda x: x),
     float: Transliterator(float, 'DOUBLE', lambda x: x, lambda x: x),
-    uuid.UUID: Transliterator(uuid.UUID, 'UUID', lambda x: x, lambda x: x),
+    uuid.UUID: Transliterator(uuid.UUID, 'UUID', lambda x: x, lambda x: x, False, str),
 }
 
 UDT_MAP = {}
 def setup_udt_transliterator(udt: CORMUDTBase) -> Transliterator:
-    if udt._udt_details.udt_key in UDT_MAP.keys():
-        raise NotImplementedError(f'Duplicate Transliterator[{udt}]')
+    udt_details = udt._udt_details
+    for registered in UDT_MAP.keys():
+        if not registered is udt and (registered._udt_details.keyspace, registered._udt_details.udt_key) == \
+                (udt_details.keyspace, udt_details.udt_key):
+            raise NotImplementedError(f'Duplicate Transliterator[{udt}]')
 
-    UDT_MAP[udt] = Transliterator(udt, udt._udt_details.udt_key, lambda x: x, lambda x: x)
+    UDT_MAP[udt] = udt_transliterator(udt)
     return UDT_MAP[udt]
+
+def udt_transliterator(udt: CORMUDTBase) -> Transliterator:
+    """
+    Compiles encode, decode and hash for one UDT. Values are handed to the driver as tuples in field order,
+    which it serialises positionally, and read back from the registered class or the driver's namedtuple
+    """
+    udt_details = udt._udt_details
+    field_names = udt_details.field_names
+    encoders = [_element_encoder(entry) for entry in udt_details.field_transliterators]
+    decoders = [_element_decoder(entry) for entry in udt_details.field_transliterators]
+    hashers = [hash_encoder(entry) for entry in udt_details.field_transliterators]
+    fields = list(zip(field_names, encoders, decoders, hashers))
+
+    def python_to_cql(value: CORMUDTBase) -> typing.Tuple[typing.Any]:
+        result = []
+        for field_name, encoder, decoder, hasher in fields:
+            entry = getattr(value, field_name, None)
+            result.append(entry if entry is None or encoder is None else encoder(entry))
+
+        return tuple(result)
+
+    def cql_to_python(value: typing.Any) -> CORMUDTBase:
+        if not isinstance(value, tuple):
+            value = [getattr(value, field_name, None) for field_name in field_names]
+
+        return udt(*[entry if entry is None or decoder is None else decoder(entry)
+            for (field_name, encoder, decoder, hasher), entry in zip(fields, value)])
+
+    def python_to_hash(value: CORMUDTBase) -> typing.Dict[str, typing.Any]:
+        result = {}
+        for field_name, encoder, decoder, hasher in fields:
+            entry = getattr(value, field_name, None)
+            result[field_name] = None if entry is None else hasher(entry)
+
+        return result
+
+    return Transliterator(udt, udt_details.udt_key, python_to_cql, cql_to_python, False, python_to_hash)
+
+def udt_field_transliterator(annotation: typing.Any) -> Transliterator:
+    # UDTs and collections inside a UDT have to be frozen
+    transliterator = obtain_transliterator(annotation)
+    return transliterator._replace(cql_type=_element_cql_type(transliterator))
+
+# Element types the driver encodes and decodes as they are, so collections of them pass through untouched
+PASSTHROUGH_TYPES = [str, int, float, bool, uuid.UUID, TimeUUID]
+COLLECTION_MAP = {}
+
+def obtain_transliterator(annotation: typing.Any) -> Transliterator:
+    if annotation in DT_MAP.keys():
+        return DT_MAP[annotation]
+
+    elif isinstance(annotation, CollectionType):
+        if not annotation in COLLECTION_MAP.keys():
+            COLLECTION_MAP[annotation] = collection_transliterator(annotation)
+
+        return COLLECTION_MAP[annotation]
+
+    elif isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+        return EnumTransliterator(annotation)
+
+    transliterator = UDT_MAP.get(annotation, None)
+    if transliterator is None:
+        raise NotImplementedError(f'Unsupported Annotation[{annotation}]')
+
+    return transliterator
+
+def hash_encoder(transliterator: Transliterator) -> types.FunctionType:
+    if transliterator.python_to_hash:
+        return transliterator.python_to_hash
+
+    return transliterator.python_to_cql
+
+def _element_cql_type(transliterator: Transliterator) -> str:
+    # Collections and UDTs nested in a collection have to be frozen
+    cql_type = transliterator.cql_type
+    if cql_type.upper().startswith('FROZEN<'):
+        return cql_type
+
+    elif isinstance(transliterator.python_type, CollectionType) or \
+            (isinstance(transliterator.python_type, type) and issubclass(transliterator.python_type, CORMUDTBase)):
+        return f'FROZEN<{cql_type}>'
+
+    return cql_type
+
+def _element_encoder(transliterator: Transliterator) -> types.FunctionType:
+    if transliterator.python_type in PASSTHROUGH_TYPES or transliterator.values_encode_exemption:
+        return None
+
+    return transliterator.python_to_cql
+
+def _element_decoder(transliterator: Transliterator) -> types.FunctionType:
+    if transliterator.python_type in PASSTHROUGH_TYPES:
+        return None
+
+    return transliterator.cql_to_python
+
+def collection_transliterator(annotation: CollectionType) -> Transliterator:
+    elements = [obtain_transliterator(argument) for argument in annotation.arguments]
+    formatted_cql_types = ', '.join([_element_cql_type(element) for element in elements])
+    if annotation.container is Frozen:
+        # Frozen UDT, written and read like the UDT itself
+        return elements[0]._replace(cql_type=f'FROZEN<{elements[0].cql_type}>')
+
+    cql_type = f'{annotation.container.cql_name}<{formatted_cql_types}>'
+    if annotation.frozen:
+        cql_type = f'FROZEN<{cql_type}>'
+
+    encoders = [_element_encoder(element) for element in elements]
+    decoders = [_element_decoder(element) for element in elements]
+    hashers = [hash_encoder(element) for element in elements]
+    passthrough = all([encoder is None for encoder in encoders])
+    if annotation.container is Set:
+        encoder, decoder, hasher = encoders[0], decoders[0], hashers[0]
+        container = frozenset if annotation.frozen else set
+        python_to_cql = lambda x: x if encoder is None else {encoder(i) for i in x}
+        cql_to_python = lambda x: container(x) if decoder is None else container([decoder(i) for i in x])
+        python_to_hash = lambda x: sorted([hasher(i) for i in x], key=str)
+
+    elif annotation.container is List:
+        encoder, decoder, hasher = encoders[0], decoders[0], hashers[0]
+        python_to_cql = lambda x: x if encoder is None else [encoder(i) for i in x]
+        cql_to_python = lambda x: list(x) if decoder is None else [decoder(i) for i in x]
+        python_to_hash = lambda x: [hasher(i) for i in x]
+
+    elif annotation.container is Dict:
+        key_encoder, value_encoder = encoders
+        key_decoder, value_decoder = decoders
+        key_hasher, value_hasher = hashers
+        python_to_cql = lambda x: x if passthrough else {(key_encoder or _identity)(k): (value_encoder or _identity)(v) for k, v in x.items()}
+        cql_to_python = lambda x: {(key_decoder or _identity)(k): (value_decoder or _identity)(v) for k, v in x.items()}
+        python_to_hash = lambda x: {str(key_hasher(k)): value_hasher(v) for k, v in x.items()}
+
+    else:
+        raise NotImplementedError(annotation.container)
+
+    return Transliterator(annotation, cql_type, python_to_cql, cql_to_python, passthrough, python_to_hash)
+
+def _identity(value: typing.Any) -> typing.Any:
+    return value
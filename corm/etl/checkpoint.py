@@ -0,0 +1,87 @@
+import logging
+import os
+import threading
+import typing
+
+import ujson as json
+
+from corm.constants import PWN, ENCODING
+from corm.datatypes import TokenRange
+from corm.etl.constants import CORM_CHECKPOINT_DIR
+from corm.utils import split_token_ring
+
+logger = logging.getLogger(__name__)
+
+class Checkpoint:
+    """
+    Local state file recording which token ranges of a table an ETL run has finished. A resumed run
+    reuses the recorded range split, so --workers may change between attempts
+    """
+    def __init__(self: PWN, name: str, resume: bool = False, directory: str = CORM_CHECKPOINT_DIR) -> None:
+        self.name = name
+        self._filepath = os.path.join(directory, f'{name}.json')
+        self._lock = threading.Lock()
+        self._range_count = None
+        self._completed = {}
+        self._options = {}
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        if resume and os.path.exists(self._filepath):
+            with open(self._filepath, 'r', encoding=ENCODING) as stream:
+                state = json.loads(stream.read())
+
+            self._range_count = state['range_count']
+            self._completed = {TokenRange(start, end): rows for start, end, rows in state['completed']}
+            self._options = state.get('options', {})
+            logger.info(f'Resuming Checkpoint[{name}] with {len(self._completed)}/{self._range_count} ranges complete')
+
+        elif os.path.exists(self._filepath):
+            os.remove(self._filepath)
+
+    @property
+    def completed_rows(self: PWN) -> int:
+        return sum(self._completed.values())
+
+    @property
+    def completed_ranges(self: PWN) -> int:
+        return len(self._completed)
+
+    def token_ranges(self: PWN, range_count: int) -> typing.List[TokenRange]:
+        if self._range_count is None:
+            self._range_count = range_count
+
+        return split_token_ring(self._range_count)
+
+    def require_option(self: PWN, option_name: str, value: typing.Any) -> None:
+        """
+        Records a setting the finished ranges' output depends on. A resumed run has to use the value the
+        first attempt ran with
+        """
+        if option_name in self._options and self._options[option_name] != value:
+            raise NotImplementedError(f'Checkpoint[{self.name}] started with {option_name}[{self._options[option_name]}], '
+                f'unable to resume with {option_name}[{value}]')
+
+        self._options[option_name] = value
+
+    def is_complete(self: PWN, token_range: TokenRange) -> bool:
+        return token_range in self._completed
+
+    def mark_complete(self: PWN, token_range: TokenRange, rows: int) -> None:
+        with self._lock:
+            self._completed[token_range] = rows
+            state = {
+                'range_count': self._range_count,
+                'completed': [[entry.start, entry.end, entry_rows] for entry, entry_rows in self._completed.items()],
+                'options': self._options,
+            }
+            # Write then rename, so a crash never leaves a truncated state file behind
+            tmp_filepath = f'{self._filepath}.tmp'
+            with open(tmp_filepath, 'w', encoding=ENCODING) as stream:
+                stream.write(json.dumps(state))
+
+            os.replace(tmp_filepath, self._filepath)
+
+    def finish(self: PWN) -> None:
+        if os.path.exists(self._filepath):
+            os.remove(self._filepath)
@@ -3,3 +3,12 @@ import os
 CORM_EXPORT_DIR = '/tmp/corm-exports'
 PSQL_CLUSTER_PORT = int(os.environ.get('PSQL_CLUSTER_PORT', 5432))
 PSQL_URI = os.environ.get('PSQL_URI', None)
+ETL_WORKERS = int(os.environ.get('CORM_ETL_WORKERS', os.cpu_count() or 1))
+ETL_FETCH_SIZE = int(os.environ.get('CORM_ETL_FETCH_SIZE', 5000))
+ETL_PIPE_DEPTH = int(os.environ.get('CORM_ETL_PIPE_DEPTH', 4))
+CORM_CHECKPOINT_DIR = os.environ.get('CORM_CHECKPOINT_DIR', '/tmp/corm-checkpoints')
+# Bytes per token range a transfer aims for, going by corm.estimate
+ETL_RANGE_BYTES = int(os.environ.get('CORM_ETL_RANGE_BYTES', 64 * 1024 * 1024))
+# Written for nulls in CSV exports, so they stay apart from empty strings. PostgreSQL COPY reads it back as NULL
+CSV_NULL = '\\N'
+ETL_CONCURRENCY = int(os.environ.get('CORM_ETL_CONCURRENCY', 128))
@@ -7,6 +7,30 @@ from corm.etl.helpers import rationalize_docker_containers, DBEngine
 from urllib.parse import urlparse
 
 
+class ExportCompression(enum.Enum):
+    GZip = 'gzip'
+    ZStandard = 'zstd'
+
+    @property
+    def file_extension(self: PWN) -> str:
+        if self is ExportCompression.GZip:
+            return '.gz'
+
+        return '.zst'
+
+class TransferStats(typing.NamedTuple):
+    table_name: str
+    rows: int
+    seconds: float
+    errors: int = 0
+
+    @property
+    def rows_per_second(self: PWN) -> float:
+        if self.seconds <= 0:
+            return float(self.rows)
+
+        return self.rows / self.seconds
+
 class ConnectionInfo(typing.NamedTuple):
     engine: DBEngine
     username: str
@@ -6,10 +6,16 @@ import logging
 import os
 import importlib
 import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 
 from corm import register_table
 from corm.constants import CLUSTER_IPS, CLUSTER_PORT
-from corm.etl.constants import PSQL_URI
+from corm.models import CORMBase
+from corm.etl.checkpoint import Checkpoint
+from corm.etl.constants import PSQL_URI, ETL_WORKERS, ETL_CONCURRENCY, CORM_EXPORT_DIR
+from corm.etl.datatypes import ExportCompression
 from corm.etl.utils import generate_sqlalchemy_metadata, generate_sqlalchemy_table, sync_sqlalchemy_schema, \
         migrate_data_to_sqlalchemy_table, ConnectionInfo, export_to_csv
 
@@ -23,29 +29,45 @@ logger = logging.getLogger(__name__)
 class Mode(enum.Enum):
     CassandraToPostgreSQL = 'cassandra-to-postgresql'
     CassandraToCSV = 'cassandra-to-csv'
+    CassandraToParquet = 'cassandra-to-parquet'
     CassandraGenerateEntries = 'cassandra-generate-data'
+    FileToCassandra = 'file-to-cassandra'
     CSVToGoogleCloudStorage = 'csv-to-google-cloud-storage'
     CassandraToBigTable = 'cassandra-to-big-table'
 
 
 formatted_modes = ', '.join([val.value for val in Mode.__members__.values()])
+formatted_compression = ', '.join([val.value for val in ExportCompression.__members__.values()])
 def obtain_options() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument('-m', '--mode', type=Mode, default=Mode.CassandraToPostgreSQL,
             help=f'Available Modes: {formatted_modes}')
     parser.add_argument('-t', '--tables', type=str, required=True)
+    parser.add_argument('-w', '--workers', type=int, default=ETL_WORKERS)
+    parser.add_argument('-s', '--source', type=str, default=CORM_EXPORT_DIR,
+            help='Export file or directory read by file-to-cassandra')
+    parser.add_argument('-n', '--count', type=int, default=100,
+            help='Rows generated per table by cassandra-generate-data')
+    parser.add_argument('--concurrency', type=int, default=ETL_CONCURRENCY,
+            help='Maximum in-flight writes per table')
+    parser.add_argument('-r', '--resume', action='store_true', default=False,
+            help='Skip token ranges completed by a previous, interrupted run')
+    parser.add_argument('-c', '--compression', type=ExportCompression, default=None,
+            help=f'Available Compression: {formatted_compression}')
     options = parser.parse_args()
     options.tables = [tbl.strip() for tbl in options.tables.split(',')]
     return options
 
+def obtain_checkpoint(options: argparse.Namespace, table: CORMBase) -> Checkpoint:
+    checkpoint_name = f'{options.mode.value}.{table._corm_details.keyspace}.{table._corm_details.table_name}'
+    return Checkpoint(checkpoint_name, options.resume)
+
 def main() -> None:
     options = obtain_options()
     if options.mode is Mode.CassandraToPostgreSQL:
         from corm import register_table
         from corm.etl.factory_testing.utils import load_table
 
-        cassandra_uri = f'cassandra://{CLUSTER_IPS[0]}:{CLUSTER_PORT}/'
-        cassandra_info = ConnectionInfo.From_URI(cassandra_uri)
         psql_info = ConnectionInfo.From_URI(PSQL_URI)
 
         paired_tables = []
@@ -57,43 +79,70 @@ def main() -> None:
             paired_tables.append((corm_table, sql_table))
 
         sync_sqlalchemy_schema(sql_metadata)
-        for corm_table, sql_table in paired_tables:
-            logger.info(f'Migrating Table {corm_table._corm_details.table_name} to PostgreSQL')
-            migrate_data_to_sqlalchemy_table(corm_table, sql_table, cassandra_info, psql_info)
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=len(paired_tables)) as executor:
+            futures = []
+            for corm_table, sql_table in paired_tables:
+                checkpoint = obtain_checkpoint(options, corm_table)
+                futures.append(executor.submit(migrate_data_to_sqlalchemy_table, corm_table, sql_table, None, psql_info,
+                    options.workers, checkpoint=checkpoint))
 
-    elif options.mode is Mode.CassandraToCSV:
-        import tempfile
+            stats = [future.result() for future in futures]
 
+        total_rows = sum([entry.rows for entry in stats])
+        total_rate = total_rows / max(time.time() - started, 0.001)
+        logger.info(f'Migrated {total_rows} rows across {len(stats)} tables at {total_rate:.0f} rows/sec')
+
+    elif options.mode is Mode.CassandraToCSV:
         from corm import register_table
-        from corm.etl.constants import CORM_EXPORT_DIR
         from corm.etl.factory_testing.utils import load_table
 
-        for ip_address in CLUSTER_IPS:
-            conn_info = ConnectionInfo.From_URI(f'cassandra://{ip_address}:{CLUSTER_PORT}/')
-            for table_path in options.tables:
-                table = load_table(table_path)
-                register_table(table)
-                table_filename = f'{table._corm_details.table_name}.csv'
-                table_filepath = os.path.join(CORM_EXPORT_DIR, table._corm_details.keyspace, table_filename)
-                table_dirpath = os.path.dirname(table_filepath)
-                if not os.path.exists(table_dirpath):
-                    os.makedirs(table_dirpath)
+        for table_path in options.tables:
+            table = load_table(table_path)
+            register_table(table)
+            table_filename = f'{table._corm_details.table_name}.csv'
+            if options.compression:
+                table_filename = f'{table_filename}{options.compression.file_extension}'
+
+            table_filepath = os.path.join(CORM_EXPORT_DIR, table._corm_details.keyspace, table_filename)
+            table_dirpath = os.path.dirname(table_filepath)
+            if not os.path.exists(table_dirpath):
+                os.makedirs(table_dirpath)
 
-                export_to_csv(table, table_filepath, conn_info)
+            checkpoint = obtain_checkpoint(options, table)
+            export_to_csv(table, table_filepath, compression=options.compression, workers=options.workers, checkpoint=checkpoint)
+
+    elif options.mode is Mode.CassandraToParquet:
+        from corm import register_table
+        from corm.etl.factory_testing.utils import load_table
+        from corm.etl.parquet import export_to_parquet
+
+        for table_path in options.tables:
+            table = load_table(table_path)
+            register_table(table)
+            checkpoint = obtain_checkpoint(options, table)
+            export_to_parquet(table, workers=options.workers, checkpoint=checkpoint)
 
     elif options.mode is Mode.CassandraGenerateEntries:
-        from corm import register_table, insert, sync_schema
-        from corm.models import CORMBase
-        from corm.etl.constants import ETL_CLUSTER_URIS
-        from corm.etl.utils import cluster_uris_to_parts
-        from corm.etl.factory_testing.utils import generate_entries, load_table
+        from corm import register_table, sync_schema
+        from corm.etl.factory_testing.utils import generate_data, load_table
+
+        for table_path in options.tables:
+            table = load_table(table_path)
+            register_table(table)
+            sync_schema()
+            generate_data(table_path, options.count, options.workers, options.concurrency)
+
+    elif options.mode is Mode.FileToCassandra:
+        from corm import register_table, sync_schema
+        from corm.etl.factory_testing.utils import load_table
+        from corm.etl.loader import load_file, locate_export
 
         for table_path in options.tables:
             table = load_table(table_path)
             register_table(table)
             sync_schema()
-            for entry in generate_entries(table):
-                insert([entry])
+            load_file(table, locate_export(table, options.source), options.concurrency)
 
     else:
         raise NotImplementedError(options.mode)
@@ -1,7 +1,19 @@
-from corm.models import CORMBase
+from corm.models import CORMBase, CORMUDTBase
 
 class RandomDataModel(CORMBase):
     __keyspace__ = 'corm_factory_keyspace'
 
     random_string: str
     random_float: float
+
+class RandomDataUDT(CORMUDTBase):
+    __keyspace__ = 'corm_factory_keyspace'
+
+    random_string: str
+    random_int: int
+
+class RandomUDTDataModel(CORMBase):
+    __keyspace__ = 'corm_factory_keyspace'
+
+    random_string: str
+    random_udt: RandomDataUDT
@@ -1,10 +1,36 @@
+import enum
 import importlib
+import logging
+import multiprocessing
+import os
 import random
+import time
 import types
+import typing
+import uuid
 
-from corm.models import CORMBase
-from corm.utils import generate_string
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
+from corm.annotations import CollectionType, Set, Dict, TimeUUID
+from corm.datatypes import Transliterator
+from corm.encoders import obtain_transliterator
+from corm.etl.constants import ETL_WORKERS, ETL_CONCURRENCY
+from corm.etl.datatypes import TransferStats
+from corm.models import CORMBase, CORMUDTBase
+from corm.utils import generate_strings
+
+from datetime import date, datetime, time as time_of_day, timedelta
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+GENERATED_STRING_LENGTH = 10
+GENERATED_SET_SIZE = 3
+GENERATED_TIMESPAN = 365 * 24 * 60 * 60
 LOADED_TABLES = {}
 def load_table(table_path: str) -> CORMBase:
     if table_path in LOADED_TABLES.keys():
@@ -23,21 +49,165 @@ def load_table(table_path: str) -> CORMBase:
     LOADED_TABLES[table_path] = corm_table
     return LOADED_TABLES[table_path]
 
+def _random_ints(count: int, upper: int) -> typing.List[int]:
+    if numpy:
+        return numpy.random.default_rng().integers(0, upper, count).tolist()
+
+    return [random.randrange(0, upper) for idx in range(0, count)]
+
+def _random_floats(count: int) -> typing.List[float]:
+    if numpy:
+        return numpy.random.default_rng().random(count).tolist()
+
+    return [random.random() for idx in range(0, count)]
+
+def _generate_uuids(count: int) -> typing.List[uuid.UUID]:
+    pool = os.urandom(count * 16)
+    return [uuid.UUID(bytes=pool[idx:idx + 16], version=4) for idx in range(0, count * 16, 16)]
+
+def _generate_datetimes(count: int) -> typing.List[datetime]:
+    now = datetime.utcnow().replace(microsecond=0)
+    return [now - timedelta(seconds=offset) for offset in _random_ints(count, GENERATED_TIMESPAN)]
+
+def _generate_dates(count: int) -> typing.List[date]:
+    today = datetime.utcnow().date()
+    return [today - timedelta(days=offset) for offset in _random_ints(count, GENERATED_TIMESPAN // 86400)]
+
+def _generate_times(count: int) -> typing.List[time_of_day]:
+    return [time_of_day(offset // 3600, offset // 60 % 60, offset % 60) for offset in _random_ints(count, 86400)]
+
+def _generate_sets(count: int) -> typing.List[typing.List[str]]:
+    pool = generate_strings(count * GENERATED_SET_SIZE, GENERATED_STRING_LENGTH)
+    return [pool[idx:idx + GENERATED_SET_SIZE] for idx in range(0, count * GENERATED_SET_SIZE, GENERATED_SET_SIZE)]
+
+DT_GENERATOR_MAP = {
+    str: lambda count: generate_strings(count, GENERATED_STRING_LENGTH),
+    int: lambda count: _random_ints(count, 2 ** 31),
+    float: _random_floats,
+    bool: lambda count: [value == 1 for value in _random_ints(count, 2)],
+    datetime: _generate_datetimes,
+    date: _generate_dates,
+    time_of_day: _generate_times,
+    TimeUUID: lambda count: [uuid.uuid1() for idx in range(0, count)],
+    uuid.UUID: _generate_uuids,
+    Set: _generate_sets,
+}
+
+def generate_column(transliterator: Transliterator, count: int) -> typing.List[typing.Any]:
+    """
+    Generates count values for one column at a time, so the randomness comes from a handful of bulk calls
+    """
+    python_type = transliterator.python_type
+    if python_type in DT_GENERATOR_MAP.keys():
+        return DT_GENERATOR_MAP[python_type](count)
+
+    elif isinstance(python_type, CollectionType):
+        elements = [obtain_transliterator(argument) for argument in python_type.arguments]
+        columns = [generate_column(element, count * GENERATED_SET_SIZE) for element in elements]
+        groups = [range(idx, idx + GENERATED_SET_SIZE) for idx in range(0, count * GENERATED_SET_SIZE, GENERATED_SET_SIZE)]
+        if python_type.container is Dict:
+            return [{columns[0][idx]: columns[1][idx] for idx in group} for group in groups]
+
+        elif python_type.container is Set:
+            container = frozenset if python_type.frozen else set
+            return [container([columns[0][idx] for idx in group]) for group in groups]
+
+        return [[columns[0][idx] for idx in group] for group in groups]
+
+    elif isinstance(python_type, type) and issubclass(python_type, enum.Enum):
+        members = [member for member in python_type.__members__.values()]
+        return [members[idx] for idx in _random_ints(count, len(members))]
+
+    elif isinstance(python_type, type) and issubclass(python_type, CORMUDTBase):
+        columns = [generate_column(entry, count) for entry in python_type._udt_details.field_transliterators]
+        return [python_type(*values) for values in zip(*columns)]
+
+    raise NotImplementedError(python_type)
+
 def generate_entries(table: CORMBase, count: int = 100) -> types.GeneratorType:
-    for idx in range(0, count):
-        field_values = []
-        for field_idx, field_name in enumerate(table._corm_details.field_names):
-            field_transliterator = table._corm_details.field_transliterators[field_idx]
-            if field_transliterator.python_type is str:
-                field_values.append(generate_string(10))
+    columns = [generate_column(entry, count) for entry in table._corm_details.field_transliterators]
+    for values in zip(*columns):
+        yield table(*values)
+
+def _model_udts(annotations: typing.List[typing.Any]) -> typing.List[CORMUDTBase]:
+    """
+    UDT classes the annotations use, inside collections too, each after the UDTs nested in it
+    """
+    udts = []
+    for annotation in annotations:
+        if isinstance(annotation, CollectionType):
+            found = _model_udts(annotation.arguments)
+
+        elif isinstance(annotation, type) and issubclass(annotation, CORMUDTBase):
+            found = _model_udts([entry for entry in annotation.__annotations__.values()]) + [annotation]
+
+        else:
+            found = []
+
+        udts.extend([udt for udt in found if not udt in udts])
+
+    return udts
+
+def _init_generator_worker(table_path: str) -> None:
+    from corm import register_table, register_user_defined_type
+
+    # A spawned worker starts from fresh imports, so it registers the model's UDTs as the parent did
+    table = load_table(table_path)
+    for udt in _model_udts([annotation for annotation in table.__annotations__.values()]):
+        register_user_defined_type(udt)
+
+    register_table(table)
+
+def _generate_bind_values(table_path: str, count: int) -> typing.List[typing.List[typing.Any]]:
+    table = load_table(table_path)
+    bind_values = []
+    for entry in generate_entries(table, count):
+        v_set = entry.values()
+        v_set.append(entry.as_hash())
+        bind_values.append(v_set)
+
+    return bind_values
+
+def generate_data(table_path: str, count: int, workers: int = ETL_WORKERS, concurrency: int = ETL_CONCURRENCY,
+        chunk_size: int = 10000) -> TransferStats:
+    """
+    Generates rows in a process pool and writes every finished chunk with concurrent prepared executions
+    while the workers build the next ones. The table must already be registered and synced
+    """
+    from corm import obtain_session, insert_statement, unset_nulls
+    from corm.concurrency import execute_adaptive
+
+    table = load_table(table_path)
+    session = obtain_session(table._corm_details.keyspace, True)
+    prepared_statement = insert_statement(table._corm_details)
+    chunk_sizes = [chunk_size] * (count // chunk_size)
+    if count % chunk_size:
+        chunk_sizes.append(count % chunk_size)
 
-            elif field_transliterator.python_type is int:
-                field_values.append(random.randint(0, 10))
+    logger.info(f'Generating {count} rows for Table[{table._corm_details.table_name}] with {workers} workers')
+    started = time.time()
+    rows = 0
+    errors = 0
+    # Spawned rather than forked, the driver's connection threads are already running by now
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_generator_worker, initargs=(table_path,),
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        pending = set()
+        while chunk_sizes or pending:
+            # Keep at most two chunks per worker queued, so memory stays bounded
+            while chunk_sizes and len(pending) < workers * 2:
+                pending.add(executor.submit(_generate_bind_values, table_path, chunk_sizes.pop()))
 
-            elif field_transliterator.python_type is float:
-                field_values.append(random.uniform(0, 1))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                # Unset here, UNSET_VALUE is compared by identity and wouldn't survive pickling
+                parameters = [(prepared_statement, unset_nulls(entry)) for entry in future.result()]
+                for success, result in execute_adaptive(session, parameters, concurrency):
+                    if success:
+                        rows += 1
 
-            else:
-                raise NotImplementedError(field_transliterator.python_type)
+                    else:
+                        errors += 1
 
-        yield table(*field_values)
+    stats = TransferStats(table._corm_details.table_name, rows, time.time() - started, errors)
+    logger.info(f'Generated {stats.rows} rows into Table[{stats.table_name}] at {stats.rows_per_second:.0f} rows/sec, {stats.errors} failed')
+    return stats
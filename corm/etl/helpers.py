@@ -8,7 +8,16 @@ import types
 import typing
 
 from corm.constants import ENCODING, CLUSTER_PORT
-from corm.etl.constants import PSQL_CLUSTER_PORT
+from corm.etl.constants import PSQL_CLUSTER_PORT, ETL_RANGE_BYTES
+
+def token_range_count(table: typing.Any, workers: int) -> int:
+    """
+    Token ranges to split a transfer of the table into, about ETL_RANGE_BYTES each going by corm.estimate.
+    At least four per worker so they stay busy, at most 256 per worker
+    """
+    from corm import estimate
+
+    return max(workers * 4, min(workers * 256, estimate(table).bytes // ETL_RANGE_BYTES))
 
 class DBEngine(enum.Enum):
     PostgreSQL = ['postgresql']
@@ -28,7 +37,8 @@ def rationalize_docker_containers(ip_address: str, engine: DBEngine) -> str:
     if ip_address in ['127.0.0.1', 'localhost']:
         list_container_ips_cmd = 'docker container ls --format "table {{.ID}}: {{.Ports}}" -a'
         list_container_ips_filepath = tempfile.NamedTemporaryFile().name
-        run_command(list_container_ips_cmd, True, list_container_ips_filepath)
+        # Hosts without docker fall through to the plain address
+        run_command(list_container_ips_cmd, True, list_container_ips_filepath, False)
         with open(list_container_ips_filepath, 'rb') as stream:
             container_ips = [ip.strip() for ip in stream.read().decode(ENCODING).split('\n') if ip]
 
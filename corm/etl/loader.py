@@ -0,0 +1,256 @@
+import collections
+import csv
+import enum
+import glob
+import logging
+import os
+import threading
+import time
+import types
+import typing
+import uuid
+
+import ujson as json
+
+from corm import obtain_session, insert_statement, unset_nulls
+from corm.annotations import CollectionType, Set, Dict, TimeUUID
+from corm.concurrency import execute_adaptive
+from corm.constants import PWN
+from corm.datatypes import Transliterator
+from corm.encoders import obtain_transliterator
+from corm.etl.constants import CORM_EXPORT_DIR, ETL_CONCURRENCY, ETL_FETCH_SIZE, CSV_NULL
+from corm.etl.datatypes import ExportCompression, TransferStats
+from corm.etl.utils import _open_import_stream
+from corm.models import CORMBase, CORMUDTBase
+
+from datetime import date, datetime, time as time_of_day
+
+logger = logging.getLogger(__name__)
+
+def _csv_decode_collection(value: str) -> typing.List[str]:
+    # Inverse of the PostgreSQL array literal written by export_to_csv
+    entries = []
+    entry = []
+    quoted = False
+    escaped = False
+    for char in value[1:-1]:
+        if escaped:
+            entry.append(char)
+            escaped = False
+
+        elif char == '\\':
+            escaped = True
+
+        elif char == '"':
+            quoted = not quoted
+
+        elif char == ',' and not quoted:
+            entries.append(''.join(entry))
+            entry = []
+
+        else:
+            entry.append(char)
+
+    if value[1:-1]:
+        entries.append(''.join(entry))
+
+    return entries
+
+def _decode_bool(value: str) -> bool:
+    return value.lower() in ['true', 't', '1', 'yes']
+
+def _is_udt(python_type: typing.Any) -> bool:
+    return isinstance(python_type, type) and issubclass(python_type, CORMUDTBase)
+
+def _is_enum(python_type: typing.Any) -> bool:
+    return isinstance(python_type, type) and issubclass(python_type, enum.Enum)
+
+def _csv_decoder(transliterator: Transliterator) -> types.FunctionType:
+    python_type = transliterator.python_type
+    if python_type is bool:
+        return _decode_bool
+
+    elif python_type in [datetime, date, time_of_day]:
+        return python_type.fromisoformat
+
+    elif python_type is Set:
+        return _csv_decode_collection
+
+    elif isinstance(python_type, CollectionType):
+        elements = [obtain_transliterator(argument) for argument in python_type.arguments]
+        decoders = [_csv_decoder(element) for element in elements]
+        if python_type.container is Dict:
+            key_decoder, value_decoder = decoders
+            return lambda x: transliterator.cql_to_python({key_decoder(key): _none_or(value_decoder, value) for key, value in json.loads(x).items()})
+
+        return lambda x: transliterator.cql_to_python([decoders[0](entry) for entry in _csv_decode_collection(x)])
+
+    elif python_type in [int, float, uuid.UUID]:
+        return python_type
+
+    elif python_type is TimeUUID:
+        return uuid.UUID
+
+    elif _is_enum(python_type):
+        return transliterator.cql_to_python
+
+    elif _is_udt(python_type):
+        udt_details = python_type._udt_details
+        decoders = [_csv_decoder(entry) for entry in udt_details.field_transliterators]
+        def _decode_udt(value: str) -> CORMUDTBase:
+            fields = json.loads(value)
+            return python_type(*[_none_or(decoders[idx], fields.get(field_name, None))
+                for idx, field_name in enumerate(udt_details.field_names)])
+
+        return _decode_udt
+
+    return str
+
+def _parquet_decoder(transliterator: Transliterator) -> types.FunctionType:
+    python_type = transliterator.python_type
+    if python_type in [uuid.UUID, TimeUUID]:
+        return uuid.UUID
+
+    elif _is_enum(python_type):
+        return transliterator.cql_to_python
+
+    elif isinstance(python_type, CollectionType):
+        elements = [obtain_transliterator(argument) for argument in python_type.arguments]
+        decoders = [_parquet_decoder(element) for element in elements]
+        if python_type.container is Dict:
+            key_decoder, value_decoder = decoders
+            # Arrow maps come back as (key, value) pairs
+            return lambda x: transliterator.cql_to_python({key_decoder(key): _none_or(value_decoder, value) for key, value in x})
+
+        return lambda x: transliterator.cql_to_python([decoders[0](entry) for entry in x])
+
+    elif _is_udt(python_type):
+        udt_details = python_type._udt_details
+        decoders = [_parquet_decoder(entry) for entry in udt_details.field_transliterators]
+        def _decode_udt(value: typing.Dict[str, typing.Any]) -> CORMUDTBase:
+            return python_type(*[_none_or(decoders[idx], value.get(field_name, None))
+                for idx, field_name in enumerate(udt_details.field_names)])
+
+        return _decode_udt
+
+    # Arrow already hands back native python values
+    return lambda x: x
+
+def _none_or(decoder: types.FunctionType, value: typing.Any) -> typing.Any:
+    # Exports mark nulls with CSV_NULL. Empty strings still mean null outside text columns, as older exports wrote them
+    if value is None or value == CSV_NULL or (value == '' and not decoder is str):
+        return None
+
+    return decoder(value)
+
+def _read_csv(filepath: str) -> types.GeneratorType:
+    with _open_import_stream(filepath) as stream:
+        reader = csv.reader(stream)
+        header = next(reader)
+        for row in reader:
+            yield {name: row[idx] for idx, name in enumerate(header)}, row
+
+def _read_parquet(filepath: str, chunk_size: int) -> types.GeneratorType:
+    import pyarrow.parquet as pq
+
+    if os.path.isdir(filepath):
+        filepaths = sorted(glob.glob(os.path.join(filepath, '*.parquet')))
+
+    else:
+        filepaths = [filepath]
+
+    for parquet_filepath in filepaths:
+        for batch in pq.ParquetFile(parquet_filepath).iter_batches(batch_size=chunk_size):
+            for row in batch.to_pylist():
+                yield row, [str(value) for value in row.values()]
+
+def locate_export(table: CORMBase, source: str = CORM_EXPORT_DIR) -> str:
+    if os.path.isfile(source):
+        return source
+
+    base_filepath = os.path.join(source, table._corm_details.keyspace, table._corm_details.table_name)
+    for extension in ['', ExportCompression.GZip.file_extension, ExportCompression.ZStandard.file_extension]:
+        filepath = f'{base_filepath}.csv{extension}'
+        if os.path.exists(filepath):
+            return filepath
+
+    if os.path.isdir(base_filepath):
+        return base_filepath
+
+    raise FileNotFoundError(f'Unable to find an export for Table[{table._corm_details.table_name}] in {source}')
+
+class _Rejects:
+    def __init__(self: PWN, filepath: str) -> None:
+        self.filepath = filepath
+        self.count = 0
+        self._stream = None
+        # Decode failures are reported from the driver's event loop, write failures from the caller
+        self._lock = threading.Lock()
+
+    def write(self: PWN, source_row: typing.List[str], err: Exception) -> None:
+        row = source_row[:]
+        row.append(f'{err.__class__.__name__}: {err}')
+        with self._lock:
+            if self._stream is None:
+                self._stream = open(self.filepath, 'w', newline='')
+                self._writer = csv.writer(self._stream)
+
+            self._writer.writerow(row)
+            self.count += 1
+
+    def close(self: PWN) -> None:
+        if self._stream:
+            self._stream.close()
+
+def load_file(table: CORMBase, filepath: str, concurrency: int = ETL_CONCURRENCY, chunk_size: int = ETL_FETCH_SIZE,
+        rejects_filepath: str = None) -> TransferStats:
+    """
+    Restores a CSV or Parquet export into the corm table. Rows are decoded through the model's transliterators
+    and written with individual prepared executions, at most concurrency in flight. The exported guid is kept
+    when present. Rows that fail to decode or write are appended to rejects_filepath with the error
+    """
+    is_parquet = filepath.endswith('.parquet') or os.path.isdir(filepath)
+    reader = _read_parquet(filepath, chunk_size) if is_parquet else _read_csv(filepath)
+    decoder_factory = _parquet_decoder if is_parquet else _csv_decoder
+    decoders = [decoder_factory(entry) for entry in table._corm_details.field_transliterators]
+    field_names = table._corm_details.field_names
+    rejects = _Rejects(rejects_filepath or f'{filepath.rstrip(os.sep)}.rejects.csv')
+    pending = collections.deque()
+
+    def _parameters() -> types.GeneratorType:
+        for record, source_row in reader:
+            try:
+                instance = table(*[_none_or(decoders[idx], record.get(field_name, None)) for idx, field_name in enumerate(field_names)])
+                v_set = unset_nulls(instance.values())
+                v_set.append(record.get('guid', None) or instance.as_hash())
+
+            except Exception as err:
+                rejects.write(source_row, err)
+                continue
+
+            pending.append(source_row)
+            yield prepared_statement, v_set
+
+    logger.info(f'Loading {filepath} into Table[{table._corm_details.table_name}]')
+    started = time.time()
+    rows = 0
+    session = obtain_session(table._corm_details.keyspace, True)
+    prepared_statement = insert_statement(table._corm_details)
+    try:
+        for success, result in execute_adaptive(session, _parameters(), concurrency):
+            source_row = pending.popleft()
+            if success:
+                rows += 1
+
+            else:
+                rejects.write(source_row, result)
+
+    finally:
+        rejects.close()
+
+    stats = TransferStats(table._corm_details.table_name, rows, time.time() - started, rejects.count)
+    logger.info(f'Loaded {stats.rows} rows into Table[{stats.table_name}] at {stats.rows_per_second:.0f} rows/sec, {stats.errors} rejected')
+    if stats.errors:
+        logger.warning(f'Rejected rows written to {rejects.filepath}')
+
+    return stats
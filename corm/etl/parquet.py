@@ -0,0 +1,203 @@
+import enum
+import logging
+import os
+import time
+import types
+import typing
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from corm import scan
+from corm.annotations import CollectionType, Set, Dict, TimeUUID
+from corm.datatypes import Transliterator, TokenRange
+from corm.encoders import obtain_transliterator
+from corm.etl.checkpoint import Checkpoint
+from corm.etl.constants import CORM_EXPORT_DIR, ETL_WORKERS, ETL_FETCH_SIZE
+from corm.etl.datatypes import TransferStats
+from corm.etl.helpers import token_range_count
+from corm.models import CORMBase, CORMUDTBase
+from corm.utils import split_token_ring
+
+from datetime import date, datetime, time as time_of_day
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+DT_ARROW_MAP = {
+    str: pa.string(),
+    int: pa.int64(),
+    datetime: pa.timestamp('ms', tz='UTC'),
+    date: pa.date32(),
+    time_of_day: pa.time64('ns'),
+    TimeUUID: pa.string(),
+    Set: pa.list_(pa.string()),
+    bool: pa.bool_(),
+    float: pa.float64(),
+    uuid.UUID: pa.string(),
+}
+
+def _udt_fields(value: typing.Any) -> typing.Dict[str, typing.Any]:
+    # Unregistered UDTs come back from the driver as namedtuples
+    return value._asdict() if hasattr(value, '_asdict') else vars(value)
+
+def _arrow_type(transliterator: Transliterator) -> pa.DataType:
+    python_type = transliterator.python_type
+    if python_type in DT_ARROW_MAP.keys():
+        return DT_ARROW_MAP[python_type]
+
+    elif isinstance(python_type, CollectionType):
+        elements = [obtain_transliterator(argument) for argument in python_type.arguments]
+        if python_type.container is Dict:
+            return pa.map_(_arrow_type(elements[0]), _arrow_type(elements[1]))
+
+        return pa.list_(_arrow_type(elements[0]))
+
+    elif isinstance(python_type, type) and issubclass(python_type, enum.Enum):
+        return pa.string()
+
+    elif isinstance(python_type, type) and issubclass(python_type, CORMUDTBase):
+        udt_details = python_type._udt_details
+        return pa.struct([(field_name, _arrow_type(udt_details.field_transliterators[idx]))
+            for idx, field_name in enumerate(udt_details.field_names)])
+
+    raise NotImplementedError(python_type)
+
+def _arrow_converter(transliterator: Transliterator) -> types.FunctionType:
+    python_type = transliterator.python_type
+    if python_type in [uuid.UUID, TimeUUID]:
+        return str
+
+    elif python_type in [date, time_of_day]:
+        # cassandra.util.Date and cassandra.util.Time
+        return transliterator.cql_to_python
+
+    elif python_type is Set:
+        return list
+
+    elif isinstance(python_type, CollectionType):
+        elements = [obtain_transliterator(argument) for argument in python_type.arguments]
+        converters = [_arrow_converter(element) or (lambda x: x) for element in elements]
+        if python_type.container is Dict:
+            key_converter, value_converter = converters
+            return lambda x: [(key_converter(key), None if value is None else value_converter(value)) for key, value in x.items()]
+
+        return lambda x: [converters[0](entry) for entry in x]
+
+    elif isinstance(python_type, type) and issubclass(python_type, CORMUDTBase):
+        udt_details = python_type._udt_details
+        converters = [_arrow_converter(entry) for entry in udt_details.field_transliterators]
+        def _convert_udt(value: typing.Any) -> typing.Dict[str, typing.Any]:
+            fields = _udt_fields(value)
+            converted = {}
+            for idx, field_name in enumerate(udt_details.field_names):
+                entry = fields.get(field_name, None)
+                converted[field_name] = None if entry is None or converters[idx] is None else converters[idx](entry)
+
+            return converted
+
+        return _convert_udt
+
+    # Driver values are already Arrow compatible
+    return None
+
+def arrow_schema(table: CORMBase) -> pa.Schema:
+    fields = [pa.field(field_name, _arrow_type(table._corm_details.field_transliterators[idx]))
+        for idx, field_name in enumerate(table._corm_details.field_names)]
+    fields.append(pa.field('guid', pa.string()))
+    return pa.schema(fields)
+
+def _page_to_arrow(page: typing.List[typing.Any], schema: pa.Schema, converters: typing.List[types.FunctionType]) -> pa.Table:
+    columns = []
+    for idx, field in enumerate(schema):
+        converter = converters[idx]
+        if converter is None:
+            values = [row[idx] for row in page]
+
+        else:
+            values = [None if row[idx] is None else converter(row[idx]) for row in page]
+
+        columns.append(pa.array(values, type=field.type))
+
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def _export_token_range(table: CORMBase, token_range: TokenRange, filepath: str, fetch_size: int, compression: str,
+        checkpoint: Checkpoint) -> int:
+    schema = arrow_schema(table)
+    field_names = schema.names
+    converters = [_arrow_converter(entry) for entry in table._corm_details.field_transliterators]
+    converters.append(None)
+    rows = 0
+    writer = None
+    tmp_filepath = f'{filepath}.tmp'
+    try:
+        for page in scan(table, token_range, field_names, fetch_size).pages():
+            if not page:
+                continue
+
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_filepath, schema, compression=compression)
+
+            # One row group per fetched page
+            writer.write_table(_page_to_arrow(page, schema, converters))
+            rows += len(page)
+
+    finally:
+        if writer:
+            writer.close()
+
+    if writer:
+        os.replace(tmp_filepath, filepath)
+
+    elif os.path.exists(filepath):
+        # Left by an earlier run, when the range still had rows
+        os.remove(filepath)
+
+    if checkpoint:
+        checkpoint.mark_complete(token_range, rows)
+
+    return rows
+
+def export_to_parquet(table: CORMBase, dirpath: str = None, workers: int = ETL_WORKERS, fetch_size: int = ETL_FETCH_SIZE,
+        compression: str = 'snappy', checkpoint: Checkpoint = None) -> TransferStats:
+    """
+    Writes the table as Parquet, one file per token range under CORM_EXPORT_DIR/<keyspace>/<table>/.
+    Columns keep their native Arrow types and every fetched page becomes a row group. Empty ranges
+    produce no file. Parquet files of an earlier run are removed first, unless a checkpoint resumes it
+    """
+    dirpath = dirpath or os.path.join(CORM_EXPORT_DIR, table._corm_details.keyspace, table._corm_details.table_name)
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+
+    if checkpoint is None or checkpoint.completed_ranges == 0:
+        # Another split of the ring leaves files that overlap the new ones, readers would count their rows twice
+        for filename in os.listdir(dirpath):
+            if filename.endswith(('.parquet', '.parquet.tmp')):
+                os.remove(os.path.join(dirpath, filename))
+
+    logger.info(f'Exporting Table[{table._corm_details.table_name}] to {dirpath}')
+    started = time.time()
+    if checkpoint is None:
+        token_ranges = split_token_ring(token_range_count(table, workers))
+        rows = 0
+
+    else:
+        token_ranges = [entry for entry in checkpoint.token_ranges(token_range_count(table, workers)) if not checkpoint.is_complete(entry)]
+        rows = checkpoint.completed_rows
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for token_range in token_ranges:
+            filepath = os.path.join(dirpath, f'{token_range.start}_{token_range.end}.parquet')
+            futures.append(executor.submit(_export_token_range, table, token_range, filepath, fetch_size, compression, checkpoint))
+
+        rows += sum([future.result() for future in futures])
+
+    if checkpoint:
+        checkpoint.finish()
+
+    stats = TransferStats(table._corm_details.table_name, rows, time.time() - started)
+    logger.info(f'Exported {stats.rows} rows from Table[{stats.table_name}] at {stats.rows_per_second:.0f} rows/sec')
+    return stats
@@ -1,22 +1,39 @@
 import _io
+import csv
+import gzip
+import io
 import logging
+import os
+import queue
+import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import types
 import typing
 
+from concurrent.futures import ThreadPoolExecutor
+
+import ujson as json
+
+from corm import scan
 from corm.constants import PWN, CLUSTER_IPS, ENCODING
-from corm.etl.datatypes import ConnectionInfo
-from corm.etl.helpers import run_command, container_ipaddress
-from corm.models import CORMBase
-from corm.annotations import Set
+from corm.datatypes import Transliterator, TokenRange
+from corm.etl.checkpoint import Checkpoint
+from corm.etl.constants import ETL_WORKERS, ETL_FETCH_SIZE, ETL_PIPE_DEPTH, CSV_NULL
+from corm.etl.datatypes import ConnectionInfo, ExportCompression, TransferStats
+from corm.etl.helpers import run_command, container_ipaddress, token_range_count
+from corm.models import CORMBase, CORMUDTBase
+from corm.annotations import CollectionType, Set, Dict, Frozen
+from corm.utils import split_token_ring
 
-from datetime import datetime
+from datetime import date, datetime, time as time_of_day
 
-from sqlalchemy import String, BigInteger, DateTime, ARRAY, Boolean, Float, Column, Table, MetaData, \
+from sqlalchemy import String, BigInteger, DateTime, Date, Time, ARRAY, Boolean, Float, Column, Table, MetaData, \
         create_engine
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.engine.base import Engine
 
@@ -27,6 +44,8 @@ DT_SQLALCHEMY_MAP_POSTGRESQL = {
     str: String,
     int: BigInteger,
     datetime: DateTime,
+    date: Date,
+    time_of_day: Time,
     Set: ARRAY,
     bool: Boolean,
     float: Float,
@@ -64,15 +83,28 @@ def obtain_sqlalchemy_session(uri: str) -> Engine:
 def generate_sqlalchemy_metadata(psql_info: ConnectionInfo) -> MetaData:
     return MetaData(bind=obtain_sqlalchemy_session(psql_info.as_uri()).connection)
 
+def _sqlalchemy_type(field_type: typing.Any) -> typing.Any:
+    if isinstance(field_type, CollectionType):
+        if field_type.container is Dict:
+            return JSONB
+
+        elif field_type.container is Frozen:
+            return _sqlalchemy_type(field_type.arguments[0])
+
+        element_type = _sqlalchemy_type(field_type.arguments[0])
+        return ARRAY(element_type() if isinstance(element_type, type) else element_type)
+
+    return DT_SQLALCHEMY_MAP_POSTGRESQL[field_type]
+
 def generate_sqlalchemy_table(table: CORMBase, metadata: MetaData) -> Table:
     sql_alchemy_types = {}
     for field_name, field_type in table.__annotations__.items():
         default_value = getattr(table, field_name, None)
         if default_value:
-            sql_alchemy_types[field_name] = DT_SQLALCHEMY_MAP_POSTGRESQL[field_type](default_value)
+            sql_alchemy_types[field_name] = _sqlalchemy_type(field_type)(default_value)
 
         else:
-            sql_alchemy_types[field_name] = DT_SQLALCHEMY_MAP_POSTGRESQL[field_type]
+            sql_alchemy_types[field_name] = _sqlalchemy_type(field_type)
 
     sql_alchemy_types['guid'] = String(65)
     cols = []
@@ -91,29 +123,377 @@ def cluster_uris_to_parts(uris: typing.List[str]) -> types.GeneratorType:
     for uri in uris:
         yield ConnectionInfo.From_URI(uri)
 
-def _corm_table_to_cql_export(table: CORMBase) -> str:
+def _csv_encode_collection(value: typing.Iterable[typing.Any]) -> str:
+    # PostgreSQL array literal, so exported collections load straight into ARRAY columns
+    entries = []
+    for entry in value:
+        escaped = str(entry).replace('\\', '\\\\').replace('"', '\\"')
+        entries.append(f'"{escaped}"')
+
+    formatted_entries = ','.join(entries)
+    return f'{{{formatted_entries}}}'
+
+def _csv_udt_encoder(udt: typing.Any) -> types.FunctionType:
+    # Each field is encoded like a column of its type and null stays null, so the loader decodes it field by field
+    field_names = udt._udt_details.field_names
+    encoders = [_csv_encoder(entry) for entry in udt._udt_details.field_transliterators]
+    def _encode_udt(value: typing.Any) -> str:
+        # Unregistered UDTs come back from the driver as namedtuples
+        fields = value._asdict() if hasattr(value, '_asdict') else vars(value)
+        return json.dumps({field_name: None if fields.get(field_name, None) is None else encoder(fields[field_name])
+            for field_name, encoder in zip(field_names, encoders)})
+
+    return _encode_udt
+
+def _collection_cql_type(transliterator: Transliterator) -> str:
+    cql_type = transliterator.cql_type.upper()
+    if cql_type.startswith('FROZEN<'):
+        return cql_type[len('FROZEN<'):]
+
+    return cql_type
+
+def _csv_encoder(transliterator: Transliterator) -> types.FunctionType:
+    if transliterator.python_type is datetime:
+        return lambda x: x.isoformat()
+
+    elif transliterator.python_type in [date, time_of_day]:
+        return lambda x: transliterator.cql_to_python(x).isoformat()
+
+    elif _collection_cql_type(transliterator).startswith(('SET', 'LIST')):
+        return _csv_encode_collection
+
+    elif _collection_cql_type(transliterator).startswith('MAP'):
+        return lambda x: json.dumps({str(key): str(value) for key, value in x.items()})
+
+    elif isinstance(transliterator.python_type, type) and issubclass(transliterator.python_type, CORMUDTBase):
+        return _csv_udt_encoder(transliterator.python_type)
+
+    return str
+
+def _csv_field_encoders(table: CORMBase) -> typing.List[types.FunctionType]:
+    encoders = [_csv_encoder(transliterator) for transliterator in table._corm_details.field_transliterators]
+    # guid
+    encoders.append(str)
+    return encoders
+
+def _csv_encode_rows(rows: typing.List[typing.Any], encoders: typing.List[types.FunctionType]) -> typing.List[typing.List[str]]:
+    encoded = []
+    for row in rows:
+        encoded.append([CSV_NULL if row[idx] is None else encoder(row[idx]) for idx, encoder in enumerate(encoders)])
+
+    return encoded
+
+def _export_field_names(table: CORMBase) -> typing.List[str]:
     field_names = table._corm_details.field_names[:]
     field_names.append('guid')
-    formatted_field_names = ','.join(field_names)
-    return f"""COPY {table._corm_details.keyspace}.{table._corm_details.table_name} ({formatted_field_names}) TO STDOUT WITH HEADER=True AND QUOTE=\'*\' AND ESCAPE=\'*\' """
-
-def export_to_csv(table: CORMBase, filepath: str, info: ConnectionInfo) -> None:
-    cql_export = _corm_table_to_cql_export(table)
-    cql_bin_cmd = f'docker run --rm library/cassandra cqlsh {info.host} {info.port}'
-    export_cmd = f'{cql_bin_cmd} -e "{cql_export}" > {filepath}'
-    logger.info(f'Exporting Table[{table._corm_details.table_name}] from {info.host}')
-    run_command(export_cmd)
-
-def migrate_data_to_sqlalchemy_table(corm_table: CORMBase, sql_table: Table, cassandra_info: ConnectionInfo, psql_info: ConnectionInfo) -> None:
-    # Export data from Cassandra
-    csv_filepath = tempfile.NamedTemporaryFile().name
-    export_to_csv(corm_table, csv_filepath, cassandra_info)
-
-    # # Import data into PostgreSQL
+    return field_names
+
+def _open_export_stream(filepath: str, compression: ExportCompression = None) -> typing.TextIO:
+    if compression is None:
+        return open(filepath, 'w', newline='', encoding=ENCODING)
+
+    elif compression is ExportCompression.GZip:
+        return gzip.open(filepath, 'wt', newline='', encoding=ENCODING)
+
+    elif compression is ExportCompression.ZStandard:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression requires the zstandard package')
+
+        stream = zstandard.ZstdCompressor().stream_writer(open(filepath, 'wb'))
+        return io.TextIOWrapper(stream, encoding=ENCODING, newline='')
+
+    raise NotImplementedError(compression)
+
+def _open_import_stream(filepath: str) -> typing.TextIO:
+    if filepath.endswith(ExportCompression.GZip.file_extension):
+        return gzip.open(filepath, 'rt', newline='', encoding=ENCODING)
+
+    elif filepath.endswith(ExportCompression.ZStandard.file_extension):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression requires the zstandard package')
+
+        stream = zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(stream, encoding=ENCODING, newline='')
+
+    return open(filepath, 'r', newline='', encoding=ENCODING)
+
+_RANGE_COMPLETE = object()
+
+def _put_unless_aborted(pipe: queue.Queue, entry: typing.Any, aborted: threading.Event) -> bool:
+    # A full pipe nobody drains any more would otherwise block the worker, and the executor waiting on it, forever
+    while not aborted.is_set():
+        try:
+            pipe.put(entry, timeout=0.1)
+            return True
+
+        except queue.Full:
+            continue
+
+    return False
+
+def _scan_token_range(table: CORMBase, token_range: TokenRange, field_names: typing.List[str], fetch_size: int,
+        encoders: typing.List[types.FunctionType], pipe: queue.Queue, aborted: threading.Event) -> None:
+    try:
+        if aborted.is_set():
+            return
+
+        for page in scan(table, token_range, field_names, fetch_size).pages():
+            if not _put_unless_aborted(pipe, _csv_encode_rows(page, encoders), aborted):
+                break
+
+    except Exception as err:
+        _put_unless_aborted(pipe, err, aborted)
+
+    finally:
+        _put_unless_aborted(pipe, _RANGE_COMPLETE, aborted)
+
+def _export_to_csv_stream(table: CORMBase, filepath: str, compression: ExportCompression, workers: int, fetch_size: int) -> int:
+    field_names = _export_field_names(table)
+    encoders = _csv_field_encoders(table)
+    token_ranges = split_token_ring(token_range_count(table, workers))
+    pipe = queue.Queue(maxsize=workers * 2)
+    aborted = threading.Event()
+    rows = 0
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            with _open_export_stream(filepath, compression) as stream:
+                writer = csv.writer(stream)
+                writer.writerow(field_names)
+                for token_range in token_ranges:
+                    executor.submit(_scan_token_range, table, token_range, field_names, fetch_size, encoders, pipe, aborted)
+
+                completed = 0
+                while completed < len(token_ranges):
+                    entry = pipe.get()
+                    if entry is _RANGE_COMPLETE:
+                        completed += 1
+
+                    elif isinstance(entry, Exception):
+                        errors.append(entry)
+
+                    else:
+                        writer.writerows(entry)
+                        rows += len(entry)
+
+        except BaseException:
+            # Stop the workers before the executor waits on them, ranges not yet started return straight away
+            aborted.set()
+            raise
+
+    if errors:
+        raise errors[0]
+
+    return rows
+
+def _export_token_range_part(table: CORMBase, token_range: TokenRange, part_filepath: str, compression: ExportCompression,
+        fetch_size: int, checkpoint: Checkpoint) -> int:
+    field_names = _export_field_names(table)
+    encoders = _csv_field_encoders(table)
+    rows = 0
+    tmp_filepath = f'{part_filepath}.tmp'
+    with _open_export_stream(tmp_filepath, compression) as stream:
+        writer = csv.writer(stream)
+        for page in scan(table, token_range, field_names, fetch_size).pages():
+            writer.writerows(_csv_encode_rows(page, encoders))
+            rows += len(page)
+
+    os.replace(tmp_filepath, part_filepath)
+    checkpoint.mark_complete(token_range, rows)
+    return rows
+
+def _export_to_csv_parts(table: CORMBase, filepath: str, compression: ExportCompression, workers: int, fetch_size: int,
+        checkpoint: Checkpoint) -> int:
+    # One file per token range, so finished ranges survive a crash. Gzip members and zstd frames
+    # both concatenate into a valid stream, so the parts are joined byte for byte at the end
+    parts_dirpath = f'{filepath}.parts'
+    if not os.path.exists(parts_dirpath):
+        os.makedirs(parts_dirpath)
+
+    # Parts of the earlier attempt are joined as they are, so they have to be compressed the same way
+    checkpoint.require_option('compression', compression.value if compression else None)
+    token_ranges = checkpoint.token_ranges(token_range_count(table, workers))
+    header_filepath = os.path.join(parts_dirpath, 'header.csv')
+    part_filepaths = [os.path.join(parts_dirpath, f'{idx:05d}.csv') for idx in range(0, len(token_ranges))]
+    with _open_export_stream(header_filepath, compression) as stream:
+        csv.writer(stream).writerow(_export_field_names(table))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # A range whose part file has gone missing is exported again
+        futures = [executor.submit(_export_token_range_part, table, token_range, part_filepaths[idx], compression, fetch_size, checkpoint)
+                for idx, token_range in enumerate(token_ranges) if not checkpoint.is_complete(token_range) or \
+                        not os.path.exists(part_filepaths[idx])]
+        for future in futures:
+            future.result()
+
+    # Every range is complete now, re-exported ones with their new counts
+    rows = checkpoint.completed_rows
+
+    with open(filepath, 'wb') as output:
+        for part_filepath in [header_filepath] + part_filepaths:
+            with open(part_filepath, 'rb') as part:
+                shutil.copyfileobj(part, output)
+
+    shutil.rmtree(parts_dirpath)
+    checkpoint.finish()
+    return rows
+
+def export_to_csv(table: CORMBase, filepath: str, info: ConnectionInfo = None, compression: ExportCompression = None,
+        workers: int = ETL_WORKERS, fetch_size: int = ETL_FETCH_SIZE, checkpoint: Checkpoint = None) -> TransferStats:
+    """
+    Scans the table token range by token range through corm's own sessions and streams rows into a CSV file.
+    At most two pages per worker are held in memory at any time. With a checkpoint, every range is written to
+    its own part file first and finished ranges are skipped on resume. info is accepted for compatibility;
+    rows are read through corm's cluster connection
+    """
+    logger.info(f'Exporting Table[{table._corm_details.table_name}] to {filepath}')
+    started = time.time()
+    if checkpoint is None:
+        rows = _export_to_csv_stream(table, filepath, compression, workers, fetch_size)
+
+    else:
+        rows = _export_to_csv_parts(table, filepath, compression, workers, fetch_size, checkpoint)
+
+    stats = TransferStats(table._corm_details.table_name, rows, time.time() - started)
+    logger.info(f'Exported {stats.rows} rows from Table[{stats.table_name}] at {stats.rows_per_second:.0f} rows/sec')
+    return stats
+
+class _CSVPipe:
+    """
+    Bounded, in-memory file-like object. A producer thread pushes encoded pages with write_rows and
+    psycopg's copy_expert drains them through read
+    """
+    def __init__(self: PWN, depth: int = ETL_PIPE_DEPTH) -> None:
+        self._queue = queue.Queue(maxsize=depth)
+        self._chunk = ''
+        self._offset = 0
+        self._closed = False
+        self.aborted = False
+
+    def write_rows(self: PWN, rows: typing.List[typing.List[str]]) -> None:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        self._queue.put(buffer.getvalue())
+
+    def close(self: PWN, err: Exception = None) -> None:
+        self._queue.put(err)
+
+    def read(self: PWN, size: int = -1) -> str:
+        parts = []
+        remaining = size
+        while remaining != 0:
+            if self._offset >= len(self._chunk):
+                if self._closed:
+                    break
+
+                chunk = self._queue.get()
+                if chunk is None:
+                    self._closed = True
+                    break
+
+                elif isinstance(chunk, Exception):
+                    self._closed = True
+                    raise chunk
+
+                self._chunk = chunk
+                self._offset = 0
+
+            if remaining < 0:
+                part = self._chunk[self._offset:]
+
+            else:
+                part = self._chunk[self._offset:self._offset + remaining]
+                remaining -= len(part)
+
+            self._offset += len(part)
+            parts.append(part)
+
+        return ''.join(parts)
+
+    def abort(self: PWN) -> None:
+        # Unblock the producer when the consumer gives up early
+        self.aborted = True
+        while not self._closed:
+            chunk = self._queue.get()
+            if chunk is None or isinstance(chunk, Exception):
+                self._closed = True
+
+def _produce_token_range(table: CORMBase, token_range: TokenRange, field_names: typing.List[str], fetch_size: int,
+        encoders: typing.List[types.FunctionType], pipe: _CSVPipe, counter: typing.List[int]) -> None:
+    try:
+        for page in scan(table, token_range, field_names, fetch_size).pages():
+            if pipe.aborted:
+                break
+
+            pipe.write_rows(_csv_encode_rows(page, encoders))
+            counter[0] += len(page)
+
+    except Exception as err:
+        pipe.close(err)
+
+    else:
+        pipe.close()
+
+def _copy_token_range(table: CORMBase, token_range: TokenRange, copy_sql: str, psql_info: ConnectionInfo,
+        fetch_size: int, checkpoint: Checkpoint = None) -> int:
+    import psycopg2
+
+    field_names = _export_field_names(table)
+    encoders = _csv_field_encoders(table)
+    pipe = _CSVPipe()
+    counter = [0]
+    producer = threading.Thread(target=_produce_token_range,
+            args=(table, token_range, field_names, fetch_size, encoders, pipe, counter), daemon=True)
+    connection = psycopg2.connect(psql_info.as_uri())
+    try:
+        producer.start()
+        with connection.cursor() as cursor:
+            cursor.copy_expert(copy_sql, pipe)
+
+        connection.commit()
+        if checkpoint:
+            checkpoint.mark_complete(token_range, counter[0])
+
+    finally:
+        connection.close()
+        pipe.abort()
+        producer.join()
+
+    return counter[0]
+
+def migrate_data_to_sqlalchemy_table(corm_table: CORMBase, sql_table: Table, cassandra_info: ConnectionInfo, psql_info: ConnectionInfo,
+        workers: int = ETL_WORKERS, fetch_size: int = ETL_FETCH_SIZE, checkpoint: Checkpoint = None) -> TransferStats:
+    """
+    Streams every token range of the corm table straight into PostgreSQL with COPY FROM STDIN. Each range is its
+    own COPY transaction over its own connection, so ranges load concurrently. With a checkpoint, committed ranges
+    are recorded and skipped on resume; a crash between commit and checkpoint replays that one range.
+    cassandra_info is accepted for compatibility; rows are read through corm's cluster connection
+    """
+    logger.info(f'Migrating Table[{corm_table._corm_details.table_name}] into {psql_info.host}')
+    started = time.time()
     column_names = [col.name for col in sql_table.columns]
     formatted_columns = ','.join(column_names)
-    SQL_IMPORT = f"""COPY {sql_table.name} ({formatted_columns}) FROM STDIN DELIMITER ',' CSV HEADER QUOTE AS \'*\' ESCAPE AS \'*\' """
-    PSQL_BIN_CMD = f'docker run -i -e PGPASSWORD="{psql_info.password}" --rm postgres psql -h {psql_info.host} -U {psql_info.username} {psql_info.name}'
-    import_cmd = f'{PSQL_BIN_CMD} -c "{SQL_IMPORT}" < {csv_filepath}'
-    logger.info(f'Importing Table[{corm_table._corm_details.table_name}] into {psql_info.host}')
-    run_command(import_cmd)
+    copy_sql = f"""COPY {sql_table.name} ({formatted_columns}) FROM STDIN WITH (FORMAT csv, NULL '{CSV_NULL}')"""
+    if checkpoint is None:
+        token_ranges = split_token_ring(token_range_count(corm_table, workers))
+        rows = 0
+
+    else:
+        token_ranges = [entry for entry in checkpoint.token_ranges(token_range_count(corm_table, workers)) if not checkpoint.is_complete(entry)]
+        rows = checkpoint.completed_rows
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_copy_token_range, corm_table, token_range, copy_sql, psql_info, fetch_size, checkpoint)
+                for token_range in token_ranges]
+        rows += sum([future.result() for future in futures])
+
+    if checkpoint:
+        checkpoint.finish()
+
+    stats = TransferStats(corm_table._corm_details.table_name, rows, time.time() - started)
+    logger.info(f'Migrated {stats.rows} rows from Table[{stats.table_name}] at {stats.rows_per_second:.0f} rows/sec')
+    return stats
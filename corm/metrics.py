@@ -0,0 +1,225 @@
+import bisect
+import logging
+import os
+import threading
+import time
+import types
+import typing
+
+import ujson as json
+
+from corm.constants import PWN, CORM_METRICS
+from corm.datatypes import QueryEvent
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, Prometheus style, the last bucket catches everything
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf')]
+
+class Histogram:
+    def __init__(self: PWN, buckets: typing.List[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self: PWN, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self: PWN) -> typing.List[int]:
+        result = []
+        total = 0
+        for count in self.counts:
+            total += count
+            result.append(total)
+
+        return result
+
+    def as_dict(self: PWN) -> typing.Dict[str, typing.Any]:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': {('+Inf' if bound == float('inf') else bound): count
+                for bound, count in zip(self.buckets, self.cumulative_counts())},
+        }
+
+class OperationMetrics:
+    def __init__(self: PWN) -> None:
+        self.latency = Histogram()
+        self.rows = 0
+        self.pages = 0
+        self.batches = 0
+        self.batch_rows = 0
+        self.errors = 0
+        self.retries = 0
+
+    def as_dict(self: PWN) -> typing.Dict[str, typing.Any]:
+        return {
+            'latency': self.latency.as_dict(),
+            'rows': self.rows,
+            'pages': self.pages,
+            'batches': self.batches,
+            'batch_rows': self.batch_rows,
+            'errors': self.errors,
+            'retries': self.retries,
+        }
+
+class MetricsRegistry:
+    """
+    Aggregates QueryEvents per (table, operation) and fans them out to hooks. corm only builds events while
+    enabled is True, so a disabled registry costs one attribute lookup per call
+    """
+    def __init__(self: PWN, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.hooks = []
+        self._operations = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self: PWN, hook: types.FunctionType) -> None:
+        self.hooks.append(hook)
+
+    def remove_hook(self: PWN, hook: types.FunctionType) -> None:
+        self.hooks.remove(hook)
+
+    def reset(self: PWN) -> None:
+        with self._lock:
+            self._operations = {}
+
+    def record(self: PWN, event: QueryEvent) -> None:
+        key = (event.table_name, event.operation)
+        with self._lock:
+            entry = self._operations.get(key, None)
+            if entry is None:
+                entry = self._operations[key] = OperationMetrics()
+
+            entry.latency.observe(event.seconds)
+            entry.rows += event.rows
+            entry.pages += event.pages
+            entry.errors += event.errors
+            entry.retries += event.retries
+            if event.batch_size:
+                entry.batches += 1
+                entry.batch_rows += event.batch_size
+
+        for hook in self.hooks:
+            # A failing exporter must not fail the query it reports on
+            try:
+                hook(event)
+            except Exception as err:
+                logger.exception(f'Metrics hook raised: {err}')
+
+    def set_gauge(self: PWN, metric_name: str, labels: typing.Dict[str, str], value: float) -> None:
+        with self._lock:
+            self._gauges[(metric_name, tuple(sorted(labels.items())))] = value
+
+    def gauge(self: PWN, metric_name: str, **labels) -> float:
+        return self._gauges.get((metric_name, tuple(sorted(labels.items()))), None)
+
+    def operation(self: PWN, table_name: str, operation: str) -> OperationMetrics:
+        return self._operations.get((table_name, operation), OperationMetrics())
+
+    def as_dict(self: PWN) -> typing.Dict[str, typing.Any]:
+        with self._lock:
+            return {f'{table_name}.{operation}': entry.as_dict() for (table_name, operation), entry in sorted(self._operations.items())}
+
+    def as_prometheus(self: PWN) -> str:
+        """
+        https://prometheus.io/docs/instrumenting/exposition_formats/
+        """
+        lines = [
+            '# TYPE corm_query_seconds histogram',
+        ]
+        counters = {
+            'rows': 'corm_rows_total',
+            'pages': 'corm_pages_total',
+            'batches': 'corm_batches_total',
+            'batch_rows': 'corm_batch_rows_total',
+            'errors': 'corm_errors_total',
+            'retries': 'corm_retries_total',
+        }
+        with self._lock:
+            operations = sorted(self._operations.items())
+            for (table_name, operation), entry in operations:
+                labels = f'table="{table_name}",operation="{operation}"'
+                for bound, count in zip(entry.latency.buckets, entry.latency.cumulative_counts()):
+                    formatted_bound = '+Inf' if bound == float('inf') else f'{bound}'
+                    lines.append(f'corm_query_seconds_bucket{{{labels},le="{formatted_bound}"}} {count}')
+
+                lines.append(f'corm_query_seconds_sum{{{labels}}} {entry.latency.sum}')
+                lines.append(f'corm_query_seconds_count{{{labels}}} {entry.latency.count}')
+
+            for attr_name, metric_name in counters.items():
+                lines.append(f'# TYPE {metric_name} counter')
+                for (table_name, operation), entry in operations:
+                    lines.append(f'{metric_name}{{table="{table_name}",operation="{operation}"}} {getattr(entry, attr_name)}')
+
+            gauge_names = []
+            for (metric_name, labels), value in sorted(self._gauges.items()):
+                if not metric_name in gauge_names:
+                    gauge_names.append(metric_name)
+                    lines.append(f'# TYPE {metric_name} gauge')
+
+                formatted_labels = ','.join([f'{key}="{label}"' for key, label in labels])
+                lines.append(f'{metric_name}{{{formatted_labels}}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self: PWN, filepath: str) -> None:
+        # Written aside and swapped in, so a node_exporter textfile collector never reads half a file
+        tmp_filepath = f'{filepath}.tmp'
+        with open(tmp_filepath, 'w') as stream:
+            stream.write(self.as_prometheus())
+
+        os.replace(tmp_filepath, filepath)
+
+class JSONLogHook:
+    """
+    Appends every QueryEvent as one JSON line
+    """
+    def __init__(self: PWN, filepath: str) -> None:
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        self._stream = open(filepath, 'a')
+
+    def __call__(self: PWN, event: QueryEvent) -> None:
+        line = json.dumps(event.as_dict())
+        with self._lock:
+            self._stream.write(f'{line}\n')
+            self._stream.flush()
+
+    def close(self: PWN) -> None:
+        self._stream.close()
+
+REGISTRY = MetricsRegistry(CORM_METRICS)
+
+def enable_metrics() -> MetricsRegistry:
+    REGISTRY.enabled = True
+    return REGISTRY
+
+def disable_metrics() -> MetricsRegistry:
+    REGISTRY.enabled = False
+    return REGISTRY
+
+def response_details(result: typing.Any) -> typing.Tuple[str, int]:
+    """
+    Coordinator and retry count from a driver ResultSet's ResponseFuture. Results without one, like the
+    memory backend's, report no coordinator
+    """
+    response_future = getattr(result, 'response_future', None)
+    if response_future is None:
+        return None, 0
+
+    coordinator = getattr(response_future, 'coordinator_host', None)
+    attempted_hosts = getattr(response_future, 'attempted_hosts', None) or []
+    # _query_retries is private to the driver and may go away, hence the getattr
+    retries = getattr(response_future, '_query_retries', 0) or max(len(attempted_hosts) - 1, 0)
+    return (str(coordinator) if coordinator else None), retries
+
+def record_query(table_name: str, operation: str, started: float, rows: int = 0, pages: int = 0, batch_size: int = 0,
+        errors: int = 0, result: typing.Any = None) -> None:
+    coordinator, retries = response_details(result)
+    REGISTRY.record(QueryEvent(table_name, operation, time.perf_counter() - started, rows, pages, batch_size,
+        errors, coordinator, retries))
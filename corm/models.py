@@ -1,6 +1,5 @@
 import hashlib
 import typing
-import uuid
 
 import ujson as json
 
@@ -10,8 +9,9 @@ PWN = typing.TypeVar('PWN')
 
 class CORMUDTBase:
     def __init__(self: PWN, *args, **kwargs) -> None:
+        # The driver builds registered UDTs from keyword arguments
         for idx, (name, annotation) in enumerate(self.__annotations__.items()):
-            setattr(self, name, args[idx])
+            setattr(self, name, args[idx] if idx < len(args) else kwargs.get(name, None))
 
 class CORMField:
     def __init__(self: PWN, name: str, annotation: typing.Any) -> None:
@@ -34,18 +34,9 @@ class CORMBase:
                 datum[field_name] = value
 
             else:
-                if issubclass(value.__class__, CORMUDTBase):
-                    datum[field_name] = {}
-                    for udt_idx, udt_field_name in enumerate(value._udt_details.field_names):
-                        udt_transliterator = value._udt_details.field_transliterators[udt_idx]
-                        datum[field_name][udt_field_name] = udt_transliterator.python_to_cql(getattr(value, udt_field_name, None))
-
-                elif isinstance(value, uuid.UUID):
-                    datum[field_name] = str(self._corm_details.field_transliterators[idx].python_to_cql(value))
-
-                else:
-                    datum[field_name] = self._corm_details.field_transliterators[idx].python_to_cql(value)
-
+                # UDTs, uuids and temporal types hash through their compiled python_to_hash
+                transliterator = self._corm_details.field_transliterators[idx]
+                datum[field_name] = (transliterator.python_to_hash or transliterator.python_to_cql)(value)
 
         sorted_datum = ''.join(sorted(json.dumps(datum)))
         return hashlib.sha256(sorted_datum.encode(ENCODING)).hexdigest()
@@ -0,0 +1,156 @@
+import collections
+import threading
+import typing
+
+from corm.constants import PWN
+from corm.datatypes import ConsistencyProfile
+
+from cassandra import ConsistencyLevel
+from cassandra.cluster import ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import RetryPolicy, SpeculativeExecutionPolicy, ConstantSpeculativeExecutionPolicy
+
+# Execution profiles handed to the Cluster when corm creates it, see register_execution_profile
+PROFILES = {}
+# Driver profiles cloned for ConsistencyProfiles
+CONSISTENCY_PROFILES = {}
+
+class PercentileSpeculativeExecutionPolicy(SpeculativeExecutionPolicy):
+    """
+    Sends the next speculative attempt once a request has run longer than the given percentile of recent
+    latencies. Until minimum_samples latencies are observed, initial_delay is used instead
+    """
+    def __init__(self: PWN, percentile: float = 99.0, max_attempts: int = 2, window: int = 1000,
+            initial_delay: float = 0.05, minimum_samples: int = 100) -> None:
+        self.percentile = percentile
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.minimum_samples = minimum_samples
+        self._latencies = collections.deque(maxlen=window)
+        self._sorted = []
+        self._observed = 0
+        self._lock = threading.Lock()
+
+    def observe(self: PWN, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self._observed += 1
+            # Re-sorting the window on every request would cost more than the tail it saves
+            if self._observed % max(len(self._latencies) // 10, 1) == 0:
+                self._sorted = sorted(self._latencies)
+
+    @property
+    def delay(self: PWN) -> float:
+        latencies = self._sorted
+        if len(latencies) < self.minimum_samples:
+            return self.initial_delay
+
+        return latencies[min(int(len(latencies) * self.percentile / 100), len(latencies) - 1)]
+
+    def new_plan(self: PWN, keyspace: str, statement: typing.Any) -> typing.Any:
+        return ConstantSpeculativeExecutionPolicy(self.delay, self.max_attempts).new_plan(keyspace, statement)
+
+class IdempotentRetryPolicy(RetryPolicy):
+    """
+    Also retries write timeouts and request errors on the next host, but only for statements marked
+    idempotent, where a second attempt can't apply the write twice
+    """
+    def __init__(self: PWN, max_retries: int = 1) -> None:
+        self.max_retries = max_retries
+
+    def on_write_timeout(self: PWN, query: typing.Any, consistency: int, write_type: str, required_responses: int,
+            received_responses: int, retry_num: int) -> typing.Tuple[int, int]:
+        if query is not None and query.is_idempotent and retry_num < self.max_retries:
+            return self.RETRY_NEXT_HOST, None
+
+        return super().on_write_timeout(query, consistency, write_type, required_responses, received_responses, retry_num)
+
+    def on_request_error(self: PWN, query: typing.Any, consistency: int, error: Exception, retry_num: int) -> typing.Tuple[int, int]:
+        if query is not None and query.is_idempotent and retry_num < self.max_retries:
+            return self.RETRY_NEXT_HOST, None
+
+        return self.RETHROW, None
+
+def register_execution_profile(name: str, speculative_delay: float = None, speculative_percentile: float = None,
+        speculative_attempts: int = 2, retry_policy: RetryPolicy = None, **profile_kwargs) -> ExecutionProfile:
+    """
+    Registers a driver ExecutionProfile for corm calls to use, by name, through execution_profile= or a
+    model's __execution_profile__. speculative_delay sends another attempt after a constant number of
+    seconds, speculative_percentile after that percentile of observed read latencies. Speculation only
+    applies to idempotent statements. Remaining keyword arguments go to ExecutionProfile. Pass
+    EXEC_PROFILE_DEFAULT as the name to change the profile used when none is given
+    """
+    from corm import CLUSTER
+
+    if speculative_delay is not None and speculative_percentile is not None:
+        raise NotImplementedError('Either speculative_delay or speculative_percentile, not both')
+
+    elif speculative_delay is not None:
+        profile_kwargs['speculative_execution_policy'] = ConstantSpeculativeExecutionPolicy(speculative_delay, speculative_attempts)
+
+    elif speculative_percentile is not None:
+        profile_kwargs['speculative_execution_policy'] = PercentileSpeculativeExecutionPolicy(speculative_percentile, speculative_attempts)
+
+    profile = ExecutionProfile(retry_policy=retry_policy or IdempotentRetryPolicy(), **profile_kwargs)
+    if CLUSTER is not None:
+        if name in PROFILES.keys():
+            raise NotImplementedError(f'ExecutionProfile[{name}] is already in use by the Cluster')
+
+        CLUSTER.add_execution_profile(name, profile)
+
+    PROFILES[name] = profile
+    return profile
+
+def consistency_value(consistency_level: typing.Any) -> int:
+    """
+    Accepts cassandra.ConsistencyLevel values or their names, like 'LOCAL_QUORUM'
+    """
+    if isinstance(consistency_level, str):
+        if not consistency_level.upper() in ConsistencyLevel.name_to_value.keys():
+            raise NotImplementedError(f'Unknown ConsistencyLevel[{consistency_level}]')
+
+        return ConsistencyLevel.name_to_value[consistency_level.upper()]
+
+    elif not consistency_level in ConsistencyLevel.value_to_name.keys():
+        raise NotImplementedError(f'Unknown ConsistencyLevel[{consistency_level}]')
+
+    return consistency_level
+
+def resolve_profile(table: typing.Any, execution_profile: str = None, consistency_level: typing.Any = None,
+        write: bool = False) -> typing.Any:
+    """
+    The profile passed to the call, else the model's __execution_profile__, else the default profile. The
+    consistency level passed to the call, else the model's __write_consistency__ or __read_consistency__,
+    turns it into a ConsistencyProfile
+    """
+    execution_profile = execution_profile or getattr(table, '__execution_profile__', None) or EXEC_PROFILE_DEFAULT
+    if consistency_level is None:
+        consistency_level = getattr(table, '__write_consistency__' if write else '__read_consistency__', None)
+
+    if consistency_level is None:
+        return execution_profile
+
+    return ConsistencyProfile(execution_profile, consistency_value(consistency_level))
+
+def driver_profile(session: typing.Any, execution_profile: typing.Any) -> typing.Any:
+    """
+    What to hand session.execute: profile names as they are, ConsistencyProfiles as a cached clone sharing
+    the named profile's load balancing policy
+    """
+    if not isinstance(execution_profile, ConsistencyProfile):
+        return execution_profile
+
+    profile = CONSISTENCY_PROFILES.get(execution_profile, None)
+    if profile is None:
+        profile = CONSISTENCY_PROFILES[execution_profile] = session.execution_profile_clone_update(
+            execution_profile.execution_profile, consistency_level=execution_profile.consistency_level)
+
+    return profile
+
+def observe_latency(execution_profile: typing.Any, seconds: float) -> None:
+    if isinstance(execution_profile, ConsistencyProfile):
+        execution_profile = execution_profile.execution_profile
+
+    profile = PROFILES.get(execution_profile, None)
+    policy = getattr(profile, 'speculative_execution_policy', None)
+    if isinstance(policy, PercentileSpeculativeExecutionPolicy):
+        policy.observe(seconds)
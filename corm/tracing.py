@@ -0,0 +1,93 @@
+import logging
+import random
+import threading
+import typing
+
+import ujson as json
+
+from corm.constants import PWN, CORM_TRACE_SAMPLE_RATE, CORM_SLOW_QUERY_SECONDS, CORM_SLOW_QUERY_LOG
+
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for system_traces to be written once a slow traced query has returned
+TRACE_MAX_WAIT = 2.0
+
+def should_trace(trace: bool = None) -> bool:
+    """
+    An explicit trace flag wins, otherwise the query is sampled at CORM_TRACE_SAMPLE_RATE
+    """
+    if trace is not None:
+        return trace
+
+    if CORM_TRACE_SAMPLE_RATE <= 0:
+        return False
+
+    return random.random() < CORM_TRACE_SAMPLE_RATE
+
+def _trace_details(response_future: typing.Any) -> typing.Dict[str, typing.Any]:
+    try:
+        trace = response_future.get_query_trace(max_wait=TRACE_MAX_WAIT)
+    except Exception as err:
+        logger.debug(f'Unable to fetch query trace: {err}')
+        return None
+
+    if trace is None:
+        return None
+
+    return {
+        'trace_id': str(trace.trace_id),
+        'request_type': trace.request_type,
+        'coordinator': str(trace.coordinator),
+        'duration_us': trace.duration.total_seconds() * 1e6 if trace.duration else None,
+        'parameters': {key: str(value) for key, value in (trace.parameters or {}).items()},
+        'events': [{
+            'description': event.description,
+            'source': str(event.source),
+            'source_elapsed_us': event.source_elapsed.total_seconds() * 1e6 if event.source_elapsed else None,
+            'thread_name': event.thread_name,
+        } for event in trace.events or []],
+    }
+
+class SlowQueryLog:
+    """
+    Writes one JSON line per query slower than threshold seconds, with the coordinator and, when the query
+    was executed with tracing, the server side trace events. Without a filepath entries go to the logger
+    """
+    def __init__(self: PWN, threshold: float = CORM_SLOW_QUERY_SECONDS, filepath: str = CORM_SLOW_QUERY_LOG) -> None:
+        self.threshold = threshold
+        self.filepath = filepath
+        self._lock = threading.Lock()
+
+    def capture(self: PWN, table_name: str, operation: str, seconds: float, result: typing.Any = None,
+            traced: bool = False) -> typing.Dict[str, typing.Any]:
+        if seconds < self.threshold:
+            return None
+
+        response_future = getattr(result, 'response_future', None)
+        statement = getattr(response_future, 'query', None)
+        coordinator = getattr(response_future, 'coordinator_host', None)
+        entry = {
+            'created': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'table_name': table_name,
+            'operation': operation,
+            'seconds': seconds,
+            'query': getattr(statement, 'query_string', None),
+            'coordinator': str(coordinator) if coordinator else None,
+            'trace': _trace_details(response_future) if traced and response_future else None,
+        }
+        self.write(entry)
+        return entry
+
+    def write(self: PWN, entry: typing.Dict[str, typing.Any]) -> None:
+        line = json.dumps(entry)
+        if self.filepath is None:
+            logger.warning(f'Slow Query: {line}')
+            return None
+
+        with self._lock:
+            with open(self.filepath, 'a') as stream:
+                stream.write(f'{line}\n')
+
+SLOW_QUERY_LOG = SlowQueryLog()
@@ -1,6 +1,24 @@
-import random
+import os
 import string
+import typing
+
+from corm.constants import MIN_TOKEN, MAX_TOKEN
+from corm.datatypes import TokenRange
+
+ASCII_POOL = string.ascii_letters + string.digits + string.punctuation
+# Maps every random byte onto the pool, so strings come from one os.urandom call instead of a choice per character
+ASCII_TRANSLATION = bytes([ord(ASCII_POOL[idx % len(ASCII_POOL)]) for idx in range(0, 256)])
 
 def generate_string(str_length: int) -> str:
-    ascii_pool = string.ascii_letters + string.digits + string.punctuation
-    return ''.join([random.choice(ascii_pool) for idx in range(0, str_length)])
+    return os.urandom(str_length).translate(ASCII_TRANSLATION).decode('ascii')
+
+def generate_strings(count: int, str_length: int) -> typing.List[str]:
+    pool = os.urandom(count * str_length).translate(ASCII_TRANSLATION).decode('ascii')
+    return [pool[idx:idx + str_length] for idx in range(0, count * str_length, str_length)]
+
+def split_token_ring(count: int) -> typing.List[TokenRange]:
+    count = max(1, count)
+    step = (MAX_TOKEN - MIN_TOKEN) // count
+    bounds = [MIN_TOKEN + step * idx for idx in range(0, count)]
+    bounds.append(MAX_TOKEN)
+    return [TokenRange(bounds[idx], bounds[idx + 1]) for idx in range(0, count)]
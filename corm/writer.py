@@ -0,0 +1,195 @@
+import logging
+import queue
+import threading
+import time
+import types
+import typing
+
+from corm.constants import PWN, CORM_WRITER_MAX_PENDING, CORM_WRITER_FLUSH_ROWS, CORM_WRITER_FLUSH_SECONDS
+from corm.models import CORMBase
+
+from cassandra.query import UNSET_VALUE
+
+logger = logging.getLogger(__name__)
+
+class Writer:
+    """
+    Write-behind buffer: put() returns as soon as the object is queued and a background thread writes it.
+    Writes to the same primary key coalesce into one row, and a flush goes out per table as concurrent
+    prepared inserts, ordered by partition, once flush_rows rows are pending or flush_seconds have passed.
+
+    At most max_pending rows are held, queued or in flight. put() blocks while the writer is full and
+    raises queue.Full once timeout expires. Failed rows are passed to on_failure(corm_object, error)
+    """
+    def __init__(self: PWN, max_pending: int = CORM_WRITER_MAX_PENDING, flush_rows: int = CORM_WRITER_FLUSH_ROWS,
+            flush_seconds: float = CORM_WRITER_FLUSH_SECONDS, concurrency: int = 100, write_nulls: bool = False,
+            on_failure: types.FunctionType = None) -> None:
+        if flush_rows > max_pending:
+            raise NotImplementedError(f'FlushRows[{flush_rows}] larger than MaxPending[{max_pending}]')
+
+        self.max_pending = max_pending
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.concurrency = concurrency
+        self.write_nulls = write_nulls
+        self.on_failure = on_failure
+        self.written = 0
+        self.failures = 0
+        self._tables = {}
+        self._pending = 0
+        self._in_flight = 0
+        self._queued = 0
+        self._done = 0
+        self._flush_requested = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='corm-writer', daemon=True)
+        self._thread.start()
+
+    def __enter__(self: PWN) -> PWN:
+        return self
+
+    def __exit__(self: PWN, *args) -> None:
+        self.close()
+
+    def _row_key(self: PWN, corm_object: CORMBase, values: typing.List[typing.Any]) -> typing.Tuple[typing.Any]:
+        table = corm_object._corm_details
+        field_names = table.field_names + ['guid']
+        return tuple([values[field_names.index(key)] for key in table.primary_keys])
+
+    def put(self: PWN, corm_object: CORMBase, timeout: float = None) -> None:
+        from corm import _bind_values
+
+        values = _bind_values([corm_object], self.write_nulls)[0]
+        key = self._row_key(corm_object, values)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            if self._closed:
+                raise Exception('Writer is closed')
+
+            rows = self._tables.setdefault(corm_object.__class__, {})
+            existing = rows.get(key, None)
+            if existing is None:
+                while self._pending + self._in_flight >= self.max_pending:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Full(f'Writer holds MaxPending[{self.max_pending}] rows')
+
+                    self._condition.wait(remaining)
+                    if self._closed:
+                        raise Exception('Writer is closed')
+
+                # The table may have been swapped out for a flush while waiting
+                rows = self._tables.setdefault(corm_object.__class__, {})
+                existing = rows.get(key, None)
+
+            if existing is None:
+                rows[key] = (corm_object, values)
+                self._pending += 1
+
+            else:
+                # Later writes win, columns they leave unset keep the earlier value
+                merged = [existing_value if value is UNSET_VALUE else value for existing_value, value in zip(existing[1], values)]
+                rows[key] = (corm_object, merged)
+
+            self._queued += 1
+            if self._pending >= self.flush_rows:
+                self._condition.notify_all()
+
+    def flush(self: PWN, timeout: float = None) -> bool:
+        """
+        Blocks until everything put before the call has been written, or failed. Returns False on timeout
+        """
+        with self._condition:
+            target = self._queued
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._done >= target, timeout)
+
+    def close(self: PWN, timeout: float = None) -> bool:
+        """
+        Stops accepting writes, flushes what is pending and stops the background thread
+        """
+        with self._condition:
+            if self._closed:
+                return True
+
+            self._closed = True
+            self._condition.notify_all()
+
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _take(self: PWN) -> typing.Tuple[typing.Dict[typing.Any, typing.Dict[typing.Tuple[typing.Any], typing.Any]], int]:
+        deadline = time.monotonic() + self.flush_seconds
+        with self._condition:
+            while not (self._closed or self._flush_requested or self._pending >= self.flush_rows):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                self._condition.wait(remaining)
+
+            tables, self._tables = self._tables, {}
+            self._in_flight, self._pending = self._pending, 0
+            self._flush_requested = False
+            return tables, self._queued
+
+    def _run(self: PWN) -> None:
+        while True:
+            tables, queued = self._take()
+            try:
+                for table, rows in tables.items():
+                    try:
+                        self._write(table, [entry for entry in rows.values()])
+                    except Exception as err:
+                        # The thread has to survive, or flush() and a full put() would wait on it forever
+                        logger.exception(f'Writer failed on Table[{table.__name__}]: {err}')
+
+            finally:
+                with self._condition:
+                    self._in_flight = 0
+                    self._done = queued
+                    closed = self._closed and not self._tables
+                    self._condition.notify_all()
+
+            if closed:
+                return None
+
+    def _write(self: PWN, table: CORMBase, entries: typing.List[typing.Tuple[CORMBase, typing.List[typing.Any]]]) -> None:
+        from corm import obtain_backend, _observe_query
+        from corm.profiles import resolve_profile
+
+        details = table._corm_details
+        field_names = details.field_names + ['guid']
+        partition_indexes = [field_names.index(key) for key in details.partition_keys]
+        started = time.perf_counter()
+        try:
+            # Rows of the same partition go out next to each other
+            entries.sort(key=lambda entry: [str(entry[1][idx]) for idx in partition_indexes])
+            results = obtain_backend().insert_concurrent(details, [values for corm_object, values in entries], self.concurrency,
+                resolve_profile(table, write=True))
+        except Exception as err:
+            results = [(False, err) for entry in entries]
+
+        errors = 0
+        for (corm_object, values), (success, result) in zip(entries, results):
+            if success:
+                continue
+
+            errors += 1
+            if self.on_failure is None:
+                logger.error(f'Write failed for Table[{details.table_name}]: {result}')
+                continue
+
+            try:
+                self.on_failure(corm_object, result)
+            except Exception as err:
+                logger.exception(f'Writer on_failure raised: {err}')
+
+        self.written += len(entries) - errors
+        self.failures += errors
+        try:
+            _observe_query(details.table_name, 'insert.writer', started, rows=len(entries) - errors, errors=errors)
+        except Exception as err:
+            logger.exception(f'Writer metrics for Table[{details.table_name}] raised: {err}')
@@ -56,6 +56,7 @@ setup(
     entry_points={
         'console_scripts': [
             'corm-etl = corm.etl.factory:run_from_cli',
+            'corm-bench = corm.bench:run_from_cli',
         ],
     },
     zip_safe=False,